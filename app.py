@@ -12,26 +12,52 @@
 import os
 import sys
 import json
+import time
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from slack_sdk import WebClient
 
-from functions.covid19 import getCountryInfo, getCountries, translateCountryName
+from functions.covid19 import getCountryInfo, getCountries, translateCountryName, getContinentCountries, Covid19Context
 from functions.covid19_comment import commentModalView, commentInsert
-from functions.covid19_csv import csvGenerateFile
-from functions.covid19_chart import chartMonthlyConfiguration, chartWeeklyConfiguration
-from functions.covid19_pdf import pdfGenerateFile
-from functions.current_time import currentTime, currentHour
+from functions.covid19_chart import chartWeeklyConfiguration, chartCompareConfiguration
+from functions.covid19_pdf import pdfGenerateBatch
+from functions.covid19_export import exportFormats
+from functions.covid19_pipeline import REPORT_PIPELINE, REPORT_JOBS, pipelineFailureMessage
+from functions.covid19_pipeline import DUPLICATE_GUARD, USER_RATE_LIMIT, TEAM_RATE_LIMIT
+from functions.current_time import currentTime, currentHour, uniqueTimeStamp
+from functions.cache import cacheStartSnapshots
+from functions.shutdown import shutdownInstall, cleanTemporaryFiles, TEMP_MAX_AGE
+from functions.metrics import metricsListener, metricsStartServer, RENDER_SECONDS, UPLOAD_SECONDS, JOB_SECONDS, JOB_WAIT_SECONDS
+from functions.tracing import traceSpan, KIND_CLIENT
+from functions.profiling import profileSection, profileArm, profileDisarm, profileStatus, PROFILE_COUNT, PROFILE_FOLDER
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# 起動モード socket: ソケットモード http: HTTPモード（Request URLでイベントを受け取る）
+slack_mode = os.environ.get('SLACK_MODE', 'socket')
+
+# Slack Web APIのURL（負荷試験ではbench/load.pyのスタブを指定する）
+slack_api_url = os.environ.get('SLACK_API_URL')
+
 # Botトークンからアプリの初期化
 app = None
 bot_token = os.environ.get('SLACK_BOT_TOKEN')
 if (bot_token == None):
     print("[環境変数未設定] SLACK_BOT_TOKEN")
 else:
-    app = App(token=bot_token)
+    options = {'token': bot_token}
+    if slack_api_url != None:
+        options = {'client': WebClient(token=bot_token, base_url=slack_api_url)}
+    if slack_mode == 'http':
+        # HTTPモードではリクエストの署名を検証する
+        signing_secret = os.environ.get('SLACK_SIGNING_SECRET')
+        if (signing_secret == None):
+            print("[環境変数未設定] SLACK_SIGNING_SECRET")
+        else:
+            app = App(signing_secret=signing_secret, **options)
+    else:
+        app = App(**options)
 
 if app == None:
     print('⚡️Boltアプリは起動できません')
@@ -42,6 +68,9 @@ local_folder = os.environ.get("LOCAL_FOLDER")
 if (bot_token == None):
     print("[環境変数未設定] LOCAL_FOLDER")
 
+# /covid19 profile を実行できる利用者ID（カンマ区切り）
+profile_admins = [u.strip() for u in os.environ.get('PROFILE_ADMINS', '').split(',') if u.strip() != '']
+
 pyEnv=os.environ.get('PY_ENV')
 if pyEnv == 'development':
   print("開発モードで起動します")
@@ -69,6 +98,7 @@ print("現在の時刻", datetime)
 #  イベントがトリガーされたチャンネルに say() でメッセージを送信する
 #
 @app.message("hello")
+@metricsListener('message:hello')
 def message_hello(message, say):
     # messageの内容を確認する
     if pyEnv == 'development':
@@ -84,6 +114,7 @@ def message_hello(message, say):
 #   Unhandled request ({'type': 'event_callback', 'event': {'type': 'message', 'subtype': 'file_share'}})
 #
 @app.event("message")
+@metricsListener('event:message')
 def handle_message_events(body, logger):
     logger.info(body)
 
@@ -109,6 +140,7 @@ def handle_message_events(body, logger):
 #    その後に今週の感染状況を折れ線グラフで表示する
 # 
 @app.command("/hello")
+@metricsListener('/hello')
 def command_hello(ack, command, respond):
     # 予め返信しておく
     ack()
@@ -130,18 +162,37 @@ def command_hello(ack, command, respond):
 
     # 現在のSlackチャネルIDを取得する
     channel = command['channel_id']
+    # 画像ファイルの生成とアップロードはジョブとして実行する
+    submit_job('chart', command_request(command), respond, None, upload_weekly_chart, channel, respond)
+
+#
+# [FUNCTION] upload_weekly_chart()
+#
+# [DESCRIPTION]
+#  今週の感染状況の折れ線グラフを作成し、Slackにアップロードする
+# 
+# [INPUTS]
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+# 
+# [OUTPUTS]
+#  respond - 失敗したときのメッセージ
+# 
+def upload_weekly_chart(channel, respond):
     # 画像ファイルを生成し、アップロードする
-    file_name = "simple-graph.png"
+    file_name = "simple-graph-" + uniqueTimeStamp() + ".png"
     file_path = local_folder + "/" + file_name
     try:
-        status = chartWeeklyConfiguration(file_path)
+        with traceSpan('render chart_weekly'), RENDER_SECONDS.time('chart_weekly'):
+            status = chartWeeklyConfiguration(file_path)
         if status == True:
-            result = app.client.files_upload_v2(
-                channel=channel, # Current Channel ID
-                #title="Generated PNG File",
-                file=file_path,
-                initial_comment="画像ファイルを添付します",
-            )
+            with traceSpan('upload chart_weekly', KIND_CLIENT), UPLOAD_SECONDS.time('chart_weekly'):
+                result = app.client.files_upload_v2(
+                    channel=channel, # Current Channel ID
+                    #title="Generated PNG File",
+                    file=file_path,
+                    initial_comment="画像ファイルを添付します",
+                )
             os.remove(file_path)
             if pyEnv == 'development':
                 print(result)
@@ -159,8 +210,15 @@ def command_hello(ack, command, respond):
 #  指定した国（英語名）の一年の感染者実数と感染者予測結果をグラフで表現する
 #
 # [NOTES]
+#  /covid19 compare <国名>,<国名>,... のとき、複数の国の感染状況を比較するグラフを表示する
+#  /covid19 report <国名>,<国名>,... あるいは /covid19 report continent:<大陸名> のとき、
+#  複数の国のレポートを一つのPDFファイルとして出力する
+#  /covid19 export <形式> <国名> のとき、全期間の履歴を指定した形式のファイルとして出力する
+#  /covid19 export-all <形式 オプション> のとき、全ての国の全期間の履歴を一つのZIPファイルとして出力する
+#  /covid19 profile <リスナー名> <回数 オプション> のとき、指定したリスナーの処理をプロファイルする（管理者のみ）
 #
 @app.command("/covid19")
+@metricsListener('/covid19')
 def command_covid19(ack, command, respond):
     # 予め返信しておく
     ack()
@@ -170,6 +228,24 @@ def command_covid19(ack, command, respond):
     # 対象とする国名を引数から取得する
     country = command['text']
 
+    # サブコマンドを処理する
+    args = country.split(None, 1)
+    if len(args) > 0 and args[0] == 'compare':
+        subcommand_compare(args[1] if len(args) > 1 else '', command['channel_id'], respond, command_request(command))
+        return
+    if len(args) > 0 and args[0] == 'report':
+        subcommand_report(args[1] if len(args) > 1 else '', command['channel_id'], respond, command_request(command))
+        return
+    if len(args) > 0 and args[0] == 'export':
+        subcommand_export(args[1] if len(args) > 1 else '', command['channel_id'], respond, command_request(command))
+        return
+    if len(args) > 0 and args[0] == 'export-all':
+        subcommand_export_all(args[1] if len(args) > 1 else '', command['channel_id'], respond, command_request(command))
+        return
+    if len(args) > 0 and args[0] == 'profile':
+        subcommand_profile(args[1] if len(args) > 1 else '', command['channel_id'], respond, command_request(command))
+        return
+
     result = None
   # 引数が指定されていなければ、選択メニューから国名を選択する
     if country == '':
@@ -183,6 +259,246 @@ def command_covid19(ack, command, respond):
     # コマンドに返答する
     respond(result)
 
+#
+# [SUBCOMMAND] /covid19 compare
+#
+# [DESCRIPTION]
+#  複数の国の人口10万人あたりの新規感染者数を一つのグラフに重ねて表示する
+# 
+# [INPUTS]
+#  text - 対象となる国名。カンマ区切り（カンマがなければ空白区切り）
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+#  request - 重複と実行回数を判定するための操作の情報（command_request()参照）
+# 
+# [OUTPUTS]
+#  respond - グラフを作成したか失敗したかのメッセージ
+# 
+def subcommand_compare(text, channel, respond, request):
+    countries = parse_countries(text)
+    if len(countries) < 2:
+        respond('比較する国名を2つ以上指定してください (例: /covid19 compare Japan,USA)')
+        return
+
+    # 画像ファイルの生成とアップロードはジョブとして実行する
+    submit_job('chart', request, respond, '比較グラフを作成中です...', upload_compare_chart, countries, channel, respond)
+
+#
+# [FUNCTION] upload_compare_chart()
+#
+# [DESCRIPTION]
+#  複数の国の比較グラフを作成し、Slackにアップロードする
+# 
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+# 
+# [OUTPUTS]
+#  respond - 失敗したときのメッセージ
+# 
+def upload_compare_chart(countries, channel, respond):
+    # 画像ファイルを生成し、アップロードする
+    file_name = "compare-" + uniqueTimeStamp() + ".png"
+    file_path = local_folder + "/" + file_name
+    try:
+        with traceSpan('render chart_compare'), RENDER_SECONDS.time('chart_compare'):
+            names = chartCompareConfiguration(countries, file_path)
+        if names != None:
+            with traceSpan('upload chart_compare', KIND_CLIENT), UPLOAD_SECONDS.time('chart_compare'):
+                result = app.client.files_upload_v2(
+                    channel=channel, # Current Channel ID
+                    file=file_path,
+                    initial_comment="比較グラフを添付します (" + ", ".join(names) + ")",
+                )
+            os.remove(file_path)
+            if pyEnv == 'development':
+                print(result)
+        else:
+            respond(f'画像ファイルは作成できませんでした。')
+    except Exception as e:
+        print(format(e))
+        respond(f'エラーが発生しました。')
+
+#
+# [SUBCOMMAND] /covid19 report
+#
+# [DESCRIPTION]
+#  複数の国の感染状況を目次付きの一つのPDFファイルとして出力する
+# 
+# [INPUTS]
+#  text - 対象となる国名（カンマ区切り）あるいは continent:<大陸名>
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+#  request - 重複と実行回数を判定するための操作の情報（command_request()参照）
+# 
+# [OUTPUTS]
+#  respond - ファイルアップロードに成功したか失敗したかのメッセージ
+# 
+def subcommand_report(text, channel, respond, request):
+    if text.startswith('continent:'):
+        countries = getContinentCountries(text[len('continent:'):].strip())
+        if countries == None:
+            respond(text + 'の国名は見つかりませんでした')
+            return
+    else:
+        countries = parse_countries(text)
+    if len(countries) == 0:
+        respond('国名を指定してください (例: /covid19 report Japan,USA または /covid19 report continent:Asia)')
+        return
+
+    # PDFファイルの生成とアップロードはジョブとして実行する
+    message = str(len(countries)) + 'ヶ国のレポートを作成中です...'
+    submit_job('batch', request, respond, message, upload_batch_report, countries, channel, respond)
+
+#
+# [FUNCTION] upload_batch_report()
+#
+# [DESCRIPTION]
+#  複数の国の感染状況をまとめたPDFファイルを作成し、Slackにアップロードする
+# 
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+# 
+# [OUTPUTS]
+#  respond - 失敗したときのメッセージ
+# 
+def upload_batch_report(countries, channel, respond):
+    try:
+        now = currentTime()
+        with traceSpan('render pdf_batch'), RENDER_SECONDS.time('pdf_batch'):
+            pdf_file = pdfGenerateBatch(now, countries)
+        if pdf_file != None:
+            with traceSpan('upload pdf_batch', KIND_CLIENT), UPLOAD_SECONDS.time('pdf_batch'):
+                result = app.client.files_upload_v2(
+                    channel=channel, # Current Channel ID
+                    file=pdf_file,
+                    initial_comment="PDFファイルを添付します",
+                )
+            os.remove(pdf_file)
+            if pyEnv == 'development':
+                print(result)
+        else:
+            respond(f'PDFファイルは作成できませんでした。')
+    except Exception as e:
+        print(format(e))
+        respond(f'エラーが発生しました。')
+
+#
+# [SUBCOMMAND] /covid19 export
+#
+# [DESCRIPTION]
+#  指定した国の全期間の履歴をCSV、Parquet、Arrow IPC、NumPy npzのいずれかの形式で出力する
+# 
+# [INPUTS]
+#  text - <形式> <国名>
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+#  request - 重複と実行回数を判定するための操作の情報（command_request()参照）
+# 
+# [OUTPUTS]
+#  respond - ファイルアップロードに成功したか失敗したかのメッセージ
+# 
+def subcommand_export(text, channel, respond, request):
+    formats = exportFormats()
+    args = text.split(None, 1)
+    if len(args) < 2 or args[0].lower() not in formats:
+        respond('形式と国名を指定してください (例: /covid19 export parquet Japan)\n利用できる形式: ' + ", ".join(formats))
+        return
+
+    # ファイルを生成してアップロードする
+    inputs = {'export_format': args[0].lower()}
+    submit_job('export', request, respond, 'ファイルを作成中です...', run_report_pipeline, ['upload_export'], args[1].strip(), channel, respond, inputs)
+
+#
+# [SUBCOMMAND] /covid19 export-all
+#
+# [DESCRIPTION]
+#  全ての国の全期間の履歴を一国一ファイルとして一つのZIPファイルにまとめて出力する
+# 
+# [INPUTS]
+#  text - 各ファイルの形式（省略時はcsv）
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+#  request - 重複と実行回数を判定するための操作の情報（command_request()参照）
+# 
+# [OUTPUTS]
+#  respond - ファイルアップロードに成功したか失敗したかのメッセージ
+# 
+def subcommand_export_all(text, channel, respond, request):
+    formats = exportFormats()
+    export_format = text.strip().lower()
+    if export_format == '':
+        export_format = 'csv'
+    if export_format not in formats:
+        respond('利用できる形式: ' + ", ".join(formats) + ' (例: /covid19 export-all parquet)')
+        return
+
+    # ZIPファイルを生成してアップロードする
+    inputs = {'export_format': export_format}
+    submit_job('batch', request, respond, '全ての国の履歴を作成中です...', run_report_pipeline, ['upload_export_all'], 'all', channel, respond, inputs)
+
+#
+# [SUBCOMMAND] /covid19 profile
+#
+# [DESCRIPTION]
+#  指定したリスナーの次の呼び出しをプロファイルし、結果をPROFILE_FOLDERに保存する
+#  環境変数PROFILE_ADMINSに含まれる利用者だけが実行できる
+# 
+# [INPUTS]
+#  text - <リスナー名（/covid19、action-report-historyなど、*は全て）> <回数>、off、あるいは空文字列（状態を表示する）
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+#  request - 操作の情報（command_request()参照）
+# 
+# [OUTPUTS]
+#  respond - プロファイルの状態
+# 
+# [NOTES]
+#  gunicornで複数のワーカーを起動したときは、このコマンドを受け取ったワーカーだけが対象となる
+#
+def subcommand_profile(text, channel, respond, request):
+    if request[1] not in profile_admins:
+        respond('このコマンドは管理者だけが実行できます')
+        return
+
+    args = text.split()
+    if len(args) > 0 and args[0] == 'off':
+        profileDisarm()
+    elif len(args) > 0:
+        if len(args) > 1 and not args[1].isdigit():
+            respond('回数を数字で指定してください (例: /covid19 profile action-report-history 5)')
+            return
+        profileArm(args[0], int(args[1]) if len(args) > 1 else PROFILE_COUNT)
+
+    status = profileStatus()
+    if len(status) == 0:
+        respond('プロファイルしていません')
+    else:
+        items = [name + ': 残り' + str(count) + '回' for name, count in sorted(status.items())]
+        respond('プロファイル中 (' + ', '.join(items) + ')\n結果の保存先: ' + PROFILE_FOLDER)
+
+#
+# [FUNCTION] parse_countries()
+#
+# [DESCRIPTION]
+#  サブコマンドの引数を国名のリストに変換する
+# 
+# [INPUTS]
+#  text - カンマ区切り（カンマがなければ空白区切り）の国名
+# 
+# [OUTPUTS]
+#  国名のリスト
+# 
+def parse_countries(text):
+    if ',' in text:
+        items = text.split(',')
+    else:
+        items = text.split()
+    return [item.strip() for item in items if item.strip() != '']
+
 #
 # [SLASH COMMAND] /translate
 #
@@ -196,6 +512,7 @@ def command_covid19(ack, command, respond):
 #  respond - JSON構造: {blocks:[<見出し>,<セクション>]}
 # 
 @app.command("/translate")
+@metricsListener('/translate')
 def command_translatge(ack, respond, command):
     # 予め返信しておく
     ack()
@@ -238,6 +555,7 @@ def command_translatge(ack, respond, command):
 #  respond - JSON構造: {blocks:[<見出し>,<セクション>]}
 #
 @app.action("action-comment")
+@metricsListener('action-comment')
 def action_comment(body, ack, client):
     # 予め返信しておく
     ack()
@@ -270,6 +588,7 @@ def action_comment(body, ack, client):
 #  respond - ファイルアップロードに成功したか失敗したかのメッセージ
 # 
 @app.action('action-csv-generate')
+@metricsListener('action-csv-generate')
 def action_csv_generate(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -277,38 +596,37 @@ def action_csv_generate(body, ack, respond):
     country = body['actions'][0]['value']
     # SlackチャネルIDを取得する
     channel = body['channel']['id']
-    respond('ファイルを作成中です...')
 
-    # 国名を選択するメニューを構成する
-    result = getCountryInfo(country)
-    if pyEnv == 'development':
-        print(result)
-    respond(result)
-
-    # CSVファイルを生成する
-    csv_file = csvGenerateFile(country)
-    message = ''
-    if csv_file != None:
-        try:
-            result = app.client.files_upload_v2(
-                channel=channel, # Current Channel ID
-                #title="Generated CSV File",
-                file=csv_file,
-                initial_comment="CSVファイルを添付します",
-            )
-            os.remove(csv_file)
-            if pyEnv == 'development':
-                print(result)
-        except Exception as e:
-            print(format(e))
-            message = 'ファイルをアップロードできません。'
-    else:
-        message = 'ファイルを作成できません。'
+    # 感染状況を返答し、CSVファイルを生成してアップロードする
+    submit_job('export', action_request(body), respond, 'ファイルを作成中です...', run_report_pipeline, ['show_card', 'upload_csv'], country, channel, respond)
 
-    # エラーメッセージがあれば返答する
-    if message != '':
-        respond(message)
+#
+# [ACTION METHOD] action-export-generate
+#
+# [DESCRIPTION]
+#  対象とする国の感染状況を選択した形式のファイルに書き込んだ後、ファイルをSlackにアップロードする
+#  「CSV出力」の隣の「出力形式」メニューから起動される
+# 
+# [INPUTS]
+#  body.actions[0].selected_option.value - <形式>:<国名>
+#  body.channel.id - 現在のSlackチャネルID
+# 
+# [OUTPUTS]
+#  respond - ファイルアップロードに成功したか失敗したかのメッセージ
+# 
+@app.action('action-export-generate')
+@metricsListener('action-export-generate')
+def action_export_generate(body, ack, respond):
+    # 予め返信しておく
+    ack()
+    # 出力形式と対象とする国名
+    export_format, country = body['actions'][0]['selected_option']['value'].split(':', 1)
+    # SlackチャネルIDを取得する
+    channel = body['channel']['id']
 
+    # 感染状況を返答し、ファイルを生成してアップロードする
+    inputs = {'export_format': export_format}
+    submit_job('export', action_request(body), respond, 'ファイルを作成中です...', run_report_pipeline, ['show_card', 'upload_export'], country, channel, respond, inputs)
 
 #
 # [ACTION METHOD] action-get-countries
@@ -323,6 +641,7 @@ def action_csv_generate(body, ack, respond):
 #  respond - JSON構造: {blocks:[<見出し>,<セクション>]}
 #
 @app.action('action-get-countries')
+@metricsListener('action-get-countries')
 def action_get_countries(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -350,6 +669,7 @@ def action_get_countries(body, ack, respond):
 #  respond - JSON構造: {blocks:[<見出し>,<セクション>]}
 #
 @app.action('action-get-info')
+@metricsListener('action-get-info')
 def action_get_info(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -377,6 +697,7 @@ def action_get_info(body, ack, respond):
 #  respond - JSON構造: {blocks:[<見出し>,<セクション>]}
 #
 @app.action('action-get-info-all')
+@metricsListener('action-get-info-all')
 def action_get_info_all(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -404,6 +725,7 @@ def action_get_info_all(body, ack, respond):
 #  respond - getCountryInfo()からのJSON構造（国名選択に戻る）
 # 
 @app.action('action-graph-history')
+@metricsListener('action-graph-history')
 def action_graph_history(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -411,34 +733,35 @@ def action_graph_history(body, ack, respond):
     country = body['actions'][0]['value']
     # 現在のSlackチャネルIDを取得する
     channel = body['channel']['id']
-    respond('グラフを作成中です...')
 
-    # 国名を選択するメニューを構成する
-    result = getCountryInfo(country)
-    if pyEnv == 'development':
-        print(result)
-    respond(result)
+    # 感染状況を返答し、画像ファイルを生成してアップロードする
+    submit_job('chart', action_request(body), respond, 'グラフを作成中です...', run_report_pipeline, ['show_card', 'upload_chart_monthly'], country, channel, respond)
 
-    # 画像ファイルを生成し、アップロードする
-    file_name = country + ".png"
-    file_path = local_folder + "/" + file_name
-    try:
-        status = chartMonthlyConfiguration(country, file_path)
-        if status == True:
-            result = app.client.files_upload_v2(
-                channel=channel, # Current Channel ID
-                #title="Generated PNG File",
-                file=file_path,
-                initial_comment="画像ファイルを添付します",
-            )
-            os.remove(file_path)
-            if pyEnv == 'development':
-                print(result)
-        else:
-            respond(f'画像ファイルは作成できませんでした。')
-    except Exception as e:
-        print(format(e))
-        respond(f'エラーが発生しました。')
+#
+# [ACTION METHOD] action-graph-history-all
+#
+# [DESCRIPTION]
+#  全期間の新型コロナウィルス新規感染者数と死亡者数を折れ線グラフで表示する画像を作成する
+# 
+# [INPUTS]
+#  body.actions[0].value - 選択した国名
+#  body.channel.id - 現在のSlackチャネルID
+# 
+# [OUTPUTS]
+#  respond - getCountryInfo()からのJSON構造（国名選択に戻る）
+# 
+@app.action('action-graph-history-all')
+@metricsListener('action-graph-history-all')
+def action_graph_history_all(body, ack, respond):
+    # 予め返信しておく
+    ack()
+    # 選択した国名
+    country = body['actions'][0]['value']
+    # 現在のSlackチャネルIDを取得する
+    channel = body['channel']['id']
+
+    # 感染状況を返答し、画像ファイルを生成してアップロードする
+    submit_job('chart', action_request(body), respond, 'グラフを作成中です...', run_report_pipeline, ['show_card', 'upload_chart_full'], country, channel, respond)
 
 #
 # [ACTION METHOD] action-report-history
@@ -454,6 +777,7 @@ def action_graph_history(body, ack, respond):
 #  respond - getCountryInfo()からのJSON構造（国名選択に戻る）
 # 
 @app.action('action-report-history')
+@metricsListener('action-report-history')
 def action_report_history(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -461,38 +785,175 @@ def action_report_history(body, ack, respond):
     country = body['actions'][0]['value']
     # 現在のSlackチャネルIDを取得する
     channel = body['channel']['id']
-    respond('レポートを作成中です...')
 
-    # 国名を選択するメニューを構成する
-    result = getCountryInfo(country)
+    # 感染状況を返答し、画像ファイルとPDFファイルを生成してアップロードする
+    submit_job('report', action_request(body), respond, 'レポートを作成中です...', run_report_pipeline, ['show_card', 'upload_pdf'], country, channel, respond)
+
+#
+# [ACTION METHOD] action-report-bundle
+#
+# [DESCRIPTION]
+#  30日間のグラフ、PDFレポート、全期間のCSVファイルを作成し、一回のアップロードでまとめて添付する
+#  「一括出力」ボタンから起動される
+# 
+# [INPUTS]
+#  body.actions[0].value - 選択した国名
+#  body.channel.id - 現在のSlackチャネルID
+# 
+# [OUTPUTS]
+#  respond - getCountryInfo()からのJSON構造（国名選択に戻る）
+# 
+# [NOTES]
+#  グラフ、PDF、CSVは一回取得した全期間の履歴を共有する
+#
+@app.action('action-report-bundle')
+@metricsListener('action-report-bundle')
+def action_report_bundle(body, ack, respond):
+    # 予め返信しておく
+    ack()
+    # 選択した国名
+    country = body['actions'][0]['value']
+    # 現在のSlackチャネルIDを取得する
+    channel = body['channel']['id']
+
+    # 感染状況を返答し、画像、PDF、CSVファイルを生成してまとめてアップロードする
+    inputs = {'context': Covid19Context(country, share_history=True)}
+    submit_job('report', action_request(body), respond, 'ファイルを作成中です...', run_report_pipeline, ['show_card', 'upload_bundle'], country, channel, respond, inputs)
+
+#
+# [FUNCTION] run_report_pipeline()
+#
+# [DESCRIPTION]
+#  REPORT_PIPELINEを実行して指定した成果物を作成し、失敗したときはその旨を返答する
+# 
+# [INPUTS]
+#  targets - 作成する成果物の名前のリスト（covid19_pipeline.py参照）
+#  country - 対象とする国名
+#  channel - 現在のSlackチャネルID
+#  respond - 返答用の関数
+#  inputs - その他の入力となる成果物 {<名前>: <値>}（省略可）
+# 
+# [OUTPUTS]
+#  PipelineRun
+# 
+def run_report_pipeline(targets, country, channel, respond, inputs=None):
+    artifacts = {
+        'country': country,
+        'channel': channel,
+        'client': app.client,
+        'respond': respond,
+    }
+    if inputs != None:
+        artifacts.update(inputs)
+    run = REPORT_PIPELINE.run(targets, artifacts)
     if pyEnv == 'development':
-        print(result)
-    respond(result)
+        print(run.artifacts.get('card'))
+        print(run.failures)
 
-    # 画像ファイルを生成し、アップロードする
-    file_name = country + ".png"
-    png_file = local_folder + "/" + file_name
-    try:
-        status = chartMonthlyConfiguration(country, png_file)
-        if status == True:
-            now = currentTime()
-            pdf_file = pdfGenerateFile(now, country, png_file)
-            if pdf_file != None:
-                result = app.client.files_upload_v2(
-                    channel=channel, # Current Channel ID
-                    #title="Generated PDF File",
-                    file=pdf_file,
-                    initial_comment="PDFファイルを添付します",
-                )
-                os.remove(pdf_file)
-            else:
-                respond(f'PDFファイルは作成できませんでした。')
-            os.remove(png_file)
+    # エラーメッセージがあれば返答する
+    message = pipelineFailureMessage(run)
+    if message != '':
+        respond(message)
+    return run
+
+#
+# [FUNCTION] submit_job()
+#
+# [DESCRIPTION]
+#  時間のかかる処理をREPORT_JOBSに登録し、リスナーはすぐに戻る
+#  待たせるときは順番を、開始したときはmessageを返答する
+#  同じ操作が実行中（あるいは直前に開始済み）のときと、実行回数の上限を超えたときは登録しない
+# 
+# [INPUTS]
+#  job_type - ジョブの種類（covid19_pipeline.py参照）
+#  request - 操作の情報 (ワークスペースID, 利用者ID, チャネルID, 操作名, 値)
+#  respond - 返答用の関数
+#  message - 処理を開始したときの返答（Noneのときは返答しない）
+#  function - 実行する関数
+#  args - functionに渡す引数
+# 
+# [OUTPUTS]
+#  respond - 順番待ちのメッセージ、あるいは受け付けられなかったときのメッセージ
+# 
+def submit_job(job_type, request, respond, message, function, *args):
+    team, user = request[0], request[1]
+    key = request[1:] # (利用者ID, チャネルID, 操作名, 値)
+    if not DUPLICATE_GUARD.claim(key):
+        if pyEnv == 'development':
+            print("[DUPLICATE]", key)
+        return # 同じ操作を実行中のジョブにまとめる
+    limited = not USER_RATE_LIMIT.allow(user)
+    if not limited and not TEAM_RATE_LIMIT.allow(team):
+        USER_RATE_LIMIT.refund(user) # 実行しないため利用者のトークンは返す
+        limited = True
+    if limited:
+        DUPLICATE_GUARD.release(key)
+        respond('実行回数の上限に達しました。しばらくしてから再度実行してください。')
+        return
+
+    def on_wait(position):
+        respond('順番待ち: ' + str(position) + '番目')
+    submitted = time.perf_counter()
+    def job():
+        wait = time.perf_counter() - submitted
+        JOB_WAIT_SECONDS.observe(wait, job_type)
+        try:
+            # 登録したリスナーのトレースの子として記録する
+            with traceSpan('job ' + job_type, wait_seconds=wait), JOB_SECONDS.time(job_type), profileSection():
+                if message != None:
+                    respond(message)
+                function(*args)
+        finally:
+            DUPLICATE_GUARD.finish(key)
+
+    def on_cancel():
+        DUPLICATE_GUARD.release(key)
+        respond('アプリを再起動するため中止しました。しばらくしてから再度実行してください。')
+
+    position = REPORT_JOBS.submit(job_type, job, on_wait=on_wait, on_cancel=on_cancel)
+    if position == None:
+        DUPLICATE_GUARD.release(key)
+        if REPORT_JOBS.closed:
+            respond('アプリを再起動しています。しばらくしてから再度実行してください。')
         else:
-            respond(f'画像ファイルは作成できませんでした。')
-    except Exception as e:
-        print(format(e))
-        respond(f'エラーが発生しました。')
+            respond('処理が混み合っています。しばらくしてから再度実行してください。')
+    if pyEnv == 'development':
+        print("[JOB]", job_type, position, REPORT_JOBS.depth())
+
+#
+# [FUNCTION] action_request()
+#
+# [DESCRIPTION]
+#  アクションのリクエストからsubmit_job()に渡す操作の情報を取り出す
+# 
+# [INPUTS]
+#  body - アクションのリクエスト
+# 
+# [OUTPUTS]
+#  (ワークスペースID, 利用者ID, チャネルID, action_id, 値)
+# 
+def action_request(body):
+    action = body['actions'][0]
+    value = action.get('value')
+    if value == None and 'selected_option' in action:
+        value = action['selected_option']['value']
+    team = (body.get('team') or {}).get('id')
+    return (team, body['user']['id'], body['channel']['id'], action['action_id'], value)
+
+#
+# [FUNCTION] command_request()
+#
+# [DESCRIPTION]
+#  スラッシュコマンドのリクエストからsubmit_job()に渡す操作の情報を取り出す
+# 
+# [INPUTS]
+#  command - スラッシュコマンドのリクエスト
+# 
+# [OUTPUTS]
+#  (ワークスペースID, 利用者ID, チャネルID, コマンド名, 引数)
+# 
+def command_request(command):
+    return (command.get('team_id'), command['user_id'], command['channel_id'], command['command'], command['text'].strip())
 
 #
 # [ACTION METHOD] action-select-country
@@ -507,6 +968,7 @@ def action_report_history(body, ack, respond):
 #  respond - JSON構造: {blocks:[<見出し>,<セクション>]}
 #
 @app.action('action-select-country')
+@metricsListener('action-select-country')
 def action_select_country(body, ack, respond):
     # 予め返信しておく
     ack()
@@ -537,6 +999,7 @@ def action_select_country(body, ack, respond):
 # [OUTPUTS] なし
 #
 @app.view('callback-put-comment')
+@metricsListener('callback-put-comment')
 def callback_put_comment(ack, view, client):
     # 予め返信しておく
     ack()
@@ -570,15 +1033,36 @@ def callback_put_comment(ack, view, client):
 #
 # サーバーを起動する
 #
+#  HTTPモードで複数のワーカープロセスを起動するときは、このファイルではなくwsgi.pyをWSGIサーバーから読み込む
+#
 if __name__ == "__main__":
 
-    app_token = os.environ["SLACK_APP_TOKEN"]
+    # 前回保存したキャッシュのスナップショットを読み込み、以後は定期的に保存する
+    # （このファイルを読み込んだだけでは開始しない。gunicornではワーカーごとにpost_forkで開始する）
+    cacheStartSnapshots()
+    # 前回の停止時に残った一時ファイルを削除する
+    cleanTemporaryFiles(local_folder, TEMP_MAX_AGE)
+
+    if slack_mode == 'http':
+        # 開発用の単一プロセスのHTTPサーバー
+        # 停止するときは実行中のジョブが終わるのを待つ
+        shutdownInstall(None, REPORT_JOBS, local_folder)
+        metricsStartServer()
+        print('⚡️Boltアプリが起動しました (HTTPモード)')
+        app.start(port=int(os.environ.get('PORT', '3000')))
+        sys.exit()
+
+    app_token = os.environ.get("SLACK_APP_TOKEN")
     if app_token == None:
         print("[環境変数未設定] SLACK_APP_TOKEN")
         print('⚡️Boltアプリは起動できません')
     else:
+        handler = SocketModeHandler(app, app_token)
+        # 停止するときは新たなイベントの受信を止め、実行中のジョブが終わるのを待つ
+        shutdownInstall(handler.close, REPORT_JOBS, local_folder)
+        metricsStartServer()
         print('⚡️Boltアプリが起動しました')
-        SocketModeHandler(app, app_token).start()
+        handler.start()
 
 #
 # END OF FILE
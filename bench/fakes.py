@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] fakes.py
+#
+# [DESCRIPTION]
+#  ベンチマークでWebサイト、PostgreSQL、Slackの代わりに用いるオブジェクトを定義するファイル
+#
+# [NOTES]
+#  Webサイトの応答は bench/fixtures/ に記録したJSON（record.pyで作成する）を返す。
+#  記録がないURLには、disease.shと同じ構造の値を国名から決まる乱数で作成して返す（毎回同じ値になる）。
+#
+import os
+import io
+import json
+import random
+import datetime
+import urllib.parse
+
+# 記録した応答を保存するフォルダー
+FIXTURE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# 履歴の期間（disease.shが提供していた期間）
+HISTORY_START = datetime.date(2020, 1, 22)
+HISTORY_END = datetime.date(2023, 3, 9)
+# 国名と日本語名（国名一覧に含める国）
+COUNTRIES = [
+  ('JPN', 'Japan', '日本', 'Asia', 125584838), ('USA', 'USA', 'アメリカ合衆国', 'North America', 334805269),
+  ('GBR', 'UK', 'イギリス', 'Europe', 68497907), ('FRA', 'France', 'フランス', 'Europe', 65584518),
+  ('DEU', 'Germany', 'ドイツ', 'Europe', 83883596), ('ITA', 'Italy', 'イタリア', 'Europe', 60262770),
+  ('KOR', 'S. Korea', '韓国', 'Asia', 51329899), ('CHN', 'China', '中国', 'Asia', 1448471400),
+  ('IND', 'India', 'インド', 'Asia', 1406631776), ('BRA', 'Brazil', 'ブラジル', 'South America', 215353593),
+  ('AUS', 'Australia', 'オーストラリア', 'Australia-Oceania', 26068792), ('CAN', 'Canada', 'カナダ', 'North America', 38388419),
+]
+# 国名一覧の国の数（COUNTRIESの後に架空の国を加える）
+COUNTRY_COUNT = 231
+
+#
+# [CLASS] FakeResponse
+#
+# [DESCRIPTION]
+#  requests.get()の結果の代わり。json()は呼ぶたびに本文を解析する
+#
+class FakeResponse:
+  def __init__(self, status_code, text):
+    self.status_code = status_code
+    self.text = text
+
+  def json(self):
+    return json.loads(self.text)
+
+#
+# [CLASS] FixtureTransport
+#
+# [DESCRIPTION]
+#  httpSetTransport()に渡す関数。URLに対応するdisease.shの応答を返す
+#
+# [INPUTS]
+#  base_url - Webサイトのベースとなるアドレス（環境変数BASE_URLと同じ値）
+#
+class FixtureTransport:
+  def __init__(self, base_url):
+    self.base_url = base_url
+    self.requests = 0
+    self.sources = set() # 応答に用いたもの（recorded: 記録した応答、synthesized: 作成した値）
+    self._texts = {} # 作成した応答の本文
+
+  def __call__(self, url):
+    self.requests += 1
+    if not url.startswith(self.base_url):
+      return FakeResponse(404, '{}')
+    key = url[len(self.base_url):]
+    text = self._texts.get(key)
+    if text == None:
+      path = os.path.join(FIXTURE_FOLDER, fixtureName(key))
+      if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+          text = f.read()
+        self.sources.add('recorded')
+      else:
+        data = _synthesize(key)
+        if data == None:
+          return FakeResponse(404, '{"message":"Country not found or doesn\'t have any cases"}')
+        text = json.dumps(data)
+        self.sources.add('synthesized')
+      self._texts[key] = text
+    return FakeResponse(200, text)
+
+#
+# [FUNCTION] fixtureName()
+#
+# [DESCRIPTION]
+#  ベースとなるアドレスより後の部分から、記録する応答のファイル名を求める
+#
+# [INPUTS]
+#  key - 例: historical/Japan?lastdays=all
+#
+# [OUTPUTS]
+#  ファイル名 例: historical_Japan_lastdays=all.json
+#
+def fixtureName(key):
+  return urllib.parse.unquote(key).replace('/', '_').replace('?', '_').replace(',', '+').replace(' ', '%20') + '.json'
+
+#
+# [CLASS] FakeConnection
+#
+# [DESCRIPTION]
+#  psqlSetConnector()に渡す関数が返すDB-APIの接続の代わり
+#  国名の変換表と注釈を返し、INSERT文は何もしない
+#
+# [INPUTS]
+#  comments - 一つの国に登録されている注釈の数
+#
+class FakeConnection:
+  def __init__(self, comments=200):
+    self.comments = comments
+
+  def cursor(self, name=None):
+    return FakeCursor(self)
+
+  def commit(self):
+    pass
+
+  def close(self):
+    pass
+
+# DB-APIのカーソルの代わり
+class FakeCursor:
+  def __init__(self, connection):
+    self.connection = connection
+    self.itersize = 2000
+    self._rows = []
+
+  def execute(self, query):
+    words = query.split()
+    statement = words[0].upper()
+    if statement != 'SELECT':
+      self._rows = []
+    elif 'annotation' in words:
+      base = datetime.datetime(2023, 3, 9, 12, 0)
+      self._rows = [(base - datetime.timedelta(hours=i * 7), 'ベンチマーク用の注釈 その' + str(i + 1)) for i in range(self.connection.comments)]
+    elif words[1] == 'id':
+      self._rows = [(1,)]
+    else:
+      self._rows = [(iso.lower(), name.lower(), ja) for iso, name, ja, _, _ in _countries()]
+
+  def fetchall(self):
+    rows, self._rows = self._rows, []
+    return rows
+
+  def fetchmany(self, size):
+    rows, self._rows = self._rows[:size], self._rows[size:]
+    return rows
+
+  def close(self):
+    pass
+
+#
+# [CLASS] FakeSlackClient
+#
+# [DESCRIPTION]
+#  SlackのWebClientの代わり。files_upload_v2()はファイルを読み込むだけで送信しない
+#
+class FakeSlackClient:
+  def __init__(self):
+    self.uploads = 0
+    self.bytes = 0
+
+  def files_upload_v2(self, **kwargs):
+    uploads = kwargs.get('file_uploads') or [{'file': kwargs.get('file'), 'filename': kwargs.get('filename')}]
+    files = []
+    for upload in uploads:
+      size = _readAll(upload['file'])
+      self.uploads += 1
+      self.bytes += size
+      files.append({'id': 'F' + str(self.uploads), 'size': size})
+    return {'ok': True, 'files': files}
+
+# ファイル名あるいはバッファーの内容を全て読み込み、バイト数を返す
+def _readAll(file):
+  if isinstance(file, (str, bytes, os.PathLike)):
+    with open(file, 'rb') as f:
+      return len(f.read())
+  if isinstance(file, io.IOBase) or hasattr(file, 'read'):
+    return len(file.read())
+  return 0
+
+# ---------- disease.shと同じ構造の値の作成 ----------
+
+# 国の一覧 (ISOコード, 英語名, 日本語名, 大陸, 人口)
+def _countries():
+  countries = list(COUNTRIES)
+  for i in range(len(COUNTRIES), COUNTRY_COUNT):
+    countries.append(('X%02d' % i, 'Country ' + str(i), '国' + str(i), 'Africa', 1000000 + i * 37511))
+  return countries
+
+# 英語名から国を求める
+def _country(name):
+  for country in _countries():
+    if country[1].lower() == name.lower() or country[0].lower() == name.lower():
+      return country
+  return None
+
+# 国の感染状況
+def _snapshot(country):
+  iso, name, _, continent, population = country
+  rng = random.Random(name)
+  cases = int(population * rng.uniform(0.05, 0.4))
+  deaths = int(cases * rng.uniform(0.001, 0.02))
+  recovered = int(cases * 0.97)
+  return {
+    'updated': 1678406621000, 'country': name,
+    'countryInfo': {'iso2': iso[:2], 'iso3': iso, 'lat': 0, 'long': 0, 'flag': 'https://disease.sh/assets/img/flags/' + iso[:2].lower() + '.png'},
+    'cases': cases, 'todayCases': 0, 'deaths': deaths, 'todayDeaths': 0, 'recovered': recovered, 'todayRecovered': 0,
+    'active': cases - deaths - recovered, 'critical': int(cases * 0.0001), 'casesPerOneMillion': int(cases * 1e6 / population),
+    'deathsPerOneMillion': int(deaths * 1e6 / population), 'tests': cases * 5, 'testsPerOneMillion': int(cases * 5e6 / population),
+    'population': population, 'continent': continent, 'oneCasePerPeople': 0, 'oneDeathPerPeople': 0, 'oneTestPerPeople': 0,
+    'activePerOneMillion': 0, 'recoveredPerOneMillion': 0, 'criticalPerOneMillion': 0,
+  }
+
+# 累計の推移 {'1/22/20': 値, ...}
+def _timeline(name, lastdays):
+  days = (HISTORY_END - HISTORY_START).days + 1
+  if lastdays != 'all':
+    days = min(days, int(lastdays))
+  rng = random.Random(name + '-timeline')
+  cases = {}
+  deaths = {}
+  total_cases = 0
+  total_deaths = 0
+  for i in range((HISTORY_END - HISTORY_START).days + 1):
+    date = HISTORY_START + datetime.timedelta(days=i)
+    total_cases += int(rng.expovariate(1.0) * 1000 * (1 + i / 100))
+    total_deaths += int(rng.expovariate(1.0) * 10)
+    key = str(date.month) + '/' + str(date.day) + '/' + date.strftime('%y')
+    cases[key] = total_cases
+    deaths[key] = total_deaths
+  keys = list(cases)[-days:]
+  return {
+    'cases': {k: cases[k] for k in keys},
+    'deaths': {k: deaths[k] for k in keys},
+    'recovered': {k: 0 for k in keys},
+  }
+
+# URL（ベースより後の部分）に対応する値
+def _synthesize(key):
+  parsed = urllib.parse.urlparse(key)
+  segments = [urllib.parse.unquote(s) for s in parsed.path.split('/') if s != '']
+  query = urllib.parse.parse_qs(parsed.query)
+  lastdays = query.get('lastdays', ['30'])[0]
+
+  if segments == ['countries']:
+    return [_snapshot(c) for c in _countries()]
+  if segments == ['all']:
+    return dict(_snapshot(('ALL', 'World', '世界', '', 7900000000)), affectedCountries=COUNTRY_COUNT)
+  if len(segments) == 2 and segments[0] == 'countries':
+    found = [_snapshot(c) for c in map(_country, segments[1].split(',')) if c != None]
+    if len(found) == 0:
+      return None
+    return found[0] if ',' not in segments[1] else found
+  if len(segments) == 2 and segments[0] == 'continents':
+    return {'continent': segments[1], 'countries': [c[1] for c in _countries() if c[3].lower() == segments[1].lower()]}
+  if len(segments) == 2 and segments[0] == 'historical':
+    if segments[1] == 'all':
+      return _timeline('all', lastdays)
+    found = [{'country': c[1], 'province': ['mainland'], 'timeline': _timeline(c[1], lastdays)} for c in map(_country, segments[1].split(',')) if c != None]
+    if len(found) == 0:
+      return None
+    return found[0] if ',' not in segments[1] else found
+  return None
+
+#
+# END OF FILE
+#
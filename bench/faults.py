@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] faults.py
+#
+# [DESCRIPTION]
+#  Webサイトとデータベースへのアクセスに遅延と障害を注入するオブジェクトを定義するファイル
+#
+# [NOTES]
+#  httpSetTransport()とpsqlSetConnector()に渡して用いる（load.pyの--http-faults、--db-faultsを参照）。
+#  注入する障害は次の形式の文字列で指定する。いずれも省略できる。
+#    delay=<分布>,error=<割合>,reset=<割合>,partial=<割合>,outage=<周期（秒）>:<停止する秒数>
+#
+#  遅延の分布（ミリ秒）:
+#    fixed:<値>  uniform:<最小>-<最大>  exp:<平均>  lognormal:<中央値>:<σ>
+#  例: delay=lognormal:200:1,error=0.05,outage=60:10
+#
+#  Webサイト:
+#   error - 503を返す、reset - 接続を切る（ConnectionError）、partial - 途中で切れた本文を返す
+#   遅延がHTTP_READ_TIMEOUT以上のときは、HTTP_READ_TIMEOUT秒だけ待ってReadTimeoutを送出する
+#  データベース:
+#   error - 接続に失敗する、reset - SQL文の実行中に切断する、partial - 結果の取得中に切断する（OperationalError）
+#   SQL文ごとの遅延がDB_STATEMENT_TIMEOUT以上のときは、その時間だけ待ってQueryCanceledを送出する
+#  outage - 周期ごとに最初の停止する秒数の間、全てのアクセスを失敗させる（Webサイトは503、データベースは接続の失敗）
+#
+import time
+import random
+import threading
+import requests
+import psycopg2
+import psycopg2.errors
+from fakes import FakeResponse
+
+#
+# [CLASS] FaultProfile
+#
+# [DESCRIPTION]
+#  注入する遅延と障害の割合。注入した回数を種類ごとに数える
+#
+# [INPUTS]
+#  spec - 障害を指定する文字列（空文字列のときは何も注入しない）
+#  seed - 乱数の初期値（省略時は毎回異なる）
+#
+class FaultProfile:
+  def __init__(self, spec, seed=None):
+    self.spec = spec
+    self.rates = {'error': 0.0, 'reset': 0.0, 'partial': 0.0}
+    self.outage = None # (周期, 停止する秒数)
+    self.counts = {} # {<種類>: 注入した回数}
+    self._delay = lambda rng: 0.0
+    self._rng = random.Random(seed)
+    self._lock = threading.Lock()
+    self._start = time.monotonic()
+
+    for item in spec.split(','):
+      if item.strip() == '':
+        continue
+      name, _, value = item.strip().partition('=')
+      if name == 'delay':
+        self._delay = _parseDelay(value)
+      elif name in self.rates:
+        self.rates[name] = float(value)
+      elif name == 'outage':
+        period, _, down = value.partition(':')
+        self.outage = (float(period), float(down))
+      else:
+        raise ValueError("不明な障害: " + item)
+
+  # 遅延（秒）
+  def delay(self):
+    with self._lock:
+      return self._delay(self._rng)
+
+  # 指定した種類の障害を注入するか
+  def roll(self, name):
+    with self._lock:
+      hit = self._rng.random() < self.rates[name]
+    if hit:
+      self.count(name)
+    return hit
+
+  # 停止している期間か
+  def down(self):
+    if self.outage == None:
+      return False
+    period, down = self.outage
+    if (time.monotonic() - self._start) % period < down:
+      self.count('outage')
+      return True
+    return False
+
+  def count(self, name):
+    with self._lock:
+      self.counts[name] = self.counts.get(name, 0) + 1
+
+# 遅延の分布を表す文字列から、乱数を受け取って秒数を返す関数を作成する
+def _parseDelay(value):
+  kind, _, params = value.partition(':')
+  if kind == 'fixed':
+    seconds = float(params) / 1000
+    return lambda rng: seconds
+  if kind == 'uniform':
+    low, _, high = params.partition('-')
+    return lambda rng: rng.uniform(float(low), float(high)) / 1000
+  if kind == 'exp':
+    mean = float(params) / 1000
+    return lambda rng: rng.expovariate(1 / mean)
+  if kind == 'lognormal':
+    median, _, sigma = params.partition(':')
+    return lambda rng: rng.lognormvariate(0, float(sigma or '1')) * float(median) / 1000
+  raise ValueError("不明な遅延の分布: " + value)
+
+#
+# [CLASS] FaultyTransport
+#
+# [DESCRIPTION]
+#  httpSetTransport()に渡す関数。遅延と障害を注入してから、Webサイトにアクセスする
+#
+# [INPUTS]
+#  profile - FaultProfile
+#  inner - Webサイトにアクセスする関数（省略時はhttp_get.pyと同じタイムアウトでrequests.get()を呼ぶ）
+#
+class FaultyTransport:
+  def __init__(self, profile, inner=None):
+    self.profile = profile
+    self.inner = inner
+
+  def __call__(self, url):
+    # functionsは環境変数を設定してから読み込むため、呼び出したときに参照する
+    from functions.http_get import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    if self.profile.down():
+      return FakeResponse(503, '{"message":"injected outage"}')
+    delay = self.profile.delay()
+    if delay >= HTTP_READ_TIMEOUT:
+      time.sleep(HTTP_READ_TIMEOUT)
+      self.profile.count('timeout')
+      raise requests.exceptions.ReadTimeout("injected: read timed out (" + str(HTTP_READ_TIMEOUT) + "s)")
+    time.sleep(delay)
+    if self.profile.roll('reset'):
+      raise requests.exceptions.ConnectionError("injected: connection reset by peer")
+    if self.profile.roll('error'):
+      return FakeResponse(503, '{"message":"injected error"}')
+
+    if self.inner == None:
+      result = requests.get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    else:
+      result = self.inner(url)
+    if result.status_code == 200 and self.profile.roll('partial'):
+      return FakeResponse(200, result.text[:len(result.text) // 2])
+    return result
+
+#
+# [CLASS] FaultyConnector
+#
+# [DESCRIPTION]
+#  psqlSetConnector()に渡す関数。遅延と障害を注入する接続オブジェクトを返す
+#
+# [INPUTS]
+#  profile - FaultProfile
+#  inner - 実際の接続オブジェクトを返す関数（FakeConnectionやpsycopg2.connect()など）
+#
+class FaultyConnector:
+  def __init__(self, profile, inner):
+    self.profile = profile
+    self.inner = inner
+
+  def __call__(self):
+    if self.profile.down() or self.profile.roll('error'):
+      raise psycopg2.OperationalError("injected: could not connect to server")
+    return FaultyConnection(self.profile, self.inner())
+
+# 接続オブジェクト。カーソルに障害を注入する
+class FaultyConnection:
+  def __init__(self, profile, connection):
+    self.profile = profile
+    self.connection = connection
+
+  def cursor(self, name=None):
+    cursor = self.connection.cursor(name) if name != None else self.connection.cursor()
+    return FaultyCursor(self.profile, cursor)
+
+  def commit(self):
+    self.connection.commit()
+
+  def close(self):
+    self.connection.close()
+
+# カーソル。SQL文の実行に遅延を、結果の取得に切断を注入する
+class FaultyCursor:
+  def __init__(self, profile, cursor):
+    self.profile = profile
+    self.cursor = cursor
+    self._partial = False # 結果の取得中に切断する
+    self._fetched = False
+
+  @property
+  def itersize(self):
+    return self.cursor.itersize
+
+  @itersize.setter
+  def itersize(self, value):
+    self.cursor.itersize = value
+
+  def execute(self, query):
+    # functionsは環境変数を設定してから読み込むため、呼び出したときに参照する
+    from functions.psql_get import DB_STATEMENT_TIMEOUT
+    timeout = DB_STATEMENT_TIMEOUT / 1000
+    delay = self.profile.delay()
+    if timeout > 0 and delay >= timeout:
+      time.sleep(timeout)
+      self.profile.count('timeout')
+      raise psycopg2.errors.QueryCanceled("injected: canceling statement due to statement timeout")
+    time.sleep(delay)
+    if self.profile.roll('reset'):
+      raise psycopg2.OperationalError("injected: server closed the connection unexpectedly")
+    self.cursor.execute(query)
+    self._partial = self.profile.roll('partial')
+    self._fetched = False
+
+  def fetchall(self):
+    if self._partial:
+      raise psycopg2.OperationalError("injected: server closed the connection unexpectedly")
+    return self.cursor.fetchall()
+
+  # 切断するときは最初の一回だけ結果を返す
+  def fetchmany(self, size):
+    if self._partial and self._fetched:
+      raise psycopg2.OperationalError("injected: server closed the connection unexpectedly")
+    self._fetched = True
+    return self.cursor.fetchmany(size)
+
+  def close(self):
+    self.cursor.close()
+
+#
+# END OF FILE
+#
@@ -0,0 +1,637 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] load.py
+#
+# [DESCRIPTION]
+#  Slackからの操作（スラッシュコマンド、ボタン操作、モーダルの送信）を一定の割合でappに送り、
+#  リスナーごとのスループット、処理時間、エラー率を求める負荷試験用のスクリプト
+#
+# [NOTES]
+#  使い方:
+#    python bench/load.py                                    既定の割合の操作を30秒間、毎秒平均5件送る
+#    python bench/load.py --rate 20 --duration 60
+#    python bench/load.py --mix /covid19=5,action-graph-history=1
+#    python bench/load.py --list                             操作の一覧と既定の割合を表示する
+#
+#  オプション:
+#    --mode <socket|http>          socket: SocketModeHandlerと同じくエンベロープをappに渡す（省略時）
+#                                  http: 署名したリクエストをwsgi.pyのWSGIアプリケーションに渡す
+#    --rate <件数>                 一秒間に送る操作の平均数（省略時は5）
+#    --duration <秒>               操作を送る時間（省略時は30）
+#    --mix <名前=割合,...>         送る操作とその割合
+#    --upstream-latency <ミリ秒>   Webサイトのスタブが応答するまでの平均時間（省略時は50）
+#    --slack-latency <ミリ秒>      Slack Web APIとresponse_urlのスタブが応答するまでの平均時間（省略時は30）
+#    --users <人数>                操作する利用者の数（省略時は200）
+#    --teams <数>                  操作するワークスペースの数（省略時は20）
+#    --no-cache                    Webサイトの応答とグラフをキャッシュしない
+#    --http-faults <指定>          Webサイトへのアクセスに遅延と障害を注入する（faults.py参照）
+#    --db-faults <指定>            データベースへのアクセスに遅延と障害を注入する（faults.py参照）
+#    --max-error-rate <割合>       エラー率がこれを超えたら終了コード1で終了する（省略時は0.01）
+#
+#  Webサイト（fakes.pyのFixtureTransportと同じ応答を返す）とSlack Web APIのスタブは別のプロセスのHTTPサーバーとして動作し、
+#  平均の前後50%の範囲でばらつかせた時間だけ待ってから応答する。PostgreSQLはfakes.pyのFakeConnectionを用いる。
+#  送る時刻はポアソン過程で予め決めておき、appの応答が遅れても送る間隔は変えない。
+#
+#  操作ごとに、予定した送信時刻から次の時点までの時間を求める。
+#   ack - appが受け付けを返すまで（Slackは3秒以内を求める）
+#   完了 - その操作によるresponse_urlへの返答とWeb APIの呼び出しのうち最後のものまで
+#  返答がない操作、エラーメッセージを返答した操作、受け付けが200以外の操作をエラーとする。
+#  実行回数の上限や順番待ちの上限による拒否はエラーとは別に数える。
+#
+#  障害を注入したときは、タイムアウト（HTTP_READ_TIMEOUT、DB_STATEMENT_TIMEOUTなど）、キャッシュ、ジョブの待ち行列によって
+#  完了までの時間が抑えられているかを確かめる。例:
+#    HTTP_READ_TIMEOUT=2 python bench/load.py --http-faults delay=lognormal:300:1.5,error=0.05,outage=20:5
+#
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+import subprocess
+import contextlib
+import urllib.parse
+import urllib.request
+import wsgiref.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import ROOT, prepareEnvironment
+from fakes import COUNTRIES, FixtureTransport
+from faults import FaultProfile, FaultyTransport, FaultyConnector
+
+# 一秒間に送る操作の平均数
+DEFAULT_RATE = 5
+# 操作を送る秒数
+DEFAULT_DURATION = 30
+# スタブが応答するまでの平均時間（秒）
+DEFAULT_UPSTREAM_LATENCY = 0.05
+DEFAULT_SLACK_LATENCY = 0.03
+# 利用者とワークスペースの数
+DEFAULT_USERS = 200
+DEFAULT_TEAMS = 20
+# 許容するエラー率
+DEFAULT_MAX_ERROR_RATE = 0.01
+# 同時に処理するエンベロープの数（SocketModeClientの既定値と同じ）
+DISPATCH_WORKERS = 10
+# 最後の呼び出しからこの秒数だけ新たな呼び出しがなく、ジョブがなければ終わったとみなす
+SETTLE_SECONDS = 3
+# 送り終わってから待つ最大秒数
+SETTLE_TIMEOUT = 180
+# HTTPモードで署名に用いる文字列
+LOAD_SIGNING_SECRET = 'load-test-secret'
+# 操作の番号をSlackへの呼び出しから求めるための接頭辞
+CHANNEL_PREFIX = 'CL'
+TRIGGER_PREFIX = 'trigger.'
+# 対象とする国名
+LOAD_COUNTRIES = [country[1] for country in COUNTRIES]
+# エラーとみなす返答
+ERROR_MESSAGES = ['エラーが発生しました', 'できませんでした', 'できません。', '見つかりませんでした']
+# 拒否とみなす返答
+REJECT_MESSAGES = ['実行回数の上限', '混み合っています', '再起動']
+
+#
+# [CLASS] LoadRequest
+#
+# [DESCRIPTION]
+#  一つの操作。SCENARIOSの関数でエンベロープ（typeとpayload）を作成する
+#
+# [INPUTS]
+#  number - 操作の番号（チャネルID、response_url、trigger_idに含める）
+#  scenario - 操作の名前（SCENARIOSのキー）
+#  rng - 利用者と国名を選ぶ乱数
+#  users, teams - 利用者とワークスペースの数
+#  slack_url - Slackのスタブのアドレス
+#
+class LoadRequest:
+  def __init__(self, number, scenario, rng, users, teams, slack_url):
+    self.number = number
+    self.scenario = scenario
+    self.team = 'T%03d' % rng.randrange(teams)
+    self.user = 'U%04d' % rng.randrange(users)
+    self.channel = CHANNEL_PREFIX + str(number)
+    self.response_url = slack_url + '/response/' + str(number)
+    self.trigger_id = TRIGGER_PREFIX + str(number)
+    self._rng = rng
+    self.type, self.payload = SCENARIOS[scenario][1](self)
+    self.scheduled = None # 送る予定の時刻
+    self.acked = None # 受け付けを返した時刻
+    self.status = None # 受け付けのステータスコード
+
+  def country(self):
+    return self._rng.choice(LOAD_COUNTRIES)
+
+  def countries(self, count):
+    return self._rng.sample(LOAD_COUNTRIES, count)
+
+  # スラッシュコマンド
+  def command(self, command, text):
+    return 'slash_commands', {
+      'token': 'load', 'team_id': self.team, 'team_domain': 'load', 'channel_id': self.channel, 'channel_name': 'load',
+      'user_id': self.user, 'user_name': self.user.lower(), 'command': command, 'text': text,
+      'api_app_id': 'A0LOAD', 'response_url': self.response_url, 'trigger_id': self.trigger_id,
+    }
+
+  # ボタン、選択メニューの操作
+  def action(self, action_id, value=None, selected=None):
+    action = {'type': 'button', 'action_id': action_id, 'block_id': 'load', 'action_ts': str(time.time())}
+    if selected != None:
+      action.update(type='static_select', selected_option={'text': {'type': 'plain_text', 'text': selected}, 'value': selected})
+    else:
+      action['value'] = value
+    return 'interactive', {
+      'type': 'block_actions', 'api_app_id': 'A0LOAD', 'token': 'load', 'team': {'id': self.team, 'domain': 'load'},
+      'user': {'id': self.user, 'username': self.user.lower(), 'team_id': self.team},
+      'channel': {'id': self.channel, 'name': 'load'}, 'container': {'type': 'message', 'channel_id': self.channel},
+      'response_url': self.response_url, 'trigger_id': self.trigger_id, 'actions': [action],
+    }
+
+  # モーダルビューの送信
+  def submission(self, callback_id, metadata, values):
+    return 'interactive', {
+      'type': 'view_submission', 'api_app_id': 'A0LOAD', 'token': 'load', 'team': {'id': self.team, 'domain': 'load'},
+      'user': {'id': self.user, 'username': self.user.lower(), 'team_id': self.team}, 'trigger_id': self.trigger_id,
+      'view': {'id': 'V0LOAD', 'type': 'modal', 'callback_id': callback_id, 'private_metadata': json.dumps(metadata),
+        'state': {'values': values}},
+    }
+
+# 送る操作 {<名前>: (既定の割合, エンベロープを作成する関数)}
+SCENARIOS = {
+  '/covid19': (30, lambda r: r.command('/covid19', r.country())),
+  '/covid19 list': (4, lambda r: r.command('/covid19', '')),
+  '/covid19 compare': (4, lambda r: r.command('/covid19', 'compare ' + ','.join(r.countries(2)))),
+  '/covid19 report': (2, lambda r: r.command('/covid19', 'report ' + ','.join(r.countries(3)))),
+  '/hello': (3, lambda r: r.command('/hello', '')),
+  '/translate': (3, lambda r: r.command('/translate', r.country())),
+  'action-get-info': (12, lambda r: r.action('action-get-info', r.country())),
+  'action-select-country': (8, lambda r: r.action('action-select-country', selected=r.country())),
+  'action-graph-history': (8, lambda r: r.action('action-graph-history', r.country())),
+  'action-report-history': (4, lambda r: r.action('action-report-history', r.country())),
+  'action-report-bundle': (4, lambda r: r.action('action-report-bundle', r.country())),
+  'action-csv-generate': (4, lambda r: r.action('action-csv-generate', r.country())),
+  'action-export-generate': (2, lambda r: r.action('action-export-generate', selected='csv:' + r.country())),
+  'action-comment': (3, lambda r: r.action('action-comment', r.country())),
+  'callback-put-comment': (3, lambda r: r.submission('callback-put-comment',
+    {'country': r.country(), 'channel': r.channel, 'user': r.user.lower()},
+    {'comment_block': {'comment': {'type': 'plain_text_input', 'value': '負荷試験のコメント'}}})),
+}
+
+# ---------- スタブ（別のプロセス） ----------
+
+# 平均の前後50%の範囲で待つ
+def _sleep(latency):
+  if latency > 0:
+    time.sleep(random.uniform(0.5, 1.5) * latency)
+
+# Webサイトのスタブ
+class UpstreamHandler(BaseHTTPRequestHandler):
+  transport = None
+  latency = 0
+
+  def do_GET(self):
+    _sleep(self.latency)
+    result = self.transport('http://' + self.headers.get('Host') + self.path)
+    body = result.text.encode('utf-8')
+    self.send_response(result.status_code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+# Slack Web API、ファイルのアップロード先、response_urlのスタブ
+class SlackHandler(BaseHTTPRequestHandler):
+  latency = 0
+  effects = [] # [時刻, 操作の番号, 呼び出し, 内容]
+  lock = threading.Lock()
+  uploads = 0
+
+  def do_GET(self):
+    with self.lock:
+      effects = list(self.effects)
+    self._reply(200, len(effects) if self.path == '/_effects/count' else effects)
+
+  def do_POST(self):
+    data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    _sleep(self.latency)
+    if self.path.startswith('/response/'):
+      self._record(int(self.path[len('/response/'):]), 'respond', _messageText(json.loads(data)))
+      self._reply(200, 'ok')
+    elif self.path.startswith('/upload/'):
+      self._reply(200, 'OK - ' + str(len(data)))
+    elif self.path.startswith('/api/'):
+      method = self.path[len('/api/'):].split('?')[0]
+      params = _apiParams(data, self.headers.get('Content-Type', ''))
+      number = _requestNumber(params)
+      if number != None:
+        self._record(number, method, _messageText(params))
+      self._reply(200, self._apiResult(method, params))
+    else:
+      self._reply(404, {'ok': False, 'error': 'unknown_path'})
+
+  # Web APIの応答
+  def _apiResult(self, method, params):
+    if method == 'auth.test':
+      return {'ok': True, 'url': 'https://load.slack.com/', 'team': 'load', 'user': 'covid19', 'team_id': 'T000', 'user_id': 'U0BOT', 'bot_id': 'B0BOT'}
+    if method == 'files.getUploadURLExternal':
+      with self.lock:
+        SlackHandler.uploads += 1
+        file_id = 'F' + str(SlackHandler.uploads)
+      return {'ok': True, 'file_id': file_id, 'upload_url': 'http://' + self.headers.get('Host') + '/upload/' + file_id}
+    if method == 'files.completeUploadExternal':
+      files = json.loads(params.get('files', '[]'))
+      return {'ok': True, 'files': [{'id': f.get('id'), 'title': f.get('title')} for f in files]}
+    return {'ok': True, 'ts': str(time.time()), 'channel': params.get('channel')}
+
+  def _record(self, number, name, text):
+    with self.lock:
+      self.effects.append([time.time(), number, name, text])
+
+  def _reply(self, status, value):
+    body = (value if isinstance(value, str) else json.dumps(value)).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/plain' if isinstance(value, str) else 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+# Web APIの引数（フォームあるいはJSON）
+def _apiParams(data, content_type):
+  if content_type.startswith('application/json'):
+    return json.loads(data or b'{}')
+  return {k: v[0] for k, v in urllib.parse.parse_qs(data.decode('utf-8')).items()}
+
+# 返答あるいはWeb APIの引数に含まれる文字列（エラーの判定に用いる）
+def _messageText(params):
+  text = str(params.get('text') or params.get('initial_comment') or '')
+  blocks = params.get('blocks')
+  if blocks != None:
+    text += ' ' + (blocks if isinstance(blocks, str) else json.dumps(blocks, ensure_ascii=False))
+  return text
+
+# チャネルIDあるいはtrigger_idから操作の番号を求める
+def _requestNumber(params):
+  for key, prefix in (('channel', CHANNEL_PREFIX), ('channel_id', CHANNEL_PREFIX), ('trigger_id', TRIGGER_PREFIX)):
+    value = params.get(key)
+    if isinstance(value, str) and value.startswith(prefix) and value[len(prefix):].isdigit():
+      return int(value[len(prefix):])
+  return None
+
+#
+# [FUNCTION] runStubs()
+#
+# [DESCRIPTION]
+#  WebサイトとSlackのスタブを起動し、ポート番号を標準出力に出力する。標準入力が閉じられたら終了する
+#
+# [INPUTS]
+#  upstream_latency - Webサイトのスタブが応答するまでの平均秒数
+#  slack_latency - Slackのスタブが応答するまでの平均秒数
+#
+# [OUTPUTS] なし
+#
+def runStubs(upstream_latency, slack_latency):
+  upstream = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+  slack = ThreadingHTTPServer(('127.0.0.1', 0), SlackHandler)
+  UpstreamHandler.transport = FixtureTransport(_upstreamUrl(upstream.server_address[1]))
+  UpstreamHandler.latency = upstream_latency
+  SlackHandler.latency = slack_latency
+  for server in (upstream, slack):
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+  print(json.dumps({'upstream': upstream.server_address[1], 'slack': slack.server_address[1]}), flush=True)
+  sys.stdin.read()
+
+# WebサイトのスタブのベースとなるURL
+def _upstreamUrl(port):
+  return 'http://127.0.0.1:' + str(port) + '/v3/covid-19/'
+
+# ---------- 負荷の生成 ----------
+
+#
+# [FUNCTION] prepareLoadEnvironment()
+#
+# [DESCRIPTION]
+#  appを読み込む前に、スタブに接続するよう環境変数を設定する
+#
+# [INPUTS]
+#  folder - ファイルを保存するフォルダー
+#  ports - スタブのポート番号 {upstream, slack}
+#  mode - socketあるいはhttp
+#  cache - Webサイトの応答とグラフをキャッシュするか
+#
+# [OUTPUTS] なし
+#
+def prepareLoadEnvironment(folder, ports, mode, cache):
+  prepareEnvironment(folder)
+  os.environ['BASE_URL'] = _upstreamUrl(ports['upstream'])
+  os.environ['SLACK_API_URL'] = 'http://127.0.0.1:' + str(ports['slack']) + '/api/'
+  os.environ['SLACK_BOT_TOKEN'] = 'xoxb-load-test'
+  os.environ['SLACK_MODE'] = mode
+  os.environ['SLACK_SIGNING_SECRET'] = LOAD_SIGNING_SECRET
+  os.environ['PROFILE_ADMINS'] = ''
+  if cache:
+    os.environ.pop('HTTP_CACHE_TTL')
+    os.environ.pop('CHART_CACHE_TTL')
+
+# SocketModeHandlerと同じくエンベロープをappに渡す関数
+def _socketDispatcher():
+  from slack_sdk.socket_mode.request import SocketModeRequest
+  from slack_bolt.adapter.socket_mode.internals import run_bolt_app
+  from app import app
+  def dispatch(request):
+    envelope = SocketModeRequest(type=request.type, envelope_id='E' + str(request.number), payload=request.payload)
+    return run_bolt_app(app, envelope).status
+  return dispatch
+
+# 署名したリクエストをWSGIアプリケーションに渡す関数
+def _httpDispatcher():
+  from tools.post_signed import signedHeaders
+  from wsgi import application
+  def dispatch(request):
+    if request.type == 'slash_commands':
+      body = urllib.parse.urlencode(request.payload)
+    else:
+      body = urllib.parse.urlencode({'payload': json.dumps(request.payload)})
+    data = body.encode('utf-8')
+    headers = signedHeaders(LOAD_SIGNING_SECRET, body)
+    environ = {
+      'REQUEST_METHOD': 'POST', 'PATH_INFO': '/slack/events', 'QUERY_STRING': '',
+      'CONTENT_TYPE': headers['Content-Type'], 'CONTENT_LENGTH': str(len(data)), 'wsgi.input': io.BytesIO(data),
+      'HTTP_X_SLACK_REQUEST_TIMESTAMP': headers['X-Slack-Request-Timestamp'],
+      'HTTP_X_SLACK_SIGNATURE': headers['X-Slack-Signature'],
+    }
+    wsgiref.util.setup_testing_defaults(environ)
+    status = []
+    b''.join(application(environ, lambda line, headers, exc_info=None: status.append(line)))
+    return int(status[0].split()[0])
+  return dispatch
+
+# 一つの操作を送り、受け付けの結果を記録する
+def _send(dispatch, request):
+  try:
+    request.status = dispatch(request)
+  except Exception as e:
+    print("[LOAD ERROR]", request.scenario, format(e), file=sys.stderr)
+    request.status = 0
+  request.acked = time.time()
+
+# 送る操作の一覧を作成する
+def _schedule(mix, rate, duration, users, teams, slack_url):
+  rng = random.Random(0)
+  names = list(mix)
+  weights = [mix[name] for name in names]
+  requests = []
+  at = 0.0
+  while True:
+    at += rng.expovariate(rate)
+    if at >= duration:
+      return requests
+    request = LoadRequest(len(requests), rng.choices(names, weights)[0], rng, users, teams, slack_url)
+    request.scheduled = at
+    requests.append(request)
+
+# Slackへの呼び出しが止まり、ジョブがなくなるまで待つ
+def _waitSettled(slack_url, jobs):
+  deadline = time.time() + SETTLE_TIMEOUT
+  count = -1
+  changed = time.time()
+  while time.time() < deadline:
+    current = _getJson(slack_url + '/_effects/count')
+    idle = jobs.depth() == 0 and sum(jobs.running().values()) == 0
+    if current != count:
+      count = current
+      changed = time.time()
+    elif idle and time.time() - changed >= SETTLE_SECONDS:
+      return True
+    time.sleep(0.2)
+  return False
+
+def _getJson(url):
+  with urllib.request.urlopen(url) as response:
+    return json.loads(response.read())
+
+#
+# [FUNCTION] summarize()
+#
+# [DESCRIPTION]
+#  操作とSlackへの呼び出しを突き合わせ、操作の名前ごとに集計する
+#
+# [INPUTS]
+#  requests - 送ったLoadRequestのリスト
+#  effects - Slackのスタブが記録した呼び出し [時刻, 操作の番号, 呼び出し, 内容]
+#
+# [OUTPUTS]
+#  {<操作の名前>: {count, ok, rejected, errors, ack, done}}（ack、doneは秒数のリスト）
+#
+def summarize(requests, effects):
+  last = {}
+  texts = {}
+  for at, number, name, text in effects:
+    last[number] = max(last.get(number, 0), at)
+    texts.setdefault(number, []).append(text)
+
+  rows = {}
+  for request in requests:
+    row = rows.setdefault(request.scenario, {'count': 0, 'ok': 0, 'rejected': 0, 'errors': 0, 'ack': [], 'done': []})
+    row['count'] += 1
+    row['ack'].append(request.acked - request.scheduled)
+    outcome = _classify(request, texts.get(request.number, []))
+    row[outcome] += 1
+    if outcome == 'ok':
+      row['done'].append(last[request.number] - request.scheduled)
+  return rows
+
+# 操作の結果 ok、rejected、errorsのいずれか
+def _classify(request, texts):
+  if request.status != 200 or len(texts) == 0:
+    return 'errors'
+  if any(message in text for text in texts for message in ERROR_MESSAGES):
+    return 'errors'
+  if any(message in text for text in texts for message in REJECT_MESSAGES):
+    return 'rejected'
+  return 'ok'
+
+# ソート済みの値のパーセンタイル
+def _percentile(samples, ratio):
+  if len(samples) == 0:
+    return None
+  index = min(len(samples) - 1, int(round(ratio * (len(samples) - 1))))
+  return samples[index]
+
+# 表示用の単位
+def _ms(seconds):
+  return "%8s" % '-' if seconds == None else "%8.1f" % (seconds * 1000)
+
+#
+# [FUNCTION] printReport()
+#
+# [DESCRIPTION]
+#  集計結果を表示する
+#
+# [INPUTS]
+#  rows - summarize()の結果
+#  elapsed - 最初の操作を送ってから最後の呼び出しまでの秒数
+#
+# [OUTPUTS]
+#  全体のエラー率
+#
+def printReport(rows, elapsed):
+  print("%-24s %6s %6s %6s %6s %6s %8s %8s %8s %8s %7s" % ('listener', 'count', 'ok', 'reject', 'error', 'err%',
+    'ack p99', 'p50(ms)', 'p99(ms)', 'max(ms)', 'ok/s'))
+  total = {'count': 0, 'ok': 0, 'rejected': 0, 'errors': 0, 'ack': [], 'done': []}
+  for name in sorted(rows) + ['total']:
+    row = rows[name] if name != 'total' else total
+    if name != 'total':
+      for key in total:
+        total[key] += row[key]
+    ack = sorted(row['ack'])
+    done = sorted(row['done'])
+    print("%-24s %6d %6d %6d %6d %6.1f %s %s %s %s %7.2f" % (name, row['count'], row['ok'], row['rejected'], row['errors'],
+      100.0 * row['errors'] / max(1, row['count']), _ms(_percentile(ack, 0.99)), _ms(_percentile(done, 0.5)),
+      _ms(_percentile(done, 0.99)), _ms(done[-1] if len(done) > 0 else None), row['ok'] / elapsed))
+  return total['errors'] / max(1, total['count'])
+
+def main(argv):
+  mode = 'socket'
+  rate = DEFAULT_RATE
+  duration = DEFAULT_DURATION
+  mix = {name: SCENARIOS[name][0] for name in SCENARIOS}
+  upstream_latency = DEFAULT_UPSTREAM_LATENCY
+  slack_latency = DEFAULT_SLACK_LATENCY
+  users = DEFAULT_USERS
+  teams = DEFAULT_TEAMS
+  cache = True
+  http_faults = ''
+  db_faults = ''
+  max_error_rate = DEFAULT_MAX_ERROR_RATE
+  i = 0
+  while i < len(argv):
+    if argv[i] == '--stubs':
+      runStubs(float(argv[i + 1]), float(argv[i + 2]))
+      return 0
+    elif argv[i] == '--list':
+      for name in SCENARIOS:
+        print("%-24s %3d" % (name, SCENARIOS[name][0]))
+      return 0
+    elif argv[i] == '--no-cache':
+      cache = False
+      i -= 1
+    elif i + 1 >= len(argv):
+      print("値がありません:", argv[i])
+      return 2
+    elif argv[i] == '--mode' and argv[i + 1] in ('socket', 'http'):
+      mode = argv[i + 1]
+    elif argv[i] == '--rate':
+      rate = float(argv[i + 1])
+    elif argv[i] == '--duration':
+      duration = float(argv[i + 1])
+    elif argv[i] == '--mix':
+      mix = {}
+      for item in argv[i + 1].split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in SCENARIOS:
+          print("不明な操作:", name)
+          return 2
+        mix[name.strip()] = float(weight) if weight != '' else 1.0
+    elif argv[i] == '--upstream-latency':
+      upstream_latency = float(argv[i + 1]) / 1000
+    elif argv[i] == '--slack-latency':
+      slack_latency = float(argv[i + 1]) / 1000
+    elif argv[i] == '--users':
+      users = int(argv[i + 1])
+    elif argv[i] == '--teams':
+      teams = int(argv[i + 1])
+    elif argv[i] == '--http-faults':
+      http_faults = argv[i + 1]
+    elif argv[i] == '--db-faults':
+      db_faults = argv[i + 1]
+    elif argv[i] == '--max-error-rate':
+      max_error_rate = float(argv[i + 1])
+    else:
+      print("不明な引数:", argv[i])
+      return 2
+    i += 2
+
+  try:
+    http_profile = FaultProfile(http_faults)
+    db_profile = FaultProfile(db_faults)
+  except ValueError as e:
+    print(format(e))
+    return 2
+
+  # スタブを起動する
+  stubs = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--stubs', str(upstream_latency), str(slack_latency)],
+    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+  ports = json.loads(stubs.stdout.readline())
+  slack_url = 'http://127.0.0.1:' + str(ports['slack'])
+
+  folder = tempfile.mkdtemp(prefix='covid19-load-')
+  prepareLoadEnvironment(folder, ports, mode, cache)
+  sys.path.insert(0, ROOT)
+  os.chdir(ROOT) # フォントなどを相対パスで読み込むため
+  try:
+    with contextlib.redirect_stdout(io.StringIO()): # appの起動時の表示
+      from fakes import FakeConnection
+      from functions.http_get import httpSetTransport
+      from functions.psql_get import psqlSetConnector
+      from functions.covid19_pipeline import REPORT_JOBS
+      connection = FakeConnection()
+      if http_faults != '':
+        httpSetTransport(FaultyTransport(http_profile))
+      if db_faults != '':
+        psqlSetConnector(FaultyConnector(db_profile, lambda: connection))
+      else:
+        psqlSetConnector(lambda: connection)
+      dispatch = _socketDispatcher() if mode == 'socket' else _httpDispatcher()
+
+    requests = _schedule(mix, rate, duration, users, teams, slack_url)
+    print("%sモードで%d件の操作を%.0f秒間送ります（Webサイト %.0fms、Slack %.0fms）" % (mode, len(requests), duration,
+      upstream_latency * 1000, slack_latency * 1000))
+    executor = ThreadPoolExecutor(max_workers=DISPATCH_WORKERS)
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()): # 各関数の出力を表示しない
+      for request in requests:
+        request.scheduled += start
+        delay = request.scheduled - time.time()
+        if delay > 0:
+          time.sleep(delay)
+        executor.submit(_send, dispatch, request)
+      executor.shutdown(wait=True)
+      settled = _waitSettled(slack_url, REPORT_JOBS)
+    if not settled:
+      print("[LOAD WARNING] " + str(SETTLE_TIMEOUT) + "秒以内に終わらなかった処理があります")
+
+    effects = _getJson(slack_url + '/_effects')
+    end = max([effect[0] for effect in effects] + [request.acked for request in requests] + [start + duration])
+    rows = summarize(requests, effects)
+    error_rate = printReport(rows, end - start)
+    print("所要時間 %.1f秒、Slackへの呼び出し %d件" % (end - start, len(effects)))
+    for name, profile in (('Webサイト', http_profile), ('データベース', db_profile)):
+      if profile.spec != '':
+        print("注入した障害 (%s): %s" % (name, ", ".join(k + "=" + str(v) for k, v in sorted(profile.counts.items())) or 'なし'))
+  finally:
+    stubs.stdin.close()
+    stubs.wait()
+    shutil.rmtree(folder, ignore_errors=True)
+
+  if error_rate > max_error_rate:
+    print("エラー率が上限（%.1f%%）を超えました" % (max_error_rate * 100))
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
+
+#
+# END OF FILE
+#
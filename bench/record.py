@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] record.py
+#
+# [DESCRIPTION]
+#  ベンチマークが用いるWebサイトの応答を実際に取得し、bench/fixtures/ に記録するスクリプト
+#
+# [NOTES]
+#  使い方（ネットワークに接続できる環境で実行する）:
+#    python bench/record.py
+#
+#  各ベンチマークを一回ずつ実行し、その間にアクセスしたURLの応答を記録する。
+#  記録した応答はfakes.pyのFixtureTransportが作成した値より優先して返す。
+#  PostgreSQLとSlackはベンチマークと同じくfakes.pyのオブジェクトを用いる。
+#
+import os
+import sys
+import shutil
+import tempfile
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import ROOT, BENCH_BASE_URL, BENCHMARKS, prepareEnvironment
+from fakes import FIXTURE_FOLDER, FakeConnection, fixtureName
+
+#
+# [FUNCTION] recordingTransport()
+#
+# [DESCRIPTION]
+#  httpSetTransport()に渡す関数。実際に取得した応答を記録してから返す
+#
+# [INPUTS]
+#  url - 対象となるURL
+#
+# [OUTPUTS]
+#  requests.get()の結果
+#
+def recordingTransport(url):
+  result = requests.get(url, timeout=30)
+  if result.status_code == 200 and url.startswith(BENCH_BASE_URL):
+    path = os.path.join(FIXTURE_FOLDER, fixtureName(url[len(BENCH_BASE_URL):]))
+    with open(path, 'w', encoding='utf-8') as f:
+      f.write(result.text)
+    print("[RECORDED]", url, len(result.text), "bytes")
+  else:
+    print("[STATUS CODE]", result.status_code, url)
+  return result
+
+if __name__ == "__main__":
+  folder = tempfile.mkdtemp(prefix='covid19-record-')
+  prepareEnvironment(folder)
+  sys.path.insert(0, ROOT)
+  os.chdir(ROOT)
+  os.makedirs(FIXTURE_FOLDER, exist_ok=True)
+
+  from functions.http_get import httpSetTransport
+  from functions.psql_get import psqlSetConnector
+  httpSetTransport(recordingTransport)
+  connection = FakeConnection()
+  psqlSetConnector(lambda: connection)
+
+  for name in BENCHMARKS:
+    setup, bench, _ = BENCHMARKS[name]
+    try:
+      bench(setup())
+    except Exception as e:
+      print("[RECORD ERROR]", name, format(e))
+  shutil.rmtree(folder, ignore_errors=True)
+
+#
+# END OF FILE
+#
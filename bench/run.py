@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] run.py
+#
+# [DESCRIPTION]
+#  Webサイト、PostgreSQL、Slackの代わりにfakes.pyのオブジェクトを用いて主な関数の処理時間とメモリ使用量を測定するスクリプト
+#
+# [NOTES]
+#  使い方:
+#    python bench/run.py                      全てのベンチマークを実行し、保存した基準値と比較する
+#    python bench/run.py country_info pdf     指定したベンチマークだけを実行する
+#    python bench/run.py --save               結果を基準値として保存する
+#    python bench/run.py --list               ベンチマークの一覧を表示する
+#
+#  オプション:
+#    --iterations <回数>   処理時間を測定する回数（省略時はベンチマークごとの既定値）
+#    --threshold <割合>    基準値より悪化したとみなす割合（省略時は0.25）
+#
+#  ネットワークに接続せずに動作する。ベンチマークごとに別のプロセスで実行し、次の値を求める。
+#   処理時間の分布（最小、中央値、90/99パーセンタイル、最大）
+#   一回の呼び出しで確保したメモリの最大値（tracemalloc）と呼び出し後に残ったメモリ
+#   プロセスの最大常駐メモリ（RSS）
+#
+#  基準値はマシンごとに bench/baselines/<ホスト名>.json に保存する。
+#  中央値、確保したメモリ、最大常駐メモリのいずれかが基準値よりthreshold以上悪化したら終了コード1で終了する。
+#  Webサイトの応答に用いたもの（fixtures: recorded、synthesized、mixed）も保存し、基準値と異なるときは比較しない。
+#
+import os
+import io
+import sys
+import json
+import time
+import platform
+import resource
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+
+# リポジトリのルート
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 基準値を保存するフォルダー
+BASELINE_FOLDER = os.path.join(ROOT, 'bench', 'baselines')
+# ベンチマークで用いるWebサイトのアドレス（fakes.pyが応答する）
+BENCH_BASE_URL = 'https://disease.sh/v3/covid-19/'
+# 基準値より悪化したとみなす割合
+DEFAULT_THRESHOLD = 0.25
+# メモリ使用量を測定する回数
+ALLOCATION_ITERATIONS = 3
+# 対象とする国名
+BENCH_COUNTRY = 'Japan'
+
+# ---------- ベンチマーク ----------
+#
+# 各ベンチマークは (準備する関数, 測定する関数, 既定の回数) とする
+# 準備する関数は測定する関数に渡す値を返す。測定する関数が作成したファイルは測定の外で削除する
+#
+
+def _setupNone():
+  return None
+
+def _benchCountryInfo(state):
+  from functions.covid19 import getCountryInfo
+  return getCountryInfo(BENCH_COUNTRY)
+
+def _benchCountries(state):
+  from functions.covid19 import getCountries
+  return getCountries()
+
+def _benchHistoricalAll(state):
+  from functions.covid19_history import getHistoricalData
+  dateL, caseL, deathL = [], [], []
+  getHistoricalData(BENCH_COUNTRY, 'all', dateL, caseL, deathL)
+  return dateL
+
+def _benchChartMonthly(state):
+  from functions.covid19_chart import chartMonthlyConfiguration
+  path = os.path.join(os.environ['LOCAL_FOLDER'], 'bench-chart.png')
+  chartMonthlyConfiguration(BENCH_COUNTRY, path)
+  return path
+
+def _setupPdf():
+  from functions.covid19_chart import chartMonthlyConfiguration
+  path = os.path.join(os.environ['LOCAL_FOLDER'], 'bench-pdf-chart.png')
+  chartMonthlyConfiguration(BENCH_COUNTRY, path)
+  return path
+
+def _benchPdf(state):
+  from functions.covid19_pdf import pdfGenerateFile
+  from functions.current_time import currentTime
+  return pdfGenerateFile(currentTime(), BENCH_COUNTRY, state)
+
+def _benchCsv(state):
+  from functions.covid19_csv import csvGenerateFile
+  return csvGenerateFile(BENCH_COUNTRY)
+
+def _setupBundle():
+  from fakes import FakeSlackClient
+  return FakeSlackClient()
+
+def _benchBundle(client):
+  from functions.covid19 import Covid19Context
+  from functions.covid19_pipeline import REPORT_PIPELINE
+  artifacts = {
+    'country': BENCH_COUNTRY,
+    'channel': 'C0BENCH',
+    'client': client,
+    'respond': lambda message: None,
+    'context': Covid19Context(BENCH_COUNTRY, share_history=True),
+  }
+  run = REPORT_PIPELINE.run(['show_card', 'upload_bundle'], artifacts)
+  if len(run.failures) > 0:
+    raise RuntimeError("pipeline failed: " + ", ".join(run.failures))
+  return None
+
+BENCHMARKS = {
+  'country_info': (_setupNone, _benchCountryInfo, 200),
+  'countries': (_setupNone, _benchCountries, 50),
+  'historical_all': (_setupNone, _benchHistoricalAll, 100),
+  'chart_monthly': (_setupNone, _benchChartMonthly, 20),
+  'pdf': (_setupPdf, _benchPdf, 20),
+  'csv': (_setupNone, _benchCsv, 50),
+  'report_bundle': (_setupBundle, _benchBundle, 10),
+}
+
+# ---------- 子プロセス ----------
+
+#
+# [FUNCTION] prepareEnvironment()
+#
+# [DESCRIPTION]
+#  functionsを読み込む前に、外部に接続せず毎回同じ処理を行うよう環境変数を設定する
+#
+# [INPUTS]
+#  folder - ファイルを保存するフォルダー
+#
+# [OUTPUTS] なし
+#
+def prepareEnvironment(folder):
+  os.environ['BASE_URL'] = BENCH_BASE_URL
+  os.environ['LOCAL_FOLDER'] = folder
+  os.environ['CACHE_BACKEND'] = 'memory'
+  os.environ['HTTP_CACHE_TTL'] = '0' # 毎回Webサイトの応答を解析する
+  os.environ['CHART_CACHE_TTL'] = '0' # 毎回グラフを描画する
+  os.environ['CACHE_SNAPSHOT_INTERVAL'] = '0'
+  os.environ['METRICS_PORT'] = '0'
+  os.environ['PY_ENV'] = 'benchmark'
+  for name in ('DB_URL', 'TRACE_PATH', 'TRACE_ENDPOINT', 'PROFILE_LISTENERS'):
+    os.environ.pop(name, None)
+
+#
+# [FUNCTION] runChild()
+#
+# [DESCRIPTION]
+#  一つのベンチマークを実行し、結果を標準出力の最後の行にJSONで出力する
+#
+# [INPUTS]
+#  name - ベンチマーク名
+#  iterations - 処理時間を測定する回数
+#
+# [OUTPUTS] なし
+#
+def runChild(name, iterations):
+  folder = tempfile.mkdtemp(prefix='covid19-bench-')
+  prepareEnvironment(folder)
+  sys.path.insert(0, ROOT)
+  sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+  os.chdir(ROOT) # フォントなどを相対パスで読み込むため
+
+  stdout = sys.stdout
+  with contextlib.redirect_stdout(io.StringIO()): # 各関数の出力を表示しない
+    from fakes import FixtureTransport, FakeConnection
+    from functions.http_get import httpSetTransport
+    from functions.psql_get import psqlSetConnector
+    transport = FixtureTransport(BENCH_BASE_URL)
+    httpSetTransport(transport)
+    connection = FakeConnection()
+    psqlSetConnector(lambda: connection)
+
+    setup, bench, _ = BENCHMARKS[name]
+    state = setup()
+    _cleanup(bench(state), state) # 初回の読み込み（フォント、変換表など）を除く
+
+    samples = []
+    for i in range(iterations):
+      start = time.perf_counter()
+      result = bench(state)
+      samples.append(time.perf_counter() - start)
+      _cleanup(result, state)
+
+    tracemalloc.start()
+    peak = 0
+    retained = 0
+    for i in range(ALLOCATION_ITERATIONS):
+      before = tracemalloc.get_traced_memory()[0]
+      tracemalloc.reset_peak()
+      result = bench(state)
+      current, allocated = tracemalloc.get_traced_memory()
+      peak = max(peak, allocated - before)
+      retained = max(retained, current - before)
+      _cleanup(result, state)
+    tracemalloc.stop()
+    requests = transport.requests
+    sources = transport.sources
+
+  samples.sort()
+  report = {
+    'name': name,
+    'iterations': iterations,
+    'min': samples[0],
+    'p50': _percentile(samples, 0.5),
+    'p90': _percentile(samples, 0.9),
+    'p99': _percentile(samples, 0.99),
+    'max': samples[-1],
+    'mean': sum(samples) / len(samples),
+    'alloc_peak': peak,
+    'alloc_retained': retained,
+    'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, # Linuxではキロバイト単位
+    'upstream_requests': requests,
+    'fixtures': 'mixed' if len(sources) > 1 else (list(sources)[0] if len(sources) == 1 else 'none'),
+  }
+  shutil.rmtree(folder, ignore_errors=True)
+  stdout.write(json.dumps(report) + "\n")
+
+# 測定する関数が作成したファイルを削除する
+def _cleanup(result, state):
+  if isinstance(result, str) and result != state and os.path.isfile(result):
+    os.remove(result)
+
+# ソート済みの値のパーセンタイル
+def _percentile(samples, ratio):
+  index = min(len(samples) - 1, int(round(ratio * (len(samples) - 1))))
+  return samples[index]
+
+# ---------- 親プロセス ----------
+
+#
+# [FUNCTION] runBenchmark()
+#
+# [DESCRIPTION]
+#  別のプロセスでベンチマークを実行し、結果を求める
+#
+# [INPUTS]
+#  name - ベンチマーク名
+#  iterations - 処理時間を測定する回数（Noneのときは既定値）
+#
+# [OUTPUTS]
+#  結果の辞書。失敗したらNone
+#
+def runBenchmark(name, iterations):
+  if iterations == None:
+    iterations = BENCHMARKS[name][2]
+  process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--iterations', str(iterations)],
+    capture_output=True, text=True)
+  lines = process.stdout.strip().splitlines()
+  if process.returncode != 0 or len(lines) == 0:
+    print("[BENCH ERROR]", name)
+    print(process.stderr)
+    return None
+  return json.loads(lines[-1])
+
+#
+# [FUNCTION] compareBaseline()
+#
+# [DESCRIPTION]
+#  結果を基準値と比較し、悪化した項目を求める
+#
+# [INPUTS]
+#  report - runBenchmark()の結果
+#  baseline - 同じベンチマークの基準値（Noneのときは比較しない）
+#  threshold - 悪化したとみなす割合
+#
+# [OUTPUTS]
+#  悪化した項目名のリスト
+#
+# [NOTES]
+#  Webサイトの応答に用いたもの（記録した応答か、作成した値か）が基準値と異なるときは比較しない
+#
+def compareBaseline(report, baseline, threshold):
+  regressions = []
+  if baseline == None or not sameFixtures(report, baseline):
+    return regressions
+  for key in ('p50', 'alloc_peak', 'max_rss'):
+    if baseline.get(key, 0) > 0 and report[key] > baseline[key] * (1 + threshold):
+      regressions.append(key)
+  return regressions
+
+# Webサイトの応答に用いたものが基準値と同じか（記録していない古い基準値は作成した値を用いたとみなす）
+def sameFixtures(report, baseline):
+  return report.get('fixtures') == baseline.get('fixtures', 'synthesized')
+
+# 基準値のファイル名
+def baselinePath():
+  return os.path.join(BASELINE_FOLDER, platform.node() + '.json')
+
+# 表示用の単位
+def _ms(seconds):
+  return "%8.2f" % (seconds * 1000)
+
+def _mb(size):
+  return "%8.2f" % (size / (1024 * 1024))
+
+# 基準値との差
+def _delta(report, baseline, key):
+  if baseline == None or baseline.get(key, 0) <= 0:
+    return "       -"
+  return "%+7.1f%%" % ((report[key] / baseline[key] - 1) * 100)
+
+def main(argv):
+  names = []
+  iterations = None
+  threshold = DEFAULT_THRESHOLD
+  save = False
+  i = 0
+  while i < len(argv):
+    if argv[i] == '--child':
+      runChild(argv[i + 1], int(argv[i + 3]))
+      return 0
+    elif argv[i] == '--iterations':
+      iterations = int(argv[i + 1])
+      i += 1
+    elif argv[i] == '--threshold':
+      threshold = float(argv[i + 1])
+      i += 1
+    elif argv[i] == '--save':
+      save = True
+    elif argv[i] == '--list':
+      for name in BENCHMARKS:
+        print(name)
+      return 0
+    elif argv[i] in BENCHMARKS:
+      names.append(argv[i])
+    else:
+      print("不明な引数:", argv[i])
+      return 2
+    i += 1
+  if len(names) == 0:
+    names = list(BENCHMARKS)
+
+  baselines = {}
+  if os.path.exists(baselinePath()):
+    with open(baselinePath(), encoding='utf-8') as f:
+      baselines = json.load(f)
+
+  print("%-15s %8s %8s %8s %8s %8s %8s %8s %8s" % ('benchmark', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)', 'alloc(MB)', 'rss(MB)', 'Δp50', 'Δalloc'))
+  reports = {}
+  failed = []
+  for name in names:
+    report = runBenchmark(name, iterations)
+    if report == None:
+      failed.append(name)
+      continue
+    reports[name] = report
+    baseline = baselines.get(name)
+    if baseline != None and not sameFixtures(report, baseline):
+      print("[BENCH WARNING]", name, "の基準値は応答が異なるため比較しない（基準値:", baseline.get('fixtures', 'synthesized'), "今回:", report['fixtures'] + "）")
+      baseline = None
+    regressions = compareBaseline(report, baseline, threshold)
+    if len(regressions) > 0:
+      failed.append(name + " (" + ", ".join(regressions) + ")")
+    print("%-15s %s %s %s %s %s %s %s %s" % (name, _ms(report['p50']), _ms(report['p90']), _ms(report['p99']), _ms(report['max']),
+      _mb(report['alloc_peak']), _mb(report['max_rss']), _delta(report, baseline, 'p50'), _delta(report, baseline, 'alloc_peak')))
+
+  if save:
+    baselines.update(reports)
+    os.makedirs(BASELINE_FOLDER, exist_ok=True)
+    with open(baselinePath(), 'w', encoding='utf-8') as f:
+      json.dump(baselines, f, indent=2)
+    print("基準値を保存しました:", baselinePath())
+    return 0 if len(reports) == len(names) else 1
+
+  if len(failed) > 0:
+    print("悪化あるいは失敗:", ", ".join(failed))
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
+
+#
+# END OF FILE
+#
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] cache.py
+#
+# [DESCRIPTION]
+#  取得したデータや作成したファイルを有効期限付きで保持するキャッシュを定義するファイル
+#
+# [NOTES]
+#  環境変数CACHE_BACKENDで保持する場所を選択する
+#   memory - プロセス内のメモリ（省略時）
+#   sqlite - SQLiteのデータベースファイル（WALモード）。同じファイルを指定したプロセス間で共有される
+#
+#  値はpickleで直列化して保持するため、取り出した値を変更してもキャッシュには影響しない。
+#
+#  memoryのときは、保持している値をスナップショットファイルに定期的に（および終了時に）保存し、
+#  起動時に有効期限内の値を読み込む（cacheStartSnapshots()参照）。sqliteのファイルはそのまま再利用される。
+#
+import os
+import time
+import zlib
+import atexit
+import pickle
+import sqlite3
+import threading
+from .metrics import metricsCacheResult
+from dotenv import load_dotenv
+load_dotenv()
+
+# キャッシュの種類
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+# sqliteのときのデータベースファイル名
+CACHE_PATH = os.environ.get("CACHE_PATH", os.path.join(os.environ.get("LOCAL_FOLDER", "."), "cache.sqlite3"))
+# getOrLoad()で他のプロセスの取得を待つ最大秒数
+LOAD_WAIT_SECONDS = 10
+# スナップショットファイル名
+CACHE_SNAPSHOT_PATH = os.environ.get("CACHE_SNAPSHOT_PATH", os.path.join(os.environ.get("LOCAL_FOLDER", "."), "cache.snapshot"))
+# スナップショットを保存する間隔（秒）。0のときはスナップショットを用いない
+CACHE_SNAPSHOT_INTERVAL = int(os.environ.get("CACHE_SNAPSHOT_INTERVAL", "300"))
+# スナップショットファイルの形式の版
+SNAPSHOT_VERSION = 1
+
+#
+# [CLASS] Cache
+#
+# [DESCRIPTION]
+#  キャッシュの共通部分。get()、set()、delete()、_lease()、_release()を実装したクラスから継承する
+#
+class Cache:
+  def __init__(self):
+    self._locks = {} # 取得中のキーごとの [ロック, 待っているスレッド数]
+    self._lock = threading.Lock()
+
+  #
+  # [METHOD] getOrLoad()
+  #
+  # [DESCRIPTION]
+  #  キャッシュに値があればそれを返し、なければloader()で取得して保持する
+  #
+  # [INPUTS]
+  #  key - キー（文字列）
+  #  ttl - 有効期限（秒）
+  #  loader - 値を取得する関数。Noneを返したときは保持しない
+  #
+  # [OUTPUTS]
+  #  値。取得できなければNone
+  #
+  # [NOTES]
+  #  同じキーを同時に取得しようとしたときは、一つのスレッド（共有するキャッシュでは一つのプロセス）だけが
+  #  loader()を呼び、他はその結果を待つ。
+  #
+  def getOrLoad(self, key, ttl, loader):
+    value = self.get(key)
+    if value != None:
+      metricsCacheResult(key, True)
+      return value
+
+    with self._lock:
+      entry = self._locks.get(key)
+      if entry == None:
+        entry = self._locks[key] = [threading.Lock(), 0]
+      entry[1] += 1
+    try:
+      with entry[0]:
+        return self._load(key, ttl, loader)
+    finally:
+      # 待っているスレッドがなくなったらロックを削除する（キーは利用者の入力から作られ、際限なく増えるため）
+      with self._lock:
+        entry[1] -= 1
+        if entry[1] == 0:
+          del self._locks[key]
+
+  # キーのロックを得た後で、値を取得して保持する
+  def _load(self, key, ttl, loader):
+    value = self.get(key) # 待っている間に他のスレッドが取得した
+    if value != None:
+      metricsCacheResult(key, True)
+      return value
+
+    # 他のプロセスが取得中であれば、その結果を待つ
+    deadline = time.monotonic() + LOAD_WAIT_SECONDS
+    while not self._lease(key, LOAD_WAIT_SECONDS):
+      if time.monotonic() > deadline:
+        break
+      time.sleep(0.05)
+      value = self.get(key)
+      if value != None:
+        metricsCacheResult(key, True)
+        return value
+
+    metricsCacheResult(key, False)
+    try:
+      value = loader()
+      if value != None:
+        self.set(key, value, ttl)
+    finally:
+      self._release(key)
+    return value
+
+  # 取得する権利を得る（プロセス内のキャッシュでは常に得られる）
+  def _lease(self, key, seconds):
+    return True
+
+  # 取得する権利を手放す
+  def _release(self, key):
+    pass
+
+#
+# [CLASS] MemoryCache
+#
+# [DESCRIPTION]
+#  プロセス内のメモリに保持するキャッシュ
+#
+# [INPUTS]
+#  max_entries - 保持する項目数の上限。超えたら期限切れの項目を削除し、なお超えていれば古いものから削除する
+#
+class MemoryCache(Cache):
+  def __init__(self, max_entries=1024):
+    super().__init__()
+    self.max_entries = max_entries
+    self._entries = {} # {<キー>: (有効期限, 直列化した値)}
+
+  #
+  # [METHOD] get()
+  #
+  # [DESCRIPTION]
+  #  有効期限内の値を取り出す。なければNone
+  #
+  def get(self, key):
+    entry = self._entries.get(key)
+    if entry == None or entry[0] < time.time():
+      return None
+    return pickle.loads(entry[1])
+
+  #
+  # [METHOD] set()
+  #
+  # [DESCRIPTION]
+  #  値をttl秒の有効期限で保持する
+  #
+  def set(self, key, value, ttl):
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (time.time() + ttl, data)
+      if len(self._entries) > self.max_entries:
+        self._evict()
+
+  #
+  # [METHOD] delete()
+  #
+  # [DESCRIPTION]
+  #  値を削除する
+  #
+  def delete(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  #
+  # [METHOD] entries()
+  #
+  # [DESCRIPTION]
+  #  有効期限内の項目の写しを取り出す
+  #
+  # [OUTPUTS]
+  #  {<キー>: (有効期限, 直列化した値)}
+  #
+  def entries(self):
+    now = time.time()
+    with self._lock:
+      return {k: v for k, v in self._entries.items() if v[0] >= now}
+
+  #
+  # [METHOD] restore()
+  #
+  # [DESCRIPTION]
+  #  entries()で取り出した項目のうち、有効期限内で、保持しているものより新しい項目を加える
+  #
+  # [OUTPUTS]
+  #  加えた項目数
+  #
+  def restore(self, entries):
+    now = time.time()
+    count = 0
+    with self._lock:
+      for key, entry in entries.items():
+        if entry[0] < now:
+          continue
+        current = self._entries.get(key)
+        if current == None or current[0] < entry[0]:
+          self._entries[key] = entry
+          count += 1
+      if len(self._entries) > self.max_entries:
+        self._evict()
+    return count
+
+  # 期限切れの項目を削除し、なお多ければ古く保持したものから削除する（self._lockを獲得して呼ぶ）
+  def _evict(self):
+    now = time.time()
+    for key in [k for k, v in self._entries.items() if v[0] < now]:
+      del self._entries[key]
+    while len(self._entries) > self.max_entries:
+      del self._entries[next(iter(self._entries))]
+
+#
+# [CLASS] SQLiteCache
+#
+# [DESCRIPTION]
+#  SQLiteのデータベースファイルに保持するキャッシュ。同じファイルを開いたプロセス間で共有される
+#
+# [INPUTS]
+#  path - データベースファイル名
+#
+# [NOTES]
+#  WALモードで開くため、書き込み中でも他のプロセスは読み出せる。
+#  接続はスレッドごと（fork後は新たなプロセスで）に作成する。
+#
+class SQLiteCache(Cache):
+  def __init__(self, path):
+    super().__init__()
+    self.path = path
+    self._local = threading.local()
+    self._writes = 0
+    conn = self._connection()
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value BLOB)")
+    conn.execute("CREATE TABLE IF NOT EXISTS lease (key TEXT PRIMARY KEY, expires REAL)")
+
+  def get(self, key):
+    row = self._connection().execute(
+      "SELECT value FROM cache WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+    if row == None:
+      return None
+    return pickle.loads(row[0])
+
+  def set(self, key, value, ttl):
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    conn = self._connection()
+    conn.execute("INSERT OR REPLACE INTO cache (key, expires, value) VALUES (?, ?, ?)",
+                 (key, time.time() + ttl, sqlite3.Binary(data)))
+    self._writes += 1
+    if self._writes % 100 == 0:
+      conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),)) # 期限切れの項目を削除する
+
+  def delete(self, key):
+    self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+  # 取得中であることを他のプロセスに示す行を作成する。既に有効な行があれば作成できない
+  def _lease(self, key, seconds):
+    now = time.time()
+    conn = self._connection()
+    conn.execute("DELETE FROM lease WHERE key = ? AND expires < ?", (key, now))
+    cursor = conn.execute("INSERT OR IGNORE INTO lease (key, expires) VALUES (?, ?)", (key, now + seconds))
+    return cursor.rowcount == 1
+
+  def _release(self, key):
+    self._connection().execute("DELETE FROM lease WHERE key = ?", (key,))
+
+  # このスレッド（プロセス）の接続。autocommitで開く
+  def _connection(self):
+    conn = getattr(self._local, 'conn', None)
+    if conn == None or self._local.pid != os.getpid():
+      conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      self._local.conn = conn
+      self._local.pid = os.getpid()
+    return conn
+
+#
+# [FUNCTION] createCache()
+#
+# [DESCRIPTION]
+#  環境変数CACHE_BACKENDに応じたキャッシュを作成する
+#
+# [INPUTS] なし
+#
+# [OUTPUTS]
+#  MemoryCacheあるいはSQLiteCache
+#
+def createCache():
+  if CACHE_BACKEND == 'sqlite':
+    try:
+      return SQLiteCache(CACHE_PATH)
+    except Exception as e:
+      print("[CACHE ERROR]", format(e))
+  return MemoryCache()
+
+# アプリ全体で共有するキャッシュ
+CACHE = createCache()
+
+#
+# [FUNCTION] cacheSaveSnapshot()
+#
+# [DESCRIPTION]
+#  キャッシュの有効期限内の項目をスナップショットファイルに保存する
+#
+# [INPUTS]
+#  path - スナップショットファイル名
+#
+# [OUTPUTS]
+#  保存した項目数
+#
+# [NOTES]
+#  既存のファイルの項目と併合する（複数のワーカーが同じファイルに保存しても他のワーカーの項目を失わない）。
+#  一時ファイルに書き込んでから置き換えるため、読み込み中のプロセスが壊れたファイルを読むことはない。
+#
+def cacheSaveSnapshot(path=CACHE_SNAPSHOT_PATH):
+  if not isinstance(CACHE, MemoryCache):
+    return 0
+
+  entries = _readSnapshot(path)
+  for key, entry in CACHE.entries().items():
+    if key not in entries or entries[key][0] < entry[0]:
+      entries[key] = entry
+  now = time.time()
+  entries = {k: v for k, v in entries.items() if v[0] >= now}
+
+  data = {'version': SNAPSHOT_VERSION, 'saved': now, 'entries': entries}
+  temp_path = path + "." + str(os.getpid())
+  try:
+    with open(temp_path, 'wb') as f:
+      f.write(zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(temp_path, path)
+  except Exception as e:
+    print("[CACHE ERROR]", format(e))
+    return 0
+  return len(entries)
+
+#
+# [FUNCTION] cacheLoadSnapshot()
+#
+# [DESCRIPTION]
+#  スナップショットファイルから有効期限内の項目をキャッシュに読み込む
+#
+# [INPUTS]
+#  path - スナップショットファイル名
+#
+# [OUTPUTS]
+#  読み込んだ項目数
+#
+def cacheLoadSnapshot(path=CACHE_SNAPSHOT_PATH):
+  if not isinstance(CACHE, MemoryCache):
+    return 0
+  return CACHE.restore(_readSnapshot(path))
+
+#
+# [FUNCTION] cacheStartSnapshots()
+#
+# [DESCRIPTION]
+#  スナップショットを読み込み、CACHE_SNAPSHOT_INTERVAL秒ごとと終了時に保存するよう設定する
+#
+# [INPUTS] なし
+#
+# [OUTPUTS] なし
+#
+# [NOTES]
+#  プロセスごとに一度だけ働く。起動処理（app.pyの__main__、gunicornのpost_fork）から呼び、
+#  fork前のプロセスでは呼ばないこと（保存中のスレッドがロックを獲得したままforkされることがある）。
+#
+snapshot_pid = None # スナップショットを設定したプロセスID
+def cacheStartSnapshots():
+  global snapshot_pid
+  if CACHE_SNAPSHOT_INTERVAL <= 0 or not isinstance(CACHE, MemoryCache):
+    return
+  if snapshot_pid == os.getpid():
+    return
+
+  if snapshot_pid == None:
+    atexit.register(_saveAtExit) # fork後のプロセスは登録を引き継ぐ
+  snapshot_pid = os.getpid()
+  count = cacheLoadSnapshot()
+  print("[CACHE] スナップショットから", count, "件を読み込みました")
+  threading.Thread(target=_snapshotLoop, daemon=True, name='cache-snapshot').start()
+
+# ---------- Utilities ----------
+
+# スナップショットファイルの項目。ファイルがないか、形式が異なれば空
+def _readSnapshot(path):
+  try:
+    with open(path, 'rb') as f:
+      data = pickle.loads(zlib.decompress(f.read()))
+  except FileNotFoundError:
+    return {}
+  except Exception as e:
+    print("[CACHE ERROR]", format(e))
+    return {}
+  if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+    return {}
+  return data['entries']
+
+# 定期的にスナップショットを保存する
+def _snapshotLoop():
+  while True:
+    time.sleep(CACHE_SNAPSHOT_INTERVAL)
+    cacheSaveSnapshot()
+
+# 終了時にスナップショットを保存する
+def _saveAtExit():
+  if snapshot_pid == os.getpid():
+    cacheSaveSnapshot()
+
+#
+# END OF FILE
+#
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] circuit_breaker.py
+#
+# [DESCRIPTION]
+#  Webサイトのエンドポイントごとに、障害が続いたらアクセスを止めるサーキットブレーカーを定義するファイル
+#
+# [NOTES]
+#  状態はプロセス内のメモリに保持する（gunicornではワーカーごとに判定する）。
+#   closed - 通常どおりアクセスする。続けてBREAKER_THRESHOLD回失敗したらopenにする
+#   open - アクセスせずにすぐ失敗とする。BREAKER_RESET_SECONDS秒経ったらhalf_openにする
+#   half_open - 一つのリクエストだけ試しにアクセスし、成功したらclosed、失敗したらopenに戻す
+#
+import os
+import time
+import threading
+from .metrics import Gauge
+from dotenv import load_dotenv
+load_dotenv()
+
+# 続けて失敗したらアクセスを止める回数
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "5"))
+# アクセスを止めてから試しにアクセスするまでの秒数
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+# 状態
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# {<名前>: CircuitBreaker}
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+#
+# [CLASS] CircuitBreaker
+#
+# [DESCRIPTION]
+#  一つのエンドポイントのサーキットブレーカー
+#
+# [INPUTS]
+#  name - 名前（エンドポイント名）
+#  threshold - 続けて失敗したらopenにする回数
+#  reset_seconds - openにしてからhalf_openにするまでの秒数
+#
+class CircuitBreaker:
+  def __init__(self, name, threshold=BREAKER_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+    self.name = name
+    self.threshold = threshold
+    self.reset_seconds = reset_seconds
+    self.state = STATE_CLOSED
+    self.failures = 0 # 続けて失敗した回数
+    self._opened = 0.0 # openにした時刻
+    self._probe = None # half_openで試しにアクセスを始めた時刻
+    self._lock = threading.Lock()
+
+  #
+  # [METHOD] allow()
+  #
+  # [DESCRIPTION]
+  #  アクセスしてよいか判定する。アクセスしたら結果をsuccess()あるいはfailure()で知らせる
+  #
+  # [OUTPUTS]
+  #  アクセスしてよければTrue、すぐに失敗とするならFalse
+  #
+  # [NOTES]
+  #  closedのときはロックを取らずに判定する。
+  #  試しのアクセスが結果を知らせないまま reset_seconds 秒経ったときは、次のリクエストで試し直す。
+  #
+  def allow(self):
+    if self.state == STATE_CLOSED:
+      return True
+    now = time.monotonic()
+    with self._lock:
+      if self.state == STATE_CLOSED:
+        return True
+      if self.state == STATE_OPEN:
+        if now - self._opened < self.reset_seconds:
+          return False
+        self.state = STATE_HALF_OPEN
+        self._probe = None
+      if self._probe != None and now - self._probe < self.reset_seconds:
+        return False
+      self._probe = now
+      return True
+
+  #
+  # [METHOD] success()
+  #
+  # [DESCRIPTION]
+  #  アクセスに成功したことを知らせる
+  #
+  def success(self):
+    if self.state == STATE_CLOSED and self.failures == 0:
+      return
+    with self._lock:
+      if self.state != STATE_CLOSED:
+        print("[CIRCUIT CLOSED]", self.name)
+      self.state = STATE_CLOSED
+      self.failures = 0
+      self._probe = None
+
+  #
+  # [METHOD] failure()
+  #
+  # [DESCRIPTION]
+  #  アクセスに失敗したことを知らせる
+  #
+  def failure(self):
+    with self._lock:
+      self.failures += 1
+      if self.state == STATE_HALF_OPEN or self.failures >= self.threshold:
+        if self.state != STATE_OPEN:
+          print("[CIRCUIT OPEN]", self.name, self.failures)
+        self.state = STATE_OPEN
+        self._opened = time.monotonic()
+        self._probe = None
+
+#
+# [FUNCTION] circuitBreaker()
+#
+# [DESCRIPTION]
+#  名前に対応するサーキットブレーカーを求める。なければ作成する
+#
+# [INPUTS]
+#  name - 名前（エンドポイント名）
+#
+# [OUTPUTS]
+#  CircuitBreaker
+#
+def circuitBreaker(name):
+  breaker = _BREAKERS.get(name)
+  if breaker != None:
+    return breaker
+  with _BREAKERS_LOCK:
+    return _BREAKERS.setdefault(name, CircuitBreaker(name))
+
+#
+# [FUNCTION] circuitStates()
+#
+# [DESCRIPTION]
+#  サーキットブレーカーごとの状態を求める
+#
+# [OUTPUTS]
+#  {<名前>: <状態>}
+#
+def circuitStates():
+  with _BREAKERS_LOCK:
+    return {name: breaker.state for name, breaker in _BREAKERS.items()}
+
+# 集計する項目（open、half_openのときに1）
+Gauge('covid19_circuit_open', 'アクセスを止めているエンドポイント（1: 止めている）',
+  lambda: {(name,): 0 if state == STATE_CLOSED else 1 for name, state in circuitStates().items()}, ('endpoint',))
+
+#
+# END OF FILE
+#
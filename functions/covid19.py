@@ -9,9 +9,14 @@
 #
 import os
 import math
-from .http_get import httpGet
+import datetime
+import threading
+from .http_get import httpGet, httpGetWithFallback
+from .cache import CACHE
 from .psql_get import psqlGet
-from .covid19_comment import commentGet
+from .covid19_comment import commentIterate
+from .covid19_history import getHistoricalData, iterHistoricalData
+from .covid19_export import exportFormats
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -26,6 +31,10 @@ if (NUM_MENUITEMS == None):
 numMenuItems = 20
 if NUM_MENUITEMS != None:
   numMenuItems = int(NUM_MENUITEMS)
+# 国名の日本語変換表をキャッシュに保持する秒数
+COUNTRY_TABLE_TTL = 24 * 60 * 60
+# 注釈をデータベースから一度に読み込む件数
+COMMENT_CHUNK_SIZE = 50
 
 # ---------- Functions ----------
 
@@ -50,7 +59,8 @@ def translateCountryName(country):
 
   global hashtable # 国名ハッシュテーブルを再利用するためグローバル化
   if hashtable == None:
-    hashtable = _createCountryHashTable()
+    # 他のプロセスが作成した変換表があれば、データベースにアクセスせずに用いる
+    hashtable = CACHE.getOrLoad('countries:hashtable', COUNTRY_TABLE_TTL, _createCountryHashTable)
 
   if hashtable != None:
     #dest = country.replace("'", "''").lower()
@@ -72,6 +82,7 @@ def translateCountryName(country):
 #
 # [INPUTS]
 #　country - 対象となる国名
+#  context - Covid19Context（省略時は新たに生成する）
 #
 # [OUTPUTS]
 #  成功: {blocks:[<見出し>, <セクション>]}
@@ -85,20 +96,17 @@ def translateCountryName(country):
 # 
 #  '{:,}'.format() は数値を三桁区切りにする。
 #
-def getCountryInfo(country):
+def getCountryInfo(country, context=None):
 
   retVal = None
-  # 対象URLにアクセスし、結果をJSONで取得する
-  url = BASE_URL + "countries/" + country
-  if country == 'all':
-    url = BASE_URL + "all"
-  result = httpGet(url)
+  if context == None:
+    context = Covid19Context(country)
+  # 対象URLにアクセスし、結果をJSONで取得する（接続できなければ前回取得した値を用いる）
+  result, stale = context.snapshotWithFallback()
 
   blocks = []
   if result != None:
-    translated = translateCountryName(country) #日本語国名へ変換
-    if translated == None:
-      translated = country
+    translated = context.translated() #日本語国名へ変換
     population = '{:,}'.format(int(result['population'])) #人口
     # 見出しの構造を生成する
     title = "[国名] " + translated + " [人口] " + population
@@ -112,6 +120,20 @@ def getCountryInfo(country):
     }
     blocks.append(objheader)
 
+    # Webサイトに接続できないときは、古いデータであることを表示する
+    if stale != None:
+      formatted = datetime.datetime.fromtimestamp(stale).strftime("%Y-%m-%d %H:%M")
+      objStale = {
+        "type": "context",
+        "elements": [
+          {
+            "type": "mrkdwn",
+            "text": ":warning: Webサイトに接続できないため、" + formatted + " に取得したデータを表示しています"
+          }
+        ]
+      }
+      blocks.append(objStale)
+
     active    = '{:,}'.format(int(result['active']))    # 感染者数
     critical  = '{:,}'.format(int(result['critical']))  # 重病者数
     recovered = '{:,}'.format(int(result['recovered'])) # 退院・療養終了
@@ -151,10 +173,10 @@ def getCountryInfo(country):
     }
     blocks.append(objBody)
 
-    # 注釈を表示する
-    comments = commentGet(country)
-    if comments != None and len(comments) > 0:
-      dt = comments[0][0] # comments[0]は(日時, コメント)のタプルから構成される
+    # 最新の注釈を表示する
+    comment = context.latestComment()
+    if comment != None:
+      dt = comment[0] # commentは(日時, コメント)のタプルから構成される
       formatted = dt.strftime("%Y-%m-%d %H:%M:%S")
       objComment = {
         "type": "section",
@@ -165,7 +187,7 @@ def getCountryInfo(country):
           },
           {
             "type": "mrkdwn",
-            "text": "*注釈:* " + comments[0][1]
+            "text": "*注釈:* " + comment[1]
           },
         ]
       }
@@ -197,6 +219,16 @@ def getCountryInfo(country):
           "value": country, # アクション関数action-graph-history()に渡す引数
           "action_id": "action-graph-history"
         },
+        {
+          "type": "button",
+          "text": {
+            "type": "plain_text",
+            "text": "全期間グラフ",
+            #"emoji": True
+          },
+          "value": country, # アクション関数action-graph-history-all()に渡す引数
+          "action_id": "action-graph-history-all"
+        },
         {
           "type": "button",
           "text": {
@@ -219,6 +251,26 @@ def getCountryInfo(country):
           "value": country, # アクション関数action-csv-generate()に渡す引数
           "action_id": "action-csv-generate"
         },
+        {
+          "type": "button",
+          "text": {
+            "type": "plain_text",
+            "text": "一括出力",
+            #"emoji": True
+          },
+          "value": country, # アクション関数action-report-bundle()に渡す引数
+          "action_id": "action-report-bundle"
+        },
+        {
+          "type": "static_select",
+          "placeholder": {
+            "type": "plain_text",
+            "text": "出力形式",
+          },
+          # 選択した値 <形式>:<国名> をアクション関数action-export-generate()に渡す
+          "options": [_exportOption(fmt, country) for fmt in exportFormats()],
+          "action_id": "action-export-generate"
+        },
         {
           "type": "button",
           "text": {
@@ -372,6 +424,220 @@ def getCountries():
 
   return retVal
 
+#
+# [FUNCTION] getCountrySnapshots()
+#
+# [DESCRIPTION]
+#  複数の国の新型コロナウィルス感染状況を一回のリクエストで取得する
+# 
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+# 
+# [OUTPUTS]
+#  成功: Webサイトが返す感染状況（JSON構造）のリスト。見つからなかった国は含まれない
+#  失敗: None
+# 
+# [NOTES]
+#  アクセスするURL:
+#   https://disease.sh/v3/covid-19/countries/<Country1>,<Country2>,...
+#
+#  対象国が一つの場合、結果はリストではなく辞書となる。
+#
+def getCountrySnapshots(countries):
+  if countries == None or len(countries) == 0:
+    return None
+
+  result = httpGet(BASE_URL + "countries/" + ",".join(countries))
+  if result == None:
+    return None
+  if isinstance(result, dict):
+    result = [result]
+
+  return [item for item in result if item != None and "country" in item]
+
+#
+# [FUNCTION] getCountryNames()
+#
+# [DESCRIPTION]
+#  Webサイトから利用可能な全ての国名を取得する
+# 
+# [INPUTS] 指定なし
+# 
+# [OUTPUTS]
+#  成功: 国名（英語表記）のリスト
+#  失敗: None
+# 
+# [NOTES]
+#  アクセスするURL:
+#   https://disease.sh/v3/covid-19/countries
+#
+def getCountryNames():
+  result = httpGet(BASE_URL + "countries")
+  if result == None or len(result) == 0:
+    return None
+
+  return [item['country'] for item in result]
+
+#
+# [FUNCTION] getContinentCountries()
+#
+# [DESCRIPTION]
+#  指定した大陸（地域）に属する国名のリストを取得する
+# 
+# [INPUTS]
+#  continent - 大陸名 (Asia, Europe, Africa, North America, South America, Australia-Oceania)
+# 
+# [OUTPUTS]
+#  成功: 国名（英語表記）のリスト
+#  失敗: None
+# 
+# [NOTES]
+#  アクセスするURL:
+#   https://disease.sh/v3/covid-19/continents/<Continent>
+#
+def getContinentCountries(continent):
+  if continent == None or continent == '':
+    return None
+
+  result = httpGet(BASE_URL + "continents/" + continent)
+  if result == None or "countries" not in result:
+    return None
+
+  return result["countries"]
+
+#
+# [CLASS] Covid19Context
+#
+# [DESCRIPTION]
+#  一回の操作（スラッシュコマンドやボタン）の間、対象国のデータを共有するためのコンテキスト
+#  getCountryInfo()、グラフを描画する関数、pdfGenerateFile()に同じコンテキストを渡すと、
+#  感染状況、注釈、日本語国名、履歴はそれぞれ最初に必要になった時点で一度だけ取得される
+#
+# [INPUTS]
+#  country - 対象となる国名
+#  share_history - Trueのとき全期間の履歴を一度だけ取得し、日数を指定した履歴はその末尾から切り出す
+#                  （グラフ、PDF、CSVをまとめて作成するときに用いる）
+#
+# [NOTES]
+#  取得に失敗した結果(None)も保持し、同じ操作の中では再取得しない。
+#  複数のスレッドから同時に呼ばれても、同じデータを二重に取得しない。
+#  注釈は全件を保持せず、最初のCOMMENT_CHUNK_SIZE件と、同じ問い合わせの続きを読み込むイテレーターを保持する。
+#
+class Covid19Context:
+  def __init__(self, country, share_history=False):
+    self.country = country
+    self.share_history = share_history
+    self._values = {} # 取得済みのデータ
+    self._locks = {}  # データごとのロック
+    self._lock = threading.Lock()
+
+  #
+  # 感染状況（Webサイトが返すJSON構造）。失敗したらNone
+  #  https://disease.sh/v3/covid-19/countries/<country>
+  #  あるいはcountryがallのときは https://disease.sh/v3/covid-19/all
+  #  Webサイトに接続できず前回取得した値しかないときもNone（グラフやPDFには古い値を用いない）
+  #
+  def snapshot(self):
+    data, stale = self.snapshotWithFallback()
+    return data if stale == None else None
+
+  #
+  # 感染状況と、Webサイトに接続できずに前回取得した値を返したときはその値を取得した時刻（time.time()）
+  #  (JSON構造, 時刻あるいはNone)。感染状況を表示するカード（getCountryInfo()）だけが用いる
+  #
+  def snapshotWithFallback(self):
+    url = BASE_URL + "countries/" + self.country
+    if self.country == 'all':
+      url = BASE_URL + "all"
+    return self._load('snapshot', lambda: httpGetWithFallback(url))
+
+  #
+  # 最新の注釈 (日時, コメント)。なければNone
+  #
+  def latestComment(self):
+    first = self._commentStream()[0]
+    return first[0] if len(first) > 0 else None
+
+  #
+  # 注釈を最新の順序でCOMMENT_CHUNK_SIZE件ずつ、(日時, コメント)のリストとして返すイテレーター
+  #  latestComment()と同じ一回の問い合わせの続きを読み込む（全件をメモリに保持しない）。
+  #  続きを読み込めるのは最初の呼び出しだけで、二回目以降は改めて問い合わせる
+  #
+  def commentChunks(self):
+    stream = self._commentStream()
+    with self._lock:
+      iterator, stream[1] = stream[1], None
+    if iterator == None:
+      yield from commentIterate(self.country, COMMENT_CHUNK_SIZE)
+      return
+    if len(stream[0]) > 0:
+      yield stream[0]
+    yield from iterator
+
+  # 注釈の問い合わせ [最初のCOMMENT_CHUNK_SIZE件, 続きを返すイテレーター]
+  #  続きを読み込まないまま操作が終わったときは、コンテキストとともにイテレーターが破棄されて接続を閉じる
+  def _commentStream(self):
+    def loader():
+      iterator = commentIterate(self.country, COMMENT_CHUNK_SIZE)
+      return [next(iterator, []), iterator]
+    return self._load('comments', loader)
+
+  #
+  # 日本語の国名。見つからなければ英語の国名
+  #
+  def translated(self):
+    def loader():
+      translated = translateCountryName(self.country) #日本語国名へ変換
+      if translated == None:
+        translated = self.country
+      return translated
+    return self._load('translated', loader)
+
+  #
+  # 履歴 (日付のリスト, 新規感染者数のリスト, 死亡者数のリスト)。失敗したらNone
+  #  lastdays - 今日から何日前までの情報を取得するか日数を指定する。'all'のときはすべて
+  #
+  def history(self, lastdays):
+    if self.share_history == True and lastdays != 'all':
+      full = self.history('all')
+      if full == None:
+        return None
+      days = max(int(lastdays) - 1, 1) # lastdays日分の累計から求まる差分の数
+      return tuple(values[-days:] for values in full)
+
+    def loader():
+      dateL  = []
+      caseL  = []
+      deathL = []
+      if getHistoricalData(self.country, lastdays, dateL, caseL, deathL) == True:
+        return (dateL, caseL, deathL)
+      return None
+    return self._load('history-' + lastdays, loader)
+
+  #
+  # 履歴を (日付, 新規感染者数, 死亡者数) のタプルとして一日ずつ返すイテレーター。失敗したらNone
+  #  全期間の履歴を保持しているとき（share_historyがTrue、あるいは取得済み）はそれを用い、
+  #  そうでなければ保持せずに取得する
+  #
+  def historyRows(self, lastdays):
+    if lastdays == 'all' and (self.share_history == True or 'history-all' in self._values):
+      full = self.history('all')
+      if full == None:
+        return None
+      return zip(*full)
+    return iterHistoricalData(self.country, lastdays)
+
+  #
+  # keyに対応するデータがなければloader()で取得して保持する
+  #
+  def _load(self, key, loader):
+    with self._lock:
+      lock = self._locks.setdefault(key, threading.Lock())
+    with lock:
+      if key not in self._values:
+        self._values[key] = loader()
+    return self._values[key]
+
 # ---------- Utilities ----------
 
 #
@@ -403,6 +669,29 @@ def _createCountryHashTable():
   print("HASHTABLE CREATED")
   return hashtable
 
+#
+# [FUNCTION] _exportOption()
+#
+# [DESCRIPTION]
+#  出力形式を選択するメニューの項目を作成する
+# 
+# [INPUTS]
+#  fmt - 出力形式（covid19_export.py参照）
+#  country - 対象とする国名
+# 
+# [OUTPUTS]
+#  選択メニューの項目 {text:<表示名>, value:<形式>:<国名>}
+#
+def _exportOption(fmt, country):
+  labels = {'csv': 'CSV', 'parquet': 'Parquet', 'arrow': 'Arrow IPC', 'npz': 'NumPy (npz)'}
+  return {
+    "text": {
+      "type": "plain_text",
+      "text": labels.get(fmt, fmt),
+    },
+    "value": fmt + ":" + country,
+  }
+
 #
 # END OF FILE
 #
\ No newline at end of file
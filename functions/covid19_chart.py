@@ -7,15 +7,32 @@
 #  新型コロナウィルスの感染状況をグラフとして描画する関数を定義するファイル
 #  ただし、Node.js版と異なり、折れ線グラフのスムージングはない。
 # 
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 # グラフ表示のライブラリとグラフ表示で日本語を表示するためのライブラリを読み込む
 import matplotlib
 # バックエンドを指定
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import japanize_matplotlib
+import numpy as np
+
+from .covid19_history import getHistoricalData, getHistoricalDataMulti
+from .covid19 import translateCountryName, getCountrySnapshots, Covid19Context
+from .covid19_sparkline import sparklineRender
+from .covid19_downsample import lttbDownsample
+
+# 高速描画（covid19_sparkline.py）を用いるデータ点数の上限
+SPARKLINE_MAX_POINTS = 31
+# 全期間グラフに描画するデータ点数の上限
+CHART_MAX_POINTS = 200
+# 複数の国のグラフを同時に描画するスレッド数の上限
+CHART_BATCH_WORKERS = int(os.environ.get("CHART_BATCH_WORKERS", "2"))
 
-from .covid19_history import getHistoricalData
-from .covid19 import translateCountryName
+# chartMonthlyBatch()が共有するスレッド
+_BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, CHART_BATCH_WORKERS), thread_name_prefix='chart')
 
 #
 # [FUNCTION] chartMonthlyConfiguration()
@@ -27,6 +44,7 @@ from .covid19 import translateCountryName
 # [INPUTS]
 #  country - 対象となる国名
 #  filename - 保存する画像ファイル名(フォルダ名を含む)
+#  context - Covid19Context（省略時は新たに生成する）
 # 
 # [OUTPUTS]
 #  成功: True
@@ -36,55 +54,255 @@ from .covid19 import translateCountryName
 #  アクセスするURL:
 #     https://disease.sh/v3/covid-19/historical/<Country>?lastdays=31
 #
-def chartMonthlyConfiguration(country, filename):
+def chartMonthlyConfiguration(country, filename, context=None):
   status = False
   if country == '':
     return status
 
-  # 関数getHistoricalData()に与える変数を初期化する
-  dateL  = []
-  caseL  = []
-  deathL = []
-  status = getHistoricalData(country, '31', dateL, caseL, deathL)
-  if status == True:
-    translated = translateCountryName(country) #日本語国名へ変換
-    if translated == None:
-      translated = country
-      
-    # グラフを表示する領域をfigとする
-    fig = plt.figure(figsize=(12,8))
+  if context == None:
+    context = Covid19Context(country)
+  history = context.history('31')
+  if history != None:
+    dateL, caseL, deathL = history
+    status = chartMonthlyDraw(country, dateL, caseL, deathL, filename)
+    
+  return status
+
+#
+# [FUNCTION] chartMonthlyDraw()
+#
+# [DESCRIPTION]
+#  取得済みの新規感染者数を棒グラフ、新たな死亡者数を折れ線グラフとしてファイル保存する
+# 
+# [INPUTS]
+#  country - 対象となる国名（見出しに用いる）
+#  dateL  - 日付のリスト
+#  caseL  - 新規感染者数のリスト
+#  deathL - 死亡者数のリスト
+#  filename - 保存する画像ファイル名(フォルダ名を含む)
+# 
+# [OUTPUTS]
+#  成功: True
+# 
+# [NOTES]
+#  pyplotの状態を用いずにFigureを直接作成するため、複数のスレッドで並列に実行できる
+#
+def chartMonthlyDraw(country, dateL, caseL, deathL, filename):
+  # 領域のどこを使用するかを設定する
+  # 1行x1列のグリッド、最初のサブプロット
+  fig = Figure(figsize=(10,8))
+  ax1 = fig.subplots(1,1)
+  ax2 = ax1.twinx()
+
+  # グラフ見出し、軸ラベルを設定する
+  title = '新規感染者数・死者数の推移 (' + country + ')'
+  ax1.set_title(title, fontsize=18)
+  ax1.set_xlabel('日付', fontsize=12)
+  ax1.set_ylabel('感染者数 (人)', fontsize=12)
+  ax2.set_ylabel('死亡者数 (人)', fontsize=12)
+  # 棒グラフ（感染者数）の設定
+  ax1.bar(dateL, caseL, color='teal', label='感染者数')
+  handles1, labels1 = ax1.get_legend_handles_labels()
+  # 線グラフ（死亡者数）の設定
+  ax2.plot(dateL, deathL, color='magenta', label='死亡者数')
+  handles2, labels2 = ax2.get_legend_handles_labels()
+  # 上限・下限値を設定する
+  #ax1.set_ylim(100, 10000)
+  #ax2.set_ylim(0, 500)
+  # 凡例 - 2つのラベルを結合し、上中央に2列で配置する
+  ax1.legend(handles1 + handles2, labels1 + labels2, ncols=2, loc='upper center')
+  # グリッド線
+  ax1.grid()
+
+  # 画像を保存する
+  fig.savefig(filename)
+
+  return True
+
+#
+# [FUNCTION] chartMonthlyBatch()
+#
+# [DESCRIPTION]
+#  複数の国の30日間のグラフを複数のスレッドで並列に描画してファイル保存する
+# 
+# [INPUTS]
+#  histories - getHistoricalDataMulti()の結果 {<国名>: (日付のリスト, 新規感染者数のリスト, 死亡者数のリスト)}
+#  folder - 画像ファイルを保存するフォルダー名
+# 
+# [OUTPUTS]
+#  {<国名>: <保存した画像ファイル名>}
+#  描画に失敗した国は含まれない
+# 
+# [NOTES]
+#  プロセス内で共有するCHART_BATCH_WORKERS個のスレッドで描画する（子プロセスは作成しない）。
+#  画像ファイル名は他のジョブと重ならないようにtempfile.mkstemp()で作成する。
+#
+def chartMonthlyBatch(histories, folder):
+  files = {}
+  if histories == None or len(histories) == 0:
+    return files
+
+  futures = {}
+  for country in histories:
+    dateL, caseL, deathL = histories[country]
+    fd, filename = tempfile.mkstemp(dir=folder, prefix=country + "-", suffix=".png")
+    os.close(fd)
+    futures[country] = (filename, _BATCH_EXECUTOR.submit(chartMonthlyDraw, country, dateL, caseL, deathL, filename))
+
+  for country in futures:
+    filename, future = futures[country]
+    try:
+      if future.result() == True:
+        files[country] = filename
+        continue
+    except Exception as e:
+      print("[CHART ERROR]", country, format(e))
+    os.remove(filename)
+
+  return files
+
+#
+# [FUNCTION] chartFullConfiguration()
+#
+# [DESCRIPTION]
+#  指定した国の全期間の新型コロナウィルス新規感染者数と新たな死亡者数を
+#  折れ線グラフとしてファイル保存する
+# 
+# [INPUTS]
+#  country - 対象となる国名
+#  filename - 保存する画像ファイル名(フォルダ名を含む)
+#  context - Covid19Context（省略時は新たに生成する）
+# 
+# [OUTPUTS]
+#  成功: True
+#  失敗: False
+# 
+# [NOTES]
+#  アクセスするURL:
+#     https://disease.sh/v3/covid-19/historical/<Country>?lastdays=all
+#
+#  描画の負荷を期間の長さによらず一定にするため、
+#  各系列をlttbDownsample()でCHART_MAX_POINTS点まで間引いてから描画する。
+#
+def chartFullConfiguration(country, filename, context=None):
+  status = False
+  if country == '':
+    return status
+
+  if context == None:
+    context = Covid19Context(country)
+  history = context.history('all')
+  if history != None and len(history[0]) > 0:
+    dateL, caseL, deathL = history
+    translated = context.translated() #日本語国名へ変換
+
+    # 日付を通し番号として扱い、系列ごとに間引く
+    positions = range(len(dateL))
+    case_index = lttbDownsample(positions, caseL, CHART_MAX_POINTS)
+    death_index = lttbDownsample(positions, deathL, CHART_MAX_POINTS)
 
-    # 領域のどこを使用するかを設定する
     # 1行x1列のグリッド、最初のサブプロット
-    fig, ax1 = plt.subplots(1,1,figsize=(10,8))
+    # （ジョブのスレッドから並行に呼ばれるため、pyplotの状態を用いずにFigureを直接作成する）
+    fig = Figure(figsize=(10,8))
+    ax1 = fig.subplots(1,1)
     ax2 = ax1.twinx()
 
     # グラフ見出し、軸ラベルを設定する
-    title = '新規感染者数・死者数の推移 (' + country + ')'
+    title = '全期間の新規感染者数・死者数の推移 (' + translated + ')'
     ax1.set_title(title, fontsize=18)
     ax1.set_xlabel('日付', fontsize=12)
     ax1.set_ylabel('感染者数 (人)', fontsize=12)
     ax2.set_ylabel('死亡者数 (人)', fontsize=12)
-    # 棒グラフ（感染者数）の設定
-    ax1.bar(dateL, caseL, color='teal', label='感染者数')
+    # 線グラフ（感染者数）の設定 - 線の下を塗りつぶす
+    case_dates = [dateL[i] for i in case_index]
+    case_values = [caseL[i] for i in case_index]
+    ax1.fill_between(case_dates, case_values, color='teal', alpha=0.4)
+    ax1.plot(case_dates, case_values, color='teal', label='感染者数')
     handles1, labels1 = ax1.get_legend_handles_labels()
     # 線グラフ（死亡者数）の設定
-    ax2.plot(dateL, deathL, color='magenta', label='死亡者数')
+    ax2.plot([dateL[i] for i in death_index], [deathL[i] for i in death_index], color='magenta', label='死亡者数')
     handles2, labels2 = ax2.get_legend_handles_labels()
-    # 上限・下限値を設定する
-    #ax1.set_ylim(100, 10000)
-    #ax2.set_ylim(0, 500)
     # 凡例 - 2つのラベルを結合し、上中央に2列で配置する
     ax1.legend(handles1 + handles2, labels1 + labels2, ncols=2, loc='upper center')
     # グリッド線
     ax1.grid()
-  
+
     # 画像を保存する
     fig.savefig(filename)
     status = True
-    
+  else:
+    status = False
+
   return status
 
+#
+# [FUNCTION] chartCompareConfiguration()
+#
+# [DESCRIPTION]
+#  複数の国の30日間の人口10万人あたりの新規感染者数を重ねた折れ線グラフとしてファイル保存する
+# 
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+#  filename - 保存する画像ファイル名(フォルダ名を含む)
+# 
+# [OUTPUTS]
+#  成功: グラフに描画した国名（英語表記）のリスト
+#  失敗: None
+# 
+# [NOTES]
+#  アクセスするURL（いずれも一回のリクエストで全ての国を取得する）:
+#     https://disease.sh/v3/covid-19/countries/<Country1>,<Country2>,...
+#     https://disease.sh/v3/covid-19/historical/<Country1>,<Country2>,...?lastdays=31
+#
+#  各国の日付を共通の日付軸に揃え、データがない日は描画しない。
+#
+def chartCompareConfiguration(countries, filename):
+  if countries == None or len(countries) == 0:
+    return None
+
+  # 人口を取得する
+  snapshots = getCountrySnapshots(countries)
+  histories = getHistoricalDataMulti(countries, '31')
+  if snapshots == None or histories == None:
+    return None
+  populations = {}
+  for snapshot in snapshots:
+    if int(snapshot['population']) > 0:
+      populations[snapshot['country']] = int(snapshot['population'])
+
+  names = [name for name in histories if name in populations]
+  if len(names) == 0:
+    return None
+
+  # 共通の日付軸を作成する
+  dates = sorted(set(d for name in names for d in histories[name][0]))
+  position = {d: i for i, d in enumerate(dates)}
+
+  # ジョブのスレッドから並行に呼ばれるため、pyplotの状態を用いずにFigureを直接作成する
+  fig = Figure(figsize=(10,8))
+  ax = fig.subplots(1,1)
+  title = '人口10万人あたりの新規感染者数の比較'
+  ax.set_title(title, fontsize=18)
+  ax.set_xlabel('日付', fontsize=12)
+  ax.set_ylabel('感染者数 (人/10万人)', fontsize=12)
+  for name in names:
+    dateL, caseL, deathL = histories[name]
+    # 共通の日付軸に揃え、データがない日はNaNとする
+    values = np.full(len(dates), np.nan)
+    values[[position[d] for d in dateL]] = caseL
+    values = values / populations[name] * 100000
+    translated = translateCountryName(name) #日本語国名へ変換
+    if translated == None:
+      translated = name
+    ax.plot(dates, values, label=translated)
+  ax.legend(loc='upper left')
+  ax.grid()
+
+  # 画像を保存する
+  fig.savefig(filename)
+
+  return names
+
 #
 # [FUNCTION] chartWeeklyConfiguration()
 #
@@ -102,6 +320,9 @@ def chartMonthlyConfiguration(country, filename):
 #  アクセスするURL:
 #     https://disease.sh/v3/covid-19/historical/Japan?lastdays=8
 #
+#  データ点数がSPARKLINE_MAX_POINTS以下のときはsparklineRender()で高速に描画し、
+#  描画できなかったときはmatplotlibで描画する。
+#
 def chartWeeklyConfiguration(filename):
 
   status = False
@@ -111,9 +332,16 @@ def chartWeeklyConfiguration(filename):
   caseL  = []
   deathL = []
   status = getHistoricalData('Japan', '8', dateL, caseL, deathL)
+  if status == True and len(dateL) <= SPARKLINE_MAX_POINTS:
+    try:
+      return sparklineRender('今週の新規感染者数', '感染者数 (人)', '感染者数', dateL, caseL, filename)
+    except Exception as e:
+      print("[SPARKLINE]", format(e))
+
   if status == True:     
     # グラフを表示する領域をfigとする
-    fig = plt.figure(figsize=(12,8))
+    # （ジョブのスレッドから並行に呼ばれるため、pyplotの状態を用いずにFigureを直接作成する）
+    fig = Figure(figsize=(12,8))
 
     # 領域のどこを使用するかを設定する
     # 1行x1列のグリッド、最初のサブプロット
@@ -10,7 +10,7 @@
 #
 import os
 import json
-from .psql_get import psqlGet, psqlInsert
+from .psql_get import psqlGet, psqlInsert, psqlIterate
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -143,6 +143,33 @@ def commentGet(country):
   
   return result
 
+#
+# [FUNCTION] commentIterate()
+#
+# [DESCRIPTION]
+#  指定した国の注釈を最新の順序で指定した件数ずつ取得するジェネレーター
+# 
+# [INPUTS]
+#  country - 国名
+#  size - 一度に取得する注釈の件数
+#
+# [OUTPUTS]
+#  (日時, 注釈)のタプルからなるリストを順に返す
+# 
+# [NOTES]
+#　'Côte d'Ivoire'と'Lao People's Democrat...のように国名にシングルクォートがある場合、「'」の前に「'」を付ける
+#
+def commentIterate(country, size):
+
+  if country == None:
+    return
+
+  # シングルクォートを置換する
+  dest = country.replace("'", "''")
+  # countriesとannotationテーブルを結合して注釈を取得する
+  query = "SELECT datetime, comment FROM annotation as a inner join countries as c ON LOWER(c.name_en)=LOWER('" + dest + "') AND a.country_id = c.id ORDER BY datetime DESC"
+  yield from psqlIterate(query, size)
+
 #
 # END OF FILE
 #
\ No newline at end of file
@@ -5,33 +5,39 @@
 #
 # [DESCRIPTION]
 #  新型コロナウィルスの感染状況をCSVファイルに保存する関数を定義するファイル
-# 
+#
 # [NOTES]
 #  生成するCSVファイルは環境変数LOCAL_FOLDERに設定されたフォルダーに保存される。
+#  csvGenerateStream()はファイルを保存せず、メモリ上（大きいときは一時ファイル）のバッファーに書き込む。
 #
 import os
+import io
 import csv
+import gzip
+import tempfile
 from .current_time import currentTimeStamp
-from .covid19_history import getHistoricalData
+from .covid19_history import iterHistoricalData
 from dotenv import load_dotenv
 load_dotenv()
 
 # ファイルを保存するフォルダー名
 LOCAL_FOLDER = os.environ.get("LOCAL_FOLDER")
+# csvGenerateStream()がメモリ上に保持する最大バイト数（超えると一時ファイルに移る）
+CSV_SPOOL_SIZE = 1024 * 1024
 
 #
 # [FUNCTION] csvGenerateFile()
 #
 # [DESCRIPTION]
 #  日々の新型コロナウィルス新規感染者数と死亡者数をCSVファイルに保存する
-# 
+#
 # [INPUTS]
 #  country - 対象となる国名
-# 
+#
 # [OUTPUTS]
 #  成功: 作成されたCSVファイル名
 #  失敗: None
-# 
+#
 # [NOTES]
 #  アクセスするURL:
 #     https://disease.sh/v3/covid-19/historical/<Country>?lastdays=all
@@ -39,12 +45,9 @@ LOCAL_FOLDER = os.environ.get("LOCAL_FOLDER")
 def csvGenerateFile(country):
   output_file = None # Output variable
 
-  # 関数getHistoricalData()に与える変数を初期化する
-  dateL  = [] # 日付のリスト
-  caseL  = [] # 新規感染者数のリスト
-  deathL = [] # 死亡者数のリスト
-  status = getHistoricalData(country, 'all', dateL, caseL, deathL)
-  if status == True:
+  # 日付、新規感染者数、死亡者数を一日ずつ取り出すイテレーター
+  rows = iterHistoricalData(country, 'all')
+  if rows != None:
     # ファイルを上書きしないようにタイムスタンプを名前に付与する
     timestamp = currentTimeStamp()
     output_file = LOCAL_FOLDER + "/" + country + "-all-" + str(timestamp) + ".csv"
@@ -53,8 +56,7 @@ def csvGenerateFile(country):
         writer = csv.writer(csvfile, lineterminator='\n')
         writer.writerow(['Date', 'Cases', 'Deaths']) # ファイルヘッダー
         # レコードごとにファイルに書き込む
-        for i in range(len(dateL)):
-           writer.writerow([dateL[i], caseL[i] , deathL[i]]) 
+        writer.writerows(rows)
       print("[INFO] ", output_file, 'は保存されました')
     except Exception as e:
       print(format(e))
@@ -62,6 +64,78 @@ def csvGenerateFile(country):
 
   return output_file
 
+#
+# [FUNCTION] csvGenerateStream()
+#
+# [DESCRIPTION]
+#  日々の新型コロナウィルス新規感染者数と死亡者数をCSV形式でバッファーに書き込む
+#
+# [INPUTS]
+#  country - 対象となる国名
+#  compress - Trueのときgzip形式で圧縮する
+#  rows - (日付, 新規感染者数, 死亡者数)のタプルを返すイテレーター（省略時はWebサイトから取得する）
+#
+# [OUTPUTS]
+#  成功: (先頭に位置付けたバッファー, ファイル名)
+#        バッファーはfiles_upload_v2()のfile引数にそのまま渡せる
+#  失敗: (None, None)
+#
+# [NOTES]
+#  アクセスするURL:
+#     https://disease.sh/v3/covid-19/historical/<Country>?lastdays=all
+#
+#  レコードは一行ずつ書き込み、リストとして保持しない。
+#  バッファーはCSV_SPOOL_SIZEまではメモリ上に置かれ、超えたときだけ一時ファイルに移る。
+#
+def csvGenerateStream(country, compress=False, rows=None):
+  if rows == None:
+    rows = iterHistoricalData(country, 'all')
+  if rows == None:
+    return None, None
+
+  buffer = tempfile.SpooledTemporaryFile(max_size=CSV_SPOOL_SIZE)
+  try:
+    target = buffer
+    if compress == True:
+      target = gzip.GzipFile(filename=country + ".csv", mode='wb', fileobj=buffer)
+    csvWriteRows(rows, target)
+    if compress == True:
+      target.close() # gzipの末尾を書き込む（bufferは閉じない）
+    buffer.seek(0)
+  except Exception as e:
+    print(format(e))
+    buffer.close()
+    return None, None
+
+  # ファイルを区別できるようにタイムスタンプを名前に付与する
+  filename = country + "-all-" + str(currentTimeStamp()) + ".csv"
+  if compress == True:
+    filename += ".gz"
+  return buffer, filename
+
+#
+# [FUNCTION] csvWriteRows()
+#
+# [DESCRIPTION]
+#  日付、新規感染者数、死亡者数のレコードをCSV形式でバイナリーのファイルオブジェクトに書き込む
+#
+# [INPUTS]
+#  rows - (日付, 新規感染者数, 死亡者数)のタプルを返すイテレーター
+#  target - 書き込み先（バイナリーモードのファイルオブジェクト）
+#
+# [OUTPUTS] なし
+#
+# [NOTES]
+#  書き込み後もtargetは閉じない。
+#
+def csvWriteRows(rows, target):
+  text = io.TextIOWrapper(target, encoding='utf-8', newline='')
+  writer = csv.writer(text, lineterminator='\n')
+  writer.writerow(['Date', 'Cases', 'Deaths']) # ファイルヘッダー
+  writer.writerows(rows)
+  text.flush()
+  text.detach() # targetを閉じずに切り離す
+
 #
 # END OF FILE
-#
\ No newline at end of file
+#
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] covid19_downsample.py
+#
+# [DESCRIPTION]
+#  長期間の時系列データをグラフ表示向けに間引く関数を定義するファイル
+#
+# [NOTES]
+#  Largest-Triangle-Three-Buckets (LTTB) 法を用いる。
+#  バケット内の三角形の面積はNumPyでまとめて計算するため、ループ回数は出力点数のみに比例する。
+#
+import numpy as np
+
+#
+# [FUNCTION] lttbDownsample()
+#
+# [DESCRIPTION]
+#  時系列データの形状を保ったまま、指定した点数まで間引くための添字を求める
+#
+# [INPUTS]
+#  x - 横軸の値のリスト（単調増加）
+#  y - 縦軸の値のリスト
+#  threshold - 間引いた後の点数
+#
+# [OUTPUTS]
+#  残す点の添字（NumPy配列、昇順）
+#  データ点数がthreshold以下のときは全ての添字を返す
+#
+# [NOTES]
+#  最初と最後の点は必ず残す。
+#
+def lttbDownsample(x, y, threshold):
+  x = np.asarray(x, dtype=np.float64)
+  y = np.asarray(y, dtype=np.float64)
+  n = len(x)
+  if threshold >= n or threshold < 3:
+    return np.arange(n)
+
+  # 最初と最後を除いた点をthreshold-2個のバケットに分ける
+  edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.intp)
+  starts = edges[:-1]
+  ends = edges[1:]
+
+  # 各バケットの平均値を累積和から求める
+  sum_x = np.concatenate(([0.0], np.cumsum(x)))
+  sum_y = np.concatenate(([0.0], np.cumsum(y)))
+  avg_x = (sum_x[ends] - sum_x[starts]) / (ends - starts)
+  avg_y = (sum_y[ends] - sum_y[starts]) / (ends - starts)
+  # 次のバケットの平均値（最後のバケットでは最後の点）
+  next_x = np.append(avg_x[1:], x[-1])
+  next_y = np.append(avg_y[1:], y[-1])
+
+  selected = np.empty(threshold, dtype=np.intp)
+  selected[0] = 0
+  selected[-1] = n - 1
+  a = 0 # 直前に選んだ点
+  for i in range(threshold - 2):
+    s = starts[i]
+    e = ends[i]
+    # 直前の点、バケット内の各点、次のバケットの平均からなる三角形の面積（の2倍）
+    area = np.abs((x[a] - next_x[i]) * (y[s:e] - y[a]) - (x[a] - x[s:e]) * (next_y[i] - y[a]))
+    a = s + int(np.argmax(area))
+    selected[i + 1] = a
+
+  return selected
+
+#
+# END OF FILE
+#
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] covid19_export.py
+#
+# [DESCRIPTION]
+#  新型コロナウィルスの感染状況の履歴をCSVあるいは列指向の形式（Parquet、Arrow IPC、NumPy npz）で出力する関数を定義するファイル
+#
+# [NOTES]
+#  列指向の形式では、日付(date)、新規感染者数(cases)、死亡者数(deaths)の3列を出力する。
+#  ParquetとArrow IPCにはpyarrowパッケージが必要である。インストールされていなければこの2形式は選択できない。
+#  exportGenerateArchive()は複数の国の履歴を一国一ファイルとしてZIP形式にまとめる。
+#
+import io
+import zipfile
+import tempfile
+import numpy as np
+from .current_time import currentTimeStamp
+from .covid19_history import iterHistoricalData, iterHistoricalDataChunks
+from .covid19_csv import csvGenerateStream, csvWriteRows
+
+try:
+  import pyarrow
+  import pyarrow.ipc
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+# バッファーがメモリ上に保持する最大バイト数（超えると一時ファイルに移る）
+EXPORT_SPOOL_SIZE = 1024 * 1024
+# exportGenerateArchive()が一回のリクエストで履歴を取得する国の数
+EXPORT_CHUNK_SIZE = 20
+# 履歴を格納する構造化配列の型
+HISTORY_DTYPE = np.dtype([('date', 'datetime64[D]'), ('cases', np.int64), ('deaths', np.int64)])
+
+#
+# [FUNCTION] exportFormats()
+#
+# [DESCRIPTION]
+#  この環境で出力できる形式の一覧を求める
+#
+# [INPUTS] なし
+#
+# [OUTPUTS]
+#  形式名のリスト（'csv', 'parquet', 'arrow', 'npz'のうち利用可能なもの）
+#
+def exportFormats():
+  return [fmt for fmt in EXPORT_FORMATS if EXPORT_FORMATS[fmt][2] == False or pyarrow != None]
+
+#
+# [FUNCTION] exportGenerateStream()
+#
+# [DESCRIPTION]
+#  日々の新型コロナウィルス新規感染者数と死亡者数を指定した形式でバッファーに書き込む
+#
+# [INPUTS]
+#  country - 対象となる国名
+#  fmt - 出力形式（exportFormats()のいずれか）
+#  compress - csvのときgzip形式で圧縮するか（他の形式は形式自体の圧縮を用いる）
+#
+# [OUTPUTS]
+#  成功: (先頭に位置付けたバッファー, ファイル名)
+#  失敗: (None, None)
+#
+# [NOTES]
+#  アクセスするURL:
+#     https://disease.sh/v3/covid-19/historical/<Country>?lastdays=all
+#
+#  csvは一行ずつ書き込む。列指向の形式は列ごとに書き込むため、履歴を一度NumPy配列にまとめる。
+#
+def exportGenerateStream(country, fmt, compress=False):
+  if fmt == 'csv':
+    return csvGenerateStream(country, compress)
+  if fmt not in exportFormats():
+    return None, None
+
+  rows = iterHistoricalData(country, 'all')
+  if rows == None:
+    return None, None
+
+  buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+  try:
+    table = np.fromiter(rows, dtype=HISTORY_DTYPE)
+    extension, writer, _ = EXPORT_FORMATS[fmt]
+    writer(table, buffer)
+    buffer.seek(0)
+  except Exception as e:
+    print(format(e))
+    buffer.close()
+    return None, None
+
+  # ファイルを区別できるようにタイムスタンプを名前に付与する
+  filename = country + "-all-" + str(currentTimeStamp()) + extension
+  return buffer, filename
+
+#
+# [FUNCTION] exportGenerateArchive()
+#
+# [DESCRIPTION]
+#  複数の国の全期間の新規感染者数と死亡者数を、一国一ファイルとしてZIP形式のバッファーに書き込む
+#
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+#  fmt - 各ファイルの形式（exportFormats()のいずれか）
+#
+# [OUTPUTS]
+#  成功: (先頭に位置付けたバッファー, ファイル名, 書き込んだ国の数)
+#  失敗: (None, None, 0)
+#
+# [NOTES]
+#  アクセスするURL:
+#     https://disease.sh/v3/covid-19/historical/<Country1>,<Country2>,...?lastdays=all
+#
+#  履歴はEXPORT_CHUNK_SIZEカ国ずつまとめて取得し、一国ずつZIPに書き込んだ時点で手放す。
+#  csvはZIP内のファイルに一行ずつ書き込んで圧縮する。他の形式は形式自体で圧縮済みのため無圧縮で格納する。
+#
+def exportGenerateArchive(countries, fmt):
+  if fmt not in exportFormats():
+    return None, None, 0
+
+  extension, writer, _ = EXPORT_FORMATS[fmt]
+  count = 0
+  buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+  try:
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+      for country, rows in iterHistoricalDataChunks(countries, 'all', EXPORT_CHUNK_SIZE):
+        if fmt == 'csv':
+          with archive.open(country + extension, 'w') as entry:
+            csvWriteRows(rows, entry)
+        else:
+          data = io.BytesIO()
+          writer(np.fromiter(rows, dtype=HISTORY_DTYPE), data)
+          archive.writestr(country + extension, data.getvalue(), compress_type=zipfile.ZIP_STORED)
+        count += 1
+    buffer.seek(0)
+  except Exception as e:
+    print(format(e))
+    buffer.close()
+    return None, None, 0
+
+  if count == 0:
+    buffer.close()
+    return None, None, 0
+
+  # ファイルを区別できるようにタイムスタンプを名前に付与する
+  filename = "covid19-all-" + fmt + "-" + str(currentTimeStamp()) + ".zip"
+  return buffer, filename, count
+
+# ---------- Utilities ----------
+
+# pyarrowのテーブルに変換する（日付はdate32型になる）
+def _arrowTable(table):
+  return pyarrow.table({
+    'date': pyarrow.array(table['date']),
+    'cases': pyarrow.array(table['cases']),
+    'deaths': pyarrow.array(table['deaths']),
+  })
+
+# Parquet形式（列ごとにzstdで圧縮する）
+def _writeParquet(table, buffer):
+  pyarrow.parquet.write_table(_arrowTable(table), buffer, compression='zstd')
+
+# Arrow IPCファイル形式（レコードバッチをzstdで圧縮する）
+def _writeArrow(table, buffer):
+  arrow_table = _arrowTable(table)
+  options = pyarrow.ipc.IpcWriteOptions(compression='zstd')
+  with pyarrow.ipc.new_file(buffer, arrow_table.schema, options=options) as writer:
+    writer.write_table(arrow_table)
+
+# NumPy npz形式（列ごとの配列を圧縮して格納する）
+def _writeNpz(table, buffer):
+  np.savez_compressed(buffer, date=table['date'], cases=table['cases'], deaths=table['deaths'])
+
+# {<形式名>: (拡張子, 書き込む関数, pyarrowが必要か)}
+EXPORT_FORMATS = {
+  'csv': ('.csv', None, False),
+  'parquet': ('.parquet', _writeParquet, True),
+  'arrow': ('.arrow', _writeArrow, True),
+  'npz': ('.npz', _writeNpz, False),
+}
+
+#
+# END OF FILE
+#
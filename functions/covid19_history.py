@@ -10,6 +10,8 @@
 #
 import os
 import datetime
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 from .http_get import httpGet
 from dotenv import load_dotenv
@@ -53,38 +55,205 @@ def getHistoricalData(country, lastdays, dateL, caseL, deathL):
   result = httpGet(url)
   if result != None:
     
-    # 新たな感染者数を前日との差分として集める
+    # 新たな感染者数と死亡者数を前日との差分として集める
     if country == 'all':
-      cases = result["cases"]
+      _convertTimeline(result, dateL, caseL, deathL)
     else:
-      cases = result["timeline"]["cases"]
-      
-    previous_value = -1
-    for key in cases: # keyは日付：m/d/YY
-      num_cases = int(cases[key])
-      if previous_value >= 0:
-        date_value = convertDateFormat(key) # M/D/YY -> YYYY-MM-DD
-        dateL.append(date_value)
-        caseL.append(num_cases-previous_value)
-      previous_value = num_cases
-
-    # 新たな死亡者数を前日との差分として集める
-    if country == 'all':
-      deaths = result["deaths"]
-    else:
-      deaths = result["timeline"]["deaths"]
-      
-    previous_value = -1
-    for key in deaths:
-      num_deaths = int(deaths[key])
-      if previous_value >= 0:
-        deathL.append(num_deaths-previous_value)
-      previous_value = num_deaths
+      _convertTimeline(result["timeline"], dateL, caseL, deathL)
       
     status = True
       
   return status
 
+#
+# [FUNCTION] getHistoricalDataMulti()
+#
+# [DESCRIPTION]
+#  複数の国の新型コロナウィルスの新規感染者数と死亡者数を一回のリクエストで取得する
+# 
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+#  lastdays - 今日から何日前までの情報を取得するか日数を指定する。'all'のときはすべてのデータを対象とする。
+# 
+# [OUTPUTS]
+#  成功: {<国名>: (日付のリスト, 新規感染者数のリスト, 死亡者数のリスト), ...}
+#        国名はWebサイトが返す英語表記で、見つからなかった国は含まれない
+#  失敗: None
+# 
+# [NOTES]
+#  アクセスするURL
+#    https://disease.sh/v3/covid-19/historical/<Country1>,<Country2>,...?lastdays=<日数 or all>
+#
+#  対象国が一つの場合、結果はリストではなく辞書となる。
+#
+def getHistoricalDataMulti(countries, lastdays):
+  if countries == None or len(countries) == 0:
+    return None
+
+  url = BASE_URL + "historical/" + ",".join(countries) + "?lastdays=" + lastdays
+  result = httpGet(url)
+  if result == None:
+    return None
+  if isinstance(result, dict):
+    result = [result]
+
+  histories = {}
+  for item in result:
+    if item == None or "timeline" not in item:
+      continue # 見つからなかった国
+    dateL  = []
+    caseL  = []
+    deathL = []
+    _convertTimeline(item["timeline"], dateL, caseL, deathL)
+    histories[item["country"]] = (dateL, caseL, deathL)
+
+  return histories
+
+#
+# [FUNCTION] iterHistoricalData()
+#
+# [DESCRIPTION]
+#  指定した日数分の新型コロナウィルスの新規感染者数と死亡者数を一日ずつ返すイテレーターを取得する
+# 
+# [INPUTS]
+#  country  - 対象となる国名
+#  lastdays - 今日から何日前までの情報を取得するか日数を指定する。'all'のときはすべてのデータを対象とする。
+# 
+# [OUTPUTS]
+#  成功: (日付, 新規感染者数, 死亡者数)のタプルを日付順に返すイテレーター
+#  失敗: None
+# 
+# [NOTES]
+#  getHistoricalData()と異なり、結果をリストとして保持しない
+#
+def iterHistoricalData(country, lastdays):
+  if country == "":
+    return None
+
+  url = BASE_URL + "historical/" + country + "?lastdays=" + lastdays
+  result = httpGet(url)
+  if result == None:
+    return None
+
+  if country == 'all':
+    return _iterTimeline(result)
+  return _iterTimeline(result["timeline"])
+
+#
+# [FUNCTION] iterHistoricalDataChunks()
+#
+# [DESCRIPTION]
+#  多数の国の新型コロナウィルスの新規感染者数と死亡者数を、数カ国ずつまとめたリクエストで取得しながら一国ずつ返す
+# 
+# [INPUTS]
+#  countries - 対象となる国名のリスト
+#  lastdays - 今日から何日前までの情報を取得するか日数を指定する。'all'のときはすべてのデータを対象とする。
+#  size - 一回のリクエストで取得する国の数
+# 
+# [OUTPUTS]
+#  (国名, (日付, 新規感染者数, 死亡者数)のタプルを返すイテレーター) を国ごとに返すジェネレーター
+#  国名はWebサイトが返す英語表記で、見つからなかった国と取得に失敗したリクエストの国は含まれない
+# 
+# [NOTES]
+#  アクセスするURL
+#    https://disease.sh/v3/covid-19/historical/<Country1>,<Country2>,...?lastdays=<日数 or all>
+#
+#  次のリクエストは現在のまとまりを返している間に別スレッドで取得する。
+#  保持するのは取得済みの二つのまとまりまでで、返した国のデータはその時点で手放す。
+#
+def iterHistoricalDataChunks(countries, lastdays, size):
+  chunks = [countries[i:i + size] for i in range(0, len(countries), size)]
+  if len(chunks) == 0:
+    return
+
+  def fetch(chunk):
+    # 大きな結果を保持し続けないようにキャッシュを用いない
+    return httpGet(BASE_URL + "historical/" + ",".join(chunk) + "?lastdays=" + lastdays, ttl=0)
+
+  context = contextvars.copy_context() # 先に取得するスレッドにトレースのスパンを引き継ぐ
+  with ThreadPoolExecutor(max_workers=1) as executor:
+    future = executor.submit(context.run, fetch, chunks[0])
+    for i in range(len(chunks)):
+      result = future.result()
+      future = None
+      if i + 1 < len(chunks):
+        future = executor.submit(context.run, fetch, chunks[i + 1]) # 次のまとまりを先に取得しておく
+      if result == None:
+        continue
+      if isinstance(result, dict):
+        result = [result]
+      result.reverse()
+      while len(result) > 0:
+        item = result.pop() # 返した国のデータを保持しない
+        if item == None or "timeline" not in item:
+          continue # 見つからなかった国
+        yield item["country"], _iterTimeline(item["timeline"])
+
+# ---------- Utilities ----------
+
+#
+# [FUNCTION] _convertTimeline()
+#
+# [DESCRIPTION]
+#  累計の感染者数と死亡者数を前日との差分に変換する
+# 
+# [INPUTS]
+#  timeline - {cases:{<M/D/YY>:<累計>, ...}, deaths:{<M/D/YY>:<累計>, ...}}
+# 
+# [OUTPUTS]
+#  次の出力用引数には初期設定として空リストを関数に与えておく
+#  dateL  - 日付のリスト
+#  caseL  - 新規感染者数のリスト
+#  deathL - 死亡者数のリスト
+#
+def _convertTimeline(timeline, dateL, caseL, deathL):
+  cases = timeline["cases"]
+  previous_value = -1
+  for key in cases: # keyは日付：m/d/YY
+    num_cases = int(cases[key])
+    if previous_value >= 0:
+      date_value = convertDateFormat(key) # M/D/YY -> YYYY-MM-DD
+      dateL.append(date_value)
+      caseL.append(num_cases-previous_value)
+    previous_value = num_cases
+
+  deaths = timeline["deaths"]
+  previous_value = -1
+  for key in deaths:
+    num_deaths = int(deaths[key])
+    if previous_value >= 0:
+      deathL.append(num_deaths-previous_value)
+    previous_value = num_deaths
+
+#
+# [FUNCTION] _iterTimeline()
+#
+# [DESCRIPTION]
+#  累計の感染者数と死亡者数を前日との差分に変換し、一日ずつ返すジェネレーター
+# 
+# [INPUTS]
+#  timeline - {cases:{<M/D/YY>:<累計>, ...}, deaths:{<M/D/YY>:<累計>, ...}}
+# 
+# [OUTPUTS]
+#  (日付, 新規感染者数, 死亡者数)のタプル
+#
+# [NOTES]
+#  deathsに含まれない日付は、その日の死亡者数を0人とする
+#
+def _iterTimeline(timeline):
+  cases = timeline["cases"]
+  deaths = timeline["deaths"]
+  previous_cases = -1
+  previous_deaths = -1
+  for key in cases: # keyは日付：m/d/YY
+    num_cases = int(cases[key])
+    # 死亡者数がない日は前日の累計を引き継ぐ（0とすると大きな負の値になる）
+    num_deaths = int(deaths[key]) if key in deaths else max(previous_deaths, 0)
+    if previous_cases >= 0:
+      yield (convertDateFormat(key), num_cases - previous_cases, num_deaths - previous_deaths)
+    previous_cases = num_cases
+    previous_deaths = num_deaths
+
 #
 # [FUNCTION] convertDateFormat()
 #
@@ -8,17 +8,21 @@
 #  Pythonのreportlabを用いる
 #
 import os
-from .http_get import httpGet
-from .covid19 import translateCountryName
-from .covid19_comment import commentGet
-from functions.current_time import currentTimeStamp
+from xml.sax.saxutils import escape
+from .covid19 import translateCountryName, getCountrySnapshots, Covid19Context, COMMENT_CHUNK_SIZE
+from .covid19_history import getHistoricalDataMulti
+from .covid19_chart import chartMonthlyBatch
+from .covid19_comment import commentIterate
+from functions.current_time import uniqueTimeStamp
 
 # reportlabモジュール
-from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
-from reportlab.platypus import Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Image, Indenter, PageBreak, Spacer, Flowable
+from reportlab.platypus.tableofcontents import TableOfContents
 from reportlab.lib import colors
-from reportlab.lib.units import mm, cm
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.units import mm
 from reportlab.lib.pagesizes import A4, portrait
 from reportlab.pdfbase.ttfonts import TTFont
 
@@ -30,6 +34,63 @@ LOCAL_FOLDER = os.environ.get("LOCAL_FOLDER")
 FONT_FILE = './fonts/ipaexg.ttf'
 FONT_NAME = 'IPAexGothic'
 
+# ドキュメントの設定: サイズはA4縦、余白は10mm
+DOCUMENT_OPTIONS = {
+  'pagesize': portrait(A4),
+  'leftMargin': 10*mm, 'rightMargin': 10*mm, 'topMargin': 10*mm, 'bottomMargin': 10*mm,
+  'author': 'TUS',
+  'title': '新型コロナウイルス感染状況レポート',
+  'subject': '新型コロナウイルス感染状況レポート',
+}
+
+# 段落のスタイル
+TITLE_STYLE = ParagraphStyle('title', fontName=FONT_NAME, fontSize=24, leading=30, alignment=TA_CENTER, spaceAfter=4*mm)
+DATETIME_STYLE = ParagraphStyle('datetime', fontName=FONT_NAME, fontSize=16, leading=20, alignment=TA_RIGHT, spaceAfter=6*mm)
+HEADING_STYLE = ParagraphStyle('heading', fontName=FONT_NAME, fontSize=20, leading=24, spaceBefore=6*mm, spaceAfter=4*mm)
+SECTION_STYLE = ParagraphStyle('section', fontName=FONT_NAME, fontSize=22, leading=28, spaceAfter=4*mm)
+TOC_STYLE = ParagraphStyle('toc', fontName=FONT_NAME, fontSize=14, leading=20)
+COMMENT_STYLE = ParagraphStyle('comment', fontName=FONT_NAME, fontSize=12, leading=15, wordWrap='CJK')
+
+# 表のスタイル（レポートごとに変わらないため一度だけ生成して共有する）
+INFO_TABLE_STYLE = TableStyle([
+  ('FONT', (0, 0), (-1, -1), FONT_NAME, 14),
+  ('BOX', (0, 0), (-1, -1), 1, colors.black),
+  ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
+  # 四角の内側に格子状の罫線を引いて、0.25の太さ
+  ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+  # セルの縦文字位置を、TOP/MIDDLE/BOTTOMにする
+  ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+  ('BACKGROUND', (0, 0), (1, 0), '#eeeeff'),
+])
+STATUS_TABLE_STYLE = TableStyle([
+  ('FONT', (0, 0), (-1, -1), FONT_NAME, 14),
+  ('BOX', (0, 0), (-1, -1), 1, colors.black),
+  ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
+  # 四角の内側に格子状の罫線を引いて、0.25の太さ
+  ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+  # セルの縦文字位置を、TOP/MIDDLE/BOTTOMにする
+  ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+  ('BACKGROUND', (0, 0), (0, 5), '#eeeeff'),
+])
+COMMENT_TABLE_STYLE = TableStyle([
+  ('FONT', (0, 0), (-1, -1), FONT_NAME, 12),
+  ('BOX', (0, 0), (-1, -1), 1, colors.black),
+  ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
+  #四角の内側に格子状の罫線を引いて、0.25の太さ
+  ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+  # セルの縦文字位置を、TOP/MIDDLE/BOTTOMにする
+  ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+  ('BACKGROUND', (0, 0), (1, 0), '#eeeeff'),
+])
+# 注釈の続きの表（見出し行なし）
+COMMENT_BODY_STYLE = TableStyle([
+  ('FONT', (0, 0), (-1, -1), FONT_NAME, 12),
+  ('BOX', (0, 0), (-1, -1), 1, colors.black),
+  ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
+  ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+  ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
 #
 # [FUNCTION] pdfGenerateFile()
 #
@@ -40,6 +101,7 @@ FONT_NAME = 'IPAexGothic'
 #  datetime - 日時
 #  country - 対象となる国名
 #  image_file - PDFファイルに追加する画像ファイル
+#  context - Covid19Context（省略時は新たに生成する）
 # 
 # [OUTPUTS]
 #  成功: 作成されたPDFファイル名
@@ -51,139 +113,319 @@ FONT_NAME = 'IPAexGothic'
 #   countryが'all'の場合
 #   https://disease.sh/v3/covid-19/all
 #
-# '{:,}'.format() は数値を三桁区切りにする。
+#  レポートはreportlabのフローアブル（Paragraph, Table, Image）を並べたストーリーとして構成し、
+#  SimpleDocTemplateが自動的に改ページする。
+#  注釈はデータベースからCOMMENT_CHUNK_SIZE件ずつ読み込み、描画が進むにつれて表を追加する。
+#  読み込みはcontext.commentChunks()で行い、同じコンテキストを用いるカードが最新の注釈を表示するときと
+#  同じ一回の問い合わせを共有する。
 #
-def pdfGenerateFile(datetime, country, image_file):
+def pdfGenerateFile(datetime, country, image_file, context=None):
   output_file = None
   if image_file == '':
     return output_file
 
-  url = BASE_URL + "countries/" + country
-  if country == 'all':
-    url = BASE_URL + "all"
-
-  result = httpGet(url)
+  if context == None:
+    context = Covid19Context(country)
+  result = context.snapshot()
   if result != None:
     # PDFファイルを生成する
-    timestamp = currentTimeStamp()
+    timestamp = uniqueTimeStamp()
     output_file = LOCAL_FOLDER + "/Report-" + country + "-" + str(timestamp) + ".pdf"
-    pdf = canvas.Canvas(output_file, pagesize=portrait(A4), bottomup=True) # PDFを生成, サイズはA4, 左上が0.0
-    pdf.saveState() # セーブ
-  
-    # ファイル情報を設定する
-    pdf.setAuthor('TUS')
-    pdf.setTitle('新型コロナウイルス感染状況レポート')
-    pdf.setSubject('新型コロナウイルス感染状況レポート')
-
-    #フォント、サイズを設定
-    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
-    pdf.setFont(FONT_NAME, 24)
+    _registerFont()
+    doc = _createDocument(output_file)
+
+    flowables = _headerFlowables(datetime) + _countryFlowables(context.translated(), result, image_file)
+    flowables.append(_CommentStream(lambda: _commentFlowables(context.commentChunks())))
+    doc.build(flowables)
+    print("[INFO] ", output_file, 'has been saved.')
+
+  return output_file
+
+#
+# [FUNCTION] pdfGenerateBatch()
+#
+# [DESCRIPTION]
+#  複数の国の感染状況を目次付きの一つのPDFドキュメントファイルとして作成する
+# 
+# [INPUTS]
+#  datetime - 日時
+#  countries - 対象となる国名のリスト
+# 
+# [OUTPUTS]
+#  成功: 作成されたPDFファイル名
+#  失敗: None
+# 
+# [NOTES]
+#  アクセスするURL（いずれも一回のリクエストで全ての国を取得する）:
+#   https://disease.sh/v3/covid-19/countries/<Country1>,<Country2>,...
+#   https://disease.sh/v3/covid-19/historical/<Country1>,<Country2>,...?lastdays=31
+#
+#  グラフはchartMonthlyBatch()で並列に描画し、PDFファイルの作成後に削除する。
+#  見つからなかった国はレポートに含まれない。
+#  注釈は国ごとに組版しながら読み込む（目次のためmultiBuild()が組版するたびに問い合わせる）。
+#
+def pdfGenerateBatch(datetime, countries):
+  output_file = None
+  snapshots = getCountrySnapshots(countries)
+  if snapshots == None or len(snapshots) == 0:
+    return output_file
+
+  histories = getHistoricalDataMulti(countries, '31')
+  image_files = chartMonthlyBatch(histories, LOCAL_FOLDER)
 
-    width, height = A4  # A4用紙のサイズ
-    
-    # 大見出しを表示
-    pdf.drawCentredString(width/2, height - 2*cm, 'COVID-19 レポート')
+  # PDFファイルを生成する
+  timestamp = uniqueTimeStamp()
+  output_file = LOCAL_FOLDER + "/Report-batch-" + str(timestamp) + ".pdf"
+  _registerFont()
+  doc = _BatchDocTemplate(output_file)
 
-    # 作成日時を表示
-    pdf.setFont(FONT_NAME, 16)
-    pdf.drawString(10*cm, height - 3*cm, '作成時刻: ' + datetime)
+  # 表紙: 大見出し、作成日時、目次
+  story = _headerFlowables(datetime)
+  toc = TableOfContents()
+  toc.levelStyles = [TOC_STYLE]
+  story.append(Paragraph('目次', HEADING_STYLE))
+  story.append(toc)
 
-    # 対象国の情報を表として定義する
+  # 国ごとの章
+  for result in snapshots:
+    country = result['country']
     translated = translateCountryName(country) #日本語国名へ変換
     if translated == None:
       translated = country
-  
-    population = '{:,}'.format(int(result['population'])) #人口
-    info_elements = [['国名', '人口'],[translated, population]]
-    info_table = Table(info_elements)
-    info_table.setStyle(TableStyle([
-      ('FONT', (0, 0), (-1, -1), FONT_NAME, 14),
-      ('BOX', (0, 0), (-1, -1), 1, colors.black),
-      ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
-      # 四角の内側に格子状の罫線を引いて、0.25の太さ
-      ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-      # セルの縦文字位置を、TOP/MIDDLE/BOTTOMにする
-      ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-      ('BACKGROUND', (0, 0), (1, 0), '#eeeeff'),
-      ]))
-    # tableを描き出す位置を指定
-    info_table.wrapOn(pdf, 20*mm, height - 50*mm)
-    info_table.drawOn(pdf, 20*mm, height - 50*mm)
-
-    # 感染状況を表示する
-    pdf.setFont(FONT_NAME, 20)
-    pdf.drawString(1*cm, height - 60*mm, '感染状況：')
-    
-    active    = '{:,}'.format(int(result['active']))    # 感染者数
-    critical  = '{:,}'.format(int(result['critical']))  # 重病者数
-    recovered = '{:,}'.format(int(result['recovered'])) # 退院・療養終了
-    cases     = '{:,}'.format(int(result['cases']))     # 感染者累計
-    deaths    = '{:,}'.format(int(result['deaths']))    # 死亡者累計
-    tests     = '{:,}'.format(int(result['tests']))     # 検査数
-
-    status_elements = [['感染者数', active],
-      ['重病者数', critical],
-      ['退院・療養終了', recovered],
-      ['感染者累計', cases],
-      ['死亡者累計', deaths],
-      ['検査数', tests]]
-    status_table = Table(status_elements)
-    status_table.setStyle(TableStyle([
-      ('FONT', (0, 0), (-1, -1), FONT_NAME, 14),
-      ('BOX', (0, 0), (-1, -1), 1, colors.black),
-      ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
-      # 四角の内側に格子状の罫線を引いて、0.25の太さ
-      ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-      # セルの縦文字位置を、TOP/MIDDLE/BOTTOMにする
-      ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-      ('BACKGROUND', (0, 0), (0, 5), '#eeeeff'),
-    ]))
-    # tableを描き出す位置を指定
-    status_table.wrapOn(pdf, 20*mm, height - 115*mm)
-    status_table.drawOn(pdf, 20*mm, height - 115*mm)
-
-    # 感染履歴グラフを表示
-    if image_file != None:
-      pdf.setFont(FONT_NAME, 20)
-      pdf.drawString(10*mm, height - 125*mm, '感染履歴グラフ： ')
-      # 画像を添付する: 1000pt x 800pt
-      pdf.drawInlineImage(image_file, 10*mm, 10*mm, 200*mm, 160*mm) 
-    
-    # 注釈があれば表示する
-    comments = commentGet(country)
-    if comments != None and len(comments) > 0:
-      pdf.showPage() # 改ページ
-      pdf.setFont(FONT_NAME, 20)
-      pdf.drawString(10*mm, height - 2*cm, 'コメント: ')
-
-      comment_elements = [['日時', 'コメント']]
-      for i in range(len(comments)):
-        dt = comments[i][0] # comments[0]は(日時, コメント)のタプルから構成される
-        formatted = dt.strftime("%Y-%m-%d %H:%M:%S")
-        comment_elements.append([formatted, comments[i][1]]) # [日時, 注釈]
-        
-      comment_table = Table(comment_elements, colWidths=(50*mm, 140*mm,), rowHeights=8*mm)
-      comment_table.setStyle(TableStyle([
-        ('FONT', (0, 0), (-1, -1), FONT_NAME, 12),
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('TEXTCOLOR',(0, 0),(1, -1), colors.black),
-        #四角の内側に格子状の罫線を引いて、0.25の太さ
-        ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-        # セルの縦文字位置を、TOP/MIDDLE/BOTTOMにする
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('BACKGROUND', (0, 0), (1, 0), '#eeeeff'),
-      ]))
-      # tableを描き出す位置を指定
-      y_pos = len(comments) * 8 + 30 # 30 means margin (mm)
-      comment_table.wrapOn(pdf, 10*mm, height - y_pos*mm)
-      comment_table.drawOn(pdf, 10*mm, height - y_pos*mm)
-
-    # ドキュメントの内容をPDFファイルとして出力する
-    pdf.save()
+    story.append(PageBreak())
+    story.append(Paragraph(escape(translated), SECTION_STYLE))
+    story.extend(_countryFlowables(translated, result, image_files.get(country)))
+    # 注釈は組版しながらCOMMENT_CHUNK_SIZE件ずつ読み込む（全ての国の注釈をメモリに保持しない）
+    story.append(_CommentStream(lambda country=country: _commentFlowables(commentIterate(country, COMMENT_CHUNK_SIZE))))
+
+  try:
+    doc.multiBuild(story) # 目次の頁番号を確定させるため複数回組版する
     print("[INFO] ", output_file, 'has been saved.')
+  except Exception as e:
+    print(format(e))
+    output_file = None
+
+  # 描画したグラフを削除する
+  for image_file in image_files.values():
+    if os.path.exists(image_file):
+      os.remove(image_file)
 
   return output_file
 
+# ---------- Utilities ----------
+
+#
+# [FUNCTION] _createDocument()
+#
+# [DESCRIPTION]
+#  A4縦のPDFドキュメントを生成する
+# 
+# [INPUTS]
+#  output_file - 出力するPDFファイル名
+# 
+# [OUTPUTS]
+#  SimpleDocTemplateオブジェクト
+#
+def _createDocument(output_file):
+  return SimpleDocTemplate(output_file, **DOCUMENT_OPTIONS)
+
+#
+# [CLASS] _BatchDocTemplate
+#
+# [DESCRIPTION]
+#  国ごとの章見出しを目次に登録するドキュメントテンプレート
+#
+class _BatchDocTemplate(SimpleDocTemplate):
+  def __init__(self, output_file):
+    SimpleDocTemplate.__init__(self, output_file, **DOCUMENT_OPTIONS)
+
+  def afterFlowable(self, flowable):
+    if isinstance(flowable, Paragraph) and flowable.style.name == SECTION_STYLE.name:
+      self.notify('TOCEntry', (0, flowable.getPlainText(), self.page))
+
+#
+# [FUNCTION] _headerFlowables()
+#
+# [DESCRIPTION]
+#  レポートの大見出しと作成日時を表すフローアブルのリストを生成する
+# 
+# [INPUTS]
+#  datetime - 日時
+# 
+# [OUTPUTS]
+#  フローアブルのリスト
+#
+def _headerFlowables(datetime):
+  return [Paragraph('COVID-19 レポート', TITLE_STYLE), Paragraph('作成時刻: ' + datetime, DATETIME_STYLE)]
+
+#
+# [FUNCTION] _countryFlowables()
+#
+# [DESCRIPTION]
+#  国の情報、感染状況、感染履歴グラフを表すフローアブルのリストを生成する
+# 
+# [INPUTS]
+#  translated - 対象となる国名（日本語表記）
+#  result - Webサイトから取得した感染状況（JSON構造）
+#  image_file - PDFファイルに追加する画像ファイル
+# 
+# [OUTPUTS]
+#  フローアブルのリスト
+# 
+# [NOTES]
+# '{:,}'.format() は数値を三桁区切りにする。
+#
+def _countryFlowables(translated, result, image_file):
+  flowables = []
+
+  # 対象国の情報を表として定義する
+  population = '{:,}'.format(int(result['population'])) #人口
+  info_elements = [['国名', '人口'],[translated, population]]
+  info_table = Table(info_elements, hAlign='LEFT')
+  info_table.setStyle(INFO_TABLE_STYLE)
+  flowables.append(Indenter(left=10*mm))
+  flowables.append(info_table)
+  flowables.append(Indenter(left=-10*mm))
+
+  # 感染状況を表示する
+  flowables.append(Paragraph('感染状況：', HEADING_STYLE))
+
+  active    = '{:,}'.format(int(result['active']))    # 感染者数
+  critical  = '{:,}'.format(int(result['critical']))  # 重病者数
+  recovered = '{:,}'.format(int(result['recovered'])) # 退院・療養終了
+  cases     = '{:,}'.format(int(result['cases']))     # 感染者累計
+  deaths    = '{:,}'.format(int(result['deaths']))    # 死亡者累計
+  tests     = '{:,}'.format(int(result['tests']))     # 検査数
+
+  status_elements = [['感染者数', active],
+    ['重病者数', critical],
+    ['退院・療養終了', recovered],
+    ['感染者累計', cases],
+    ['死亡者累計', deaths],
+    ['検査数', tests]]
+  status_table = Table(status_elements, hAlign='LEFT')
+  status_table.setStyle(STATUS_TABLE_STYLE)
+  flowables.append(Indenter(left=10*mm))
+  flowables.append(status_table)
+  flowables.append(Indenter(left=-10*mm))
+
+  # 感染履歴グラフを表示
+  if image_file != None:
+    flowables.append(Paragraph('感染履歴グラフ： ', HEADING_STYLE))
+    # 画像を添付する: 1000pt x 800pt
+    flowables.append(Image(image_file, width=175*mm, height=140*mm))
+
+  return flowables
+
+#
+# [FUNCTION] _commentFlowables()
+#
+# [DESCRIPTION]
+#  注釈を表すフローアブルを少しずつ生成するジェネレーター
+# 
+# [INPUTS]
+#  chunks - (日時, 注釈)のタプルからなるリストを順に返すイテレーター
+# 
+# [OUTPUTS]
+#  フローアブルのリストを順に返す
+#  最初のリストは改ページ、見出し、最初の表を含み、以降は続きの表のみを含む
+# 
+# [NOTES]
+#  注釈は改行して表のセルに収め、表が頁からはみ出すときは行単位で次の頁に送る
+#
+def _commentFlowables(chunks):
+  first = True
+  for comments in chunks:
+    comment_elements = []
+    if first == True:
+      comment_elements.append(['日時', 'コメント'])
+    for comment in comments:
+      dt = comment[0] # commentは(日時, コメント)のタプルから構成される
+      formatted = dt.strftime("%Y-%m-%d %H:%M:%S")
+      comment_elements.append([formatted, Paragraph(escape(comment[1]), COMMENT_STYLE)]) # [日時, 注釈]
+
+    comment_table = Table(comment_elements, colWidths=(50*mm, 140*mm,), repeatRows=(1 if first else 0))
+    comment_table.setStyle(COMMENT_TABLE_STYLE if first else COMMENT_BODY_STYLE)
+    if first == True:
+      first = False
+      yield [PageBreak(), Paragraph('コメント: ', HEADING_STYLE), comment_table]
+    else:
+      yield [comment_table]
+
+#
+# [CLASS] _CommentStream
+#
+# [DESCRIPTION]
+#  注釈のフローアブルを、描画が進むにつれて一つずつ取り出すフローアブル
+#
+# [INPUTS]
+#  chunks - 呼ぶたびに、フローアブルのリストを順に返す新たなイテレーター（_commentFlowables()の結果）を返す関数
+#  generator - 読み込み中のイテレーター（split()が作成する続きのフローアブルに渡す）
+#
+# [NOTES]
+#  次のリストがある間はwrap()で収まらない大きさを返し、split()で「次のリスト + 続き」に分割させる。
+#  ストーリーにはその時点のリストだけが加わるため、メモリに保持されるのは描画中のフローアブルのみとなる。
+#  全て取り出した後は大きさ0のフローアブルとして何も描画しない。
+#  ストーリーに置いたフローアブル自身は読み込みを始めず、分割するたびにchunks()で読み込みを始めた続きを作成する。
+#  そのためmultiBuild()が同じストーリーを複数回組版しても、毎回全ての注釈が加わる。
+#
+class _CommentStream(Flowable):
+  def __init__(self, chunks, generator=None):
+    Flowable.__init__(self)
+    self.chunks = chunks
+    self.generator = generator
+    self._next = None # 次に加えるフローアブルのリスト
+
+  # 次のリストを取り出しておく。なければNone
+  def _peek(self):
+    if self._next == None and self.generator != None:
+      try:
+        self._next = next(self.generator)
+      except StopIteration:
+        self.generator = None
+    return self._next
+
+  def wrap(self, availWidth, availHeight):
+    if self.chunks != None and self.generator == None:
+      return (availWidth, availHeight + 1) # 読み込みを始めるため分割させる
+    if self._peek() == None:
+      return (0, 0)
+    return (availWidth, availHeight + 1)
+
+  def split(self, availWidth, availHeight):
+    # 分割した先頭はその場に収まる必要があるため、大きさ0のSpacerを置く
+    if self.chunks != None and self.generator == None:
+      return [Spacer(0, 0), _CommentStream(None, self.chunks())]
+    flowables = self._peek()
+    if flowables == None:
+      return []
+    self._next = None
+    return [Spacer(0, 0)] + flowables + [self]
+
+  def draw(self):
+    pass
+
+#
+# [FUNCTION] _registerFont()
+#
+# [DESCRIPTION]
+#  日本語フォントをreportlabに登録する
+# 
+# [INPUTS] なし
+# 
+# [OUTPUTS] なし
+# 
+# [NOTES]
+#  TTFファイルの解析には時間がかかるため、プロセスごとに一度だけ登録し、
+#  解析済みのフォントを全てのレポートで共有する
+#
+font_registered = False # フォント登録の有無を初期化する
+def _registerFont():
+  global font_registered # 登録済みのフォントを再利用するためグローバル化
+  if font_registered == False:
+    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
+    font_registered = True
+
 #
 # END OF FILE
 #
\ No newline at end of file
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] covid19_pipeline.py
+#
+# [DESCRIPTION]
+#  感染状況の取得、グラフ・PDF・CSVの作成、Slackへのアップロードをパイプラインのステージとして定義するファイル
+#
+# [NOTES]
+#  パイプラインの入力として次の成果物を与える
+#   country - 対象となる国名
+#   channel - アップロード先のSlackチャネルID
+#   client - SlackのWebClient
+#   respond - 返答用の関数
+#   export_format - 出力形式（exportを作成するときのみ。covid19_export.py参照）
+#
+#  作成できる成果物
+#   context - Covid19Context
+#   card - getCountryInfo()のJSON構造
+#   show_card - cardを返答したらTrue
+#   chart_monthly, chart_full - グラフの画像ファイル（一時ファイル）
+#   pdf - PDFファイル（一時ファイル）
+#   csv - CSV形式の(バッファー, ファイル名)（一時的な成果物）
+#   export - export_formatで指定した形式の(バッファー, ファイル名)（一時的な成果物）
+#   export_all - 全ての国の履歴をexport_formatで指定した形式でまとめたZIPの(バッファー, ファイル名)（一時的な成果物）
+#   upload_chart_monthly, upload_chart_full, upload_pdf, upload_csv, upload_export, upload_export_all - アップロードの結果
+#   upload_bundle - chart_monthly、pdf、csvを一回のfiles_upload_v2()でアップロードした結果
+#
+#  contextとしてCovid19Context(country, share_history=True)を与えると、
+#  chart_monthly、pdf、csvは一回取得した全期間の履歴を共有する
+#
+import os
+from .pipeline import Stage, Pipeline
+from .cache import CACHE
+from .job_queue import JobType, JobQueue
+from .rate_limit import DuplicateGuard, RateLimiter
+from .metrics import Gauge, RENDER_SECONDS, UPLOAD_SECONDS, metricsCacheResult
+from .tracing import traceSpan, KIND_CLIENT
+from .covid19 import getCountryInfo, getCountryNames, Covid19Context
+from .covid19_chart import chartMonthlyConfiguration, chartFullConfiguration
+from .covid19_pdf import pdfGenerateFile
+from .covid19_csv import csvGenerateStream
+from .covid19_export import exportFormats, exportGenerateStream, exportGenerateArchive
+from .current_time import currentTime, uniqueTimeStamp
+from dotenv import load_dotenv
+load_dotenv()
+
+# ファイルを保存するフォルダー名
+LOCAL_FOLDER = os.environ.get("LOCAL_FOLDER")
+# CSVファイルをgzip形式で圧縮するか (true/false)
+CSV_GZIP = os.environ.get("CSV_GZIP") == 'true'
+# 同時に実行するジョブ数の上限
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# 順番待ちにできるジョブ数の上限
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "20"))
+# 描画したグラフをキャッシュに保持する秒数
+CHART_CACHE_TTL = int(os.environ.get("CHART_CACHE_TTL", "3600"))
+# 同じ操作を重複とみなす秒数
+DUPLICATE_WINDOW = float(os.environ.get("DUPLICATE_WINDOW", "10"))
+# 利用者ごと、ワークスペースごとに一分間に実行できるジョブ数
+RATE_LIMIT_USER = int(os.environ.get("RATE_LIMIT_USER", "6"))
+RATE_LIMIT_TEAM = int(os.environ.get("RATE_LIMIT_TEAM", "30"))
+
+# 成果物を作成できなかったときのメッセージ（先に見つかったものを返答する）
+FAILURE_MESSAGES = [
+  ('card', '感染状況を取得できませんでした。'),
+  ('chart_monthly', '画像ファイルは作成できませんでした。'),
+  ('chart_full', '画像ファイルは作成できませんでした。'),
+  ('pdf', 'PDFファイルは作成できませんでした。'),
+  ('csv', 'ファイルを作成できません。'),
+  ('export', 'ファイルを作成できません。'),
+  ('export_all', 'ファイルを作成できません。'),
+  ('upload_chart_monthly', 'ファイルをアップロードできません。'),
+  ('upload_chart_full', 'ファイルをアップロードできません。'),
+  ('upload_pdf', 'ファイルをアップロードできません。'),
+  ('upload_csv', 'ファイルをアップロードできません。'),
+  ('upload_export', 'ファイルをアップロードできません。'),
+  ('upload_export_all', 'ファイルをアップロードできません。'),
+  ('upload_bundle', 'ファイルをアップロードできません。'),
+]
+
+#
+# [FUNCTION] pipelineFailureMessage()
+#
+# [DESCRIPTION]
+#  パイプラインの実行結果から利用者に返答するエラーメッセージを求める
+#
+# [INPUTS]
+#  run - Pipeline.run()の結果
+#
+# [OUTPUTS]
+#  エラーメッセージ。失敗がなければ空文字列
+#
+def pipelineFailureMessage(run):
+  for name, message in FAILURE_MESSAGES:
+    if name in run.failures:
+      if isinstance(run.failures[name], Exception):
+        return 'エラーが発生しました。'
+      return message
+  return ''
+
+# ---------- Stages ----------
+#
+# 各ステージの関数は、Stageで宣言した入力を同じ順序で引数として受け取る
+#
+
+# この操作の間、取得したデータを共有するコンテキスト
+def _stageContext(country):
+  return Covid19Context(country)
+
+# 国の感染状況を表すブロック構造
+def _stageCard(country, context):
+  return getCountryInfo(country, context)
+
+# 感染状況を返答する
+def _stageShowCard(respond, card):
+  respond(card)
+  return True
+
+# 30日間のグラフ
+def _stageChartMonthly(country, context):
+  file_path = LOCAL_FOLDER + "/" + country + "-" + uniqueTimeStamp() + ".png"
+  render = lambda: chartMonthlyConfiguration(country, file_path, context)
+  return _cachedChart('monthly', country, context.history('31'), file_path, render)
+
+# 全期間のグラフ
+def _stageChartFull(country, context):
+  file_path = LOCAL_FOLDER + "/" + country + "-all-" + uniqueTimeStamp() + ".png"
+  render = lambda: chartFullConfiguration(country, file_path, context)
+  return _cachedChart('full', country, context.history('all'), file_path, render)
+
+#
+# [FUNCTION] _cachedChart()
+#
+# [DESCRIPTION]
+#  同じデータから描画したグラフがキャッシュにあればファイルに書き出し、なければ描画してキャッシュに保持する
+#
+# [INPUTS]
+#  kind - グラフの種類
+#  country - 対象となる国名
+#  history - グラフに用いる履歴（最新の日付をキーに含める）
+#  file_path - 画像ファイル名
+#  render - グラフを描画する関数。成功したらTrueを返す
+#
+# [OUTPUTS]
+#  成功: file_path
+#  失敗: None
+#
+def _cachedChart(kind, country, history, file_path, render):
+  if history == None or len(history[0]) == 0:
+    return None
+  key = "chart:" + kind + ":" + country + ":" + str(history[0][-1])
+  data = CACHE.get(key)
+  metricsCacheResult(key, data != None)
+  if data != None:
+    with open(file_path, 'wb') as f:
+      f.write(data)
+    return file_path
+
+  with traceSpan('render chart_' + kind, country=country), RENDER_SECONDS.time('chart_' + kind):
+    status = render()
+  if status != True:
+    return None
+  with open(file_path, 'rb') as f:
+    CACHE.set(key, f.read(), CHART_CACHE_TTL)
+  return file_path
+
+# PDFレポート
+def _stagePdf(country, context, chart_monthly):
+  with traceSpan('render pdf', country=country), RENDER_SECONDS.time('pdf'):
+    return pdfGenerateFile(currentTime(), country, chart_monthly, context)
+
+# 全期間の履歴のCSV（ファイルを保存せずバッファーに書き込む）
+def _stageCsv(country, context):
+  rows = context.historyRows('all')
+  if rows == None:
+    return None
+  with traceSpan('render csv', country=country), RENDER_SECONDS.time('csv'):
+    buffer, filename = csvGenerateStream(country, CSV_GZIP, rows)
+  if buffer == None:
+    return None
+  return (buffer, filename)
+
+# 指定した形式の全期間の履歴（ファイルを保存せずバッファーに書き込む）
+def _stageExport(country, export_format):
+  kind = _exportKind('export', export_format)
+  with traceSpan('render ' + kind, country=country), RENDER_SECONDS.time(kind):
+    buffer, filename = exportGenerateStream(country, export_format, CSV_GZIP)
+  if buffer == None:
+    return None
+  return (buffer, filename)
+
+# 全ての国の全期間の履歴をまとめたZIP
+def _stageExportAll(export_format):
+  countries = getCountryNames()
+  if countries == None:
+    return None
+  kind = _exportKind('export_all', export_format)
+  with traceSpan('render ' + kind, countries=len(countries)), RENDER_SECONDS.time(kind):
+    buffer, filename, count = exportGenerateArchive(countries, export_format)
+  if buffer == None:
+    return None
+  print("[INFO] ", filename, 'に', count, 'ヶ国の履歴を書き込みました')
+  return (buffer, filename)
+
+# 作成時間を記録する種類名（利用者が指定した値をそのままラベルにしない）
+def _exportKind(prefix, export_format):
+  if export_format not in exportFormats():
+    return prefix
+  return prefix + '_' + export_format
+
+#
+# [FUNCTION] _uploadStage()
+#
+# [DESCRIPTION]
+#  成果物のファイルをSlackにアップロードするステージを生成する
+#
+# [INPUTS]
+#  source - アップロードするファイルの成果物名
+#           成果物はファイル名、あるいは(バッファー, ファイル名)のタプル
+#  comment - ファイルに添えるコメント
+#
+# [OUTPUTS]
+#  Stageオブジェクト（名前は upload_<source>）
+#
+def _uploadStage(source, comment):
+  def upload(client, channel, file):
+    with traceSpan('upload ' + source, KIND_CLIENT), UPLOAD_SECONDS.time(source):
+      if isinstance(file, tuple):
+        buffer, filename = file
+        return client.files_upload_v2(
+          channel=channel, # Current Channel ID
+          file=buffer,
+          filename=filename,
+          initial_comment=comment,
+        )
+      return client.files_upload_v2(
+        channel=channel, # Current Channel ID
+        file=file,
+        initial_comment=comment,
+      )
+  return Stage('upload_' + source, ['client', 'channel', source], upload)
+
+# グラフ、PDF、CSVをまとめて一回でアップロードする
+def _stageUploadBundle(client, channel, chart_monthly, pdf, csv):
+  buffer, filename = csv
+  with traceSpan('upload bundle', KIND_CLIENT), UPLOAD_SECONDS.time('bundle'):
+    return client.files_upload_v2(
+      channel=channel, # Current Channel ID
+      file_uploads=[
+        {"file": chart_monthly},
+        {"file": pdf},
+        {"file": buffer, "filename": filename},
+      ],
+      initial_comment="グラフ、PDF、CSVファイルを添付します",
+    )
+
+# レポート作成に用いるパイプライン
+REPORT_PIPELINE = Pipeline([
+  Stage('context', ['country'], _stageContext),
+  Stage('card', ['country', 'context'], _stageCard),
+  Stage('show_card', ['respond', 'card'], _stageShowCard),
+  Stage('chart_monthly', ['country', 'context'], _stageChartMonthly, temporary=True),
+  Stage('chart_full', ['country', 'context'], _stageChartFull, temporary=True),
+  Stage('pdf', ['country', 'context', 'chart_monthly'], _stagePdf, temporary=True),
+  Stage('csv', ['country', 'context'], _stageCsv, temporary=True),
+  Stage('export', ['country', 'export_format'], _stageExport, temporary=True),
+  Stage('export_all', ['export_format'], _stageExportAll, temporary=True),
+  _uploadStage('chart_monthly', "画像ファイルを添付します"),
+  _uploadStage('chart_full', "画像ファイルを添付します"),
+  _uploadStage('pdf', "PDFファイルを添付します"),
+  _uploadStage('csv', "CSVファイルを添付します"),
+  _uploadStage('export', "ファイルを添付します"),
+  _uploadStage('export_all', "全ての国の履歴をまとめたZIPファイルを添付します"),
+  Stage('upload_bundle', ['client', 'channel', 'chart_monthly', 'pdf', 'csv'], _stageUploadBundle),
+])
+
+# 時間のかかる処理を実行するジョブキュー
+#  chart - グラフ（利用者が画面で待っているため優先する）
+#  report - 一国のPDFレポート、グラフ・PDF・CSVの一括出力
+#  export - 一国の履歴のファイル出力
+#  batch - 複数の国のPDFレポート、全ての国の履歴の出力
+REPORT_JOBS = JobQueue([
+  JobType('chart', limit=max(1, JOB_WORKERS // 2), priority=0),
+  JobType('report', limit=max(1, JOB_WORKERS // 2), priority=1),
+  JobType('export', limit=max(1, JOB_WORKERS // 2), priority=1),
+  JobType('batch', limit=1, priority=2),
+], workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING)
+
+# ジョブの待ち行列の長さと実行中のジョブ数を公開する
+Gauge('covid19_job_queue_depth', '順番待ちのジョブ数', REPORT_JOBS.depth)
+Gauge('covid19_jobs_running', '実行中のジョブ数', lambda: {(k,): v for k, v in REPORT_JOBS.running().items()}, ('type',))
+
+# 重複した操作の抑止と実行回数の制限
+#  連続して実行できる回数は一分間の回数の半分まで
+DUPLICATE_GUARD = DuplicateGuard(DUPLICATE_WINDOW)
+USER_RATE_LIMIT = RateLimiter(RATE_LIMIT_USER, max(1, RATE_LIMIT_USER // 2))
+TEAM_RATE_LIMIT = RateLimiter(RATE_LIMIT_TEAM, max(1, RATE_LIMIT_TEAM // 2))
+
+#
+# END OF FILE
+#
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] covid19_sparkline.py
+#
+# [DESCRIPTION]
+#  小さな固定レイアウトのグラフを高速に描画する関数を定義するファイル
+#  matplotlibで描画した背景（見出し、軸ラベル、凡例）と数字の字形を一度だけ作成して再利用し、
+#  データに依存する部分（塗りつぶし、折れ線、目盛り）はNumPy配列へ直接描画してPNGとして保存する。
+#
+# [NOTES]
+#  描画できない場合は例外を送出する。呼び出し側でmatplotlibによる描画に切り替えること。
+#
+import zlib
+import struct
+import numpy as np
+
+import matplotlib
+# バックエンドを指定
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import japanize_matplotlib
+
+# 画像サイズ（ピクセル）
+SPARK_WIDTH  = 720
+SPARK_HEIGHT = 450
+SPARK_DPI    = 100
+# 目盛りに用いる文字
+GLYPH_CHARS = "0123456789,-/"
+GLYPH_SIZE  = 9 # 目盛り文字のフォントサイズ(pt)
+
+# 色 (R, G, B)
+COLOR_LINE = (31, 119, 180)
+COLOR_FILL = (0, 0, 255)
+COLOR_GRID = (176, 176, 176)
+COLOR_TEXT = (0, 0, 0)
+
+#
+# [FUNCTION] sparklineRender()
+#
+# [DESCRIPTION]
+#  日付と値のリストを塗りつぶし付き折れ線グラフとしてPNGファイルに保存する
+#
+# [INPUTS]
+#  title - グラフの見出し
+#  ylabel - 縦軸のラベル
+#  legend - 凡例の文字列
+#  dateL - 日付(datetime.date)のリスト
+#  valueL - 値のリスト
+#  filename - 保存する画像ファイル名(フォルダ名を含む)
+#
+# [OUTPUTS]
+#  成功: True
+#  失敗: 例外を送出する
+#
+# [NOTES]
+#  見出しと軸ラベルの組み合わせごとに背景を一度だけ作成し、以後は複製して用いる。
+#
+def sparklineRender(title, ylabel, legend, dateL, valueL, filename):
+  n = len(valueL)
+  if n < 2 or n != len(dateL):
+    raise ValueError("sparkline requires at least two points")
+
+  background, filled, area = _getBackground(title, ylabel, legend)
+  image = background.copy()
+  x0, y0, x1, y1 = area # 描画領域（左, 上, 右, 下）
+
+  values = np.asarray(valueL, dtype=np.float64)
+  vmin = min(0.0, float(values.min()))
+  vmax = float(values.max())
+  if vmax <= vmin:
+    vmax = vmin + 1.0
+  vmax = vmin + (vmax - vmin) * 1.05 # 上端に余白を設ける
+
+  # データ座標をピクセル座標に変換する
+  xs = x0 + np.arange(n) * (x1 - x0) / (n - 1)
+  ys = y1 - (values - vmin) / (vmax - vmin) * (y1 - y0)
+  baseline = y1 - (0.0 - vmin) / (vmax - vmin) * (y1 - y0)
+
+  # グリッド線と縦軸の目盛り
+  for k in range(5):
+    level = vmin + (vmax - vmin) * k / 4
+    row = int(round(y1 - (level - vmin) / (vmax - vmin) * (y1 - y0)))
+    image[row, x0:x1:4] = COLOR_GRID
+    label = '{:,}'.format(int(round(level)))
+    _drawText(image, label, x0 - 6, row, 'right')
+  for i in range(n):
+    col = int(round(xs[i]))
+    image[y0:y1:4, col] = COLOR_GRID
+    _drawText(image, dateL[i].strftime('%m/%d'), col, y1 + 12, 'center')
+
+  # 線の下を塗りつぶす（半透明）
+  # 塗りつぶし済みの背景から列ごとに線と基準線の間を複製する
+  cols = np.arange(x0, x1 + 1)
+  tops = np.interp(cols, xs, ys)
+  lows = np.rint(np.minimum(tops, baseline)).astype(np.intp)
+  highs = np.rint(np.maximum(tops, baseline)).astype(np.intp) + 1
+  for c, lo, hi in zip(cols.tolist(), lows.tolist(), highs.tolist()):
+    image[lo:hi, c] = filled[lo:hi, c]
+
+  # 折れ線を描く（0.25ピクセル間隔で補間し、2ピクセル幅で打点する）
+  fine_x = np.arange(xs[0], xs[-1], 0.25)
+  fine_y = np.interp(fine_x, xs, ys)
+  px = np.clip(np.round(fine_x).astype(np.intp), 0, SPARK_WIDTH - 2)
+  py = np.clip(np.round(fine_y).astype(np.intp), 0, SPARK_HEIGHT - 2)
+  for dx in (0, 1):
+    for dy in (0, 1):
+      image[py + dy, px + dx] = COLOR_LINE
+
+  _writePNG(filename, image)
+  return True
+
+# ---------- Utilities ----------
+
+#
+# [FUNCTION] _getBackground()
+#
+# [DESCRIPTION]
+#  見出し、軸ラベル、凡例、枠線を描画した背景画像を取得する
+#
+# [INPUTS]
+#  title - グラフの見出し
+#  ylabel - 縦軸のラベル
+#  legend - 凡例の文字列
+#
+# [OUTPUTS]
+#  (背景画像(高さ x 幅 x 3のuint8配列), 塗りつぶし色を合成した背景画像, 描画領域(左, 上, 右, 下))
+#
+# [NOTES]
+#  一度作成した背景はbackgroundsに保持して再利用する
+#
+backgrounds = {} # 背景画像のキャッシュを初期化する
+def _getBackground(title, ylabel, legend):
+  key = (title, ylabel, legend)
+  if key in backgrounds:
+    return backgrounds[key]
+
+  fig = Figure(figsize=(SPARK_WIDTH/SPARK_DPI, SPARK_HEIGHT/SPARK_DPI), dpi=SPARK_DPI)
+  canvas = FigureCanvasAgg(fig)
+  ax = fig.add_axes([0.12, 0.12, 0.84, 0.76])
+  ax.set_title(title, fontsize=18)
+  ax.set_xlabel('日付', fontsize=12, labelpad=18)
+  ax.set_ylabel(ylabel, fontsize=12, labelpad=44)
+  ax.set_xticks([])
+  ax.set_yticks([])
+  ax.fill_between([], [], color="blue", alpha=0.5, label=legend)
+  ax.legend(loc='upper left')
+  canvas.draw()
+
+  image = np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+  # 表示座標（左下原点）を配列座標（左上原点）に変換する
+  bbox = ax.get_window_extent()
+  area = (int(bbox.x0) + 1, SPARK_HEIGHT - int(bbox.y1) + 1,
+          int(bbox.x1) - 1, SPARK_HEIGHT - int(bbox.y0) - 1)
+  # 凡例と重ならないように描画領域の上端を下げる
+  legend_box = ax.get_legend().get_window_extent()
+  area = (area[0], max(area[1], SPARK_HEIGHT - int(legend_box.y0) + 4), area[2], area[3])
+
+  # 塗りつぶし色(不透明度0.5)を合成した背景も作成しておく
+  filled = (image >> 1) + (np.array(COLOR_FILL, dtype=np.uint8) >> 1)
+
+  backgrounds[key] = (image, filled, area)
+  return backgrounds[key]
+
+#
+# [FUNCTION] sparklinePreload()
+#
+# [DESCRIPTION]
+#  数字の字形を作成しておく（HTTPモードでワーカープロセスを起動する前に呼ぶと、全てのワーカーで共有される）
+#
+# [INPUTS] なし
+#
+# [OUTPUTS] なし
+#
+def sparklinePreload():
+  _getGlyphs()
+
+#
+# [FUNCTION] _getGlyphs()
+#
+# [DESCRIPTION]
+#  目盛りに用いる文字の字形（濃度マスク）を作成する
+#
+# [INPUTS] なし
+#
+# [OUTPUTS]
+#  {<文字>: 高さ x 幅の濃度配列(0.0～1.0)}
+#
+# [NOTES]
+#  字形は最初の呼び出しで一度だけ作成する
+#
+glyphs = None # 字形テーブルを初期化する
+def _getGlyphs():
+  global glyphs # 字形テーブルを再利用するためグローバル化
+  if glyphs != None:
+    return glyphs
+
+  size = 24 # 字形を描画する正方形の一辺（ピクセル）
+  table = {}
+  for ch in GLYPH_CHARS:
+    fig = Figure(figsize=(size/SPARK_DPI, size/SPARK_DPI), dpi=SPARK_DPI)
+    canvas = FigureCanvasAgg(fig)
+    fig.text(0.5, 0.5, ch, fontsize=GLYPH_SIZE, ha='center', va='center')
+    canvas.draw()
+    gray = np.asarray(canvas.buffer_rgba())[:, :, 0].astype(np.float64)
+    alpha = 1.0 - gray / 255.0
+    # 文字の左右の空白を取り除く（縦方向は揃えるため残す）
+    used = np.nonzero(alpha.max(axis=0) > 0.05)[0]
+    if len(used) > 0:
+      alpha = alpha[:, used[0]:used[-1] + 1]
+    table[ch] = alpha
+  glyphs = table
+  return glyphs
+
+#
+# [FUNCTION] _drawText()
+#
+# [DESCRIPTION]
+#  字形を画像に合成して文字列を描画する
+#
+# [INPUTS]
+#  image - 描画先の画像
+#  text - 文字列（GLYPH_CHARSに含まれる文字のみ）
+#  x - 基準となる横位置
+#  y - 文字列の縦中央の位置
+#  align - 'left', 'center', 'right'のいずれか
+#
+# [OUTPUTS] なし
+#
+def _drawText(image, text, x, y, align):
+  table = _getGlyphs()
+  parts = [table[ch] for ch in text if ch in table]
+  if len(parts) == 0:
+    return
+  mask = np.concatenate(parts, axis=1)
+  h, w = mask.shape
+  if align == 'right':
+    left = x - w
+  elif align == 'center':
+    left = x - w // 2
+  else:
+    left = x
+  top = y - h // 2
+  # 画像からはみ出す部分を切り落とす
+  r0, c0 = max(top, 0), max(left, 0)
+  r1, c1 = min(top + h, image.shape[0]), min(left + w, image.shape[1])
+  if r0 >= r1 or c0 >= c1:
+    return
+  alpha = mask[r0 - top:r1 - top, c0 - left:c1 - left, None]
+  region = image[r0:r1, c0:c1]
+  region[:] = (region * (1.0 - alpha) + np.array(COLOR_TEXT) * alpha).astype(np.uint8)
+
+#
+# [FUNCTION] _writePNG()
+#
+# [DESCRIPTION]
+#  RGB画像をPNGファイルとして保存する
+#
+# [INPUTS]
+#  filename - 保存するファイル名
+#  image - 高さ x 幅 x 3のuint8配列
+#
+# [OUTPUTS] なし
+#
+def _writePNG(filename, image):
+  height, width, _ = image.shape
+  # 各行の先頭にフィルタ種別(0: None)を付加する
+  raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+  raw[:, 1:] = image.reshape(height, width * 3)
+
+  def chunk(tag, data):
+    body = tag + data
+    return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+  header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0) # 8bit, RGB
+  with open(filename, 'wb') as f:
+    f.write(b'\x89PNG\r\n\x1a\n')
+    f.write(chunk(b'IHDR', header))
+    f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 1)))
+    f.write(chunk(b'IEND', b''))
+
+#
+# END OF FILE
+#
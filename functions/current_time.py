@@ -8,6 +8,7 @@
 # 
 # [NOTES]
 #
+import uuid
 import datetime
 
 #
@@ -46,6 +47,23 @@ def currentTimeStamp():
     formatted = dt.strftime("%Y%m%d%H%M%S")
     return formatted
 
+#
+# [FUNCTION] uniqueTimeStamp()
+#
+# [DESCRIPTION]
+#  現在のタイムスタンプに乱数を加えた、ファイル名に用いる文字列を求める関数
+# 
+# [INPUTS] なし
+# 
+# [OUTPUTS]
+#  YYYYMMDDHH24MISS-<16進数8桁>
+# 
+# [NOTES]
+#  同じ秒に複数のスレッドやプロセスが同じフォルダーにファイルを作成しても、名前が重ならない
+#
+def uniqueTimeStamp():
+    return currentTimeStamp() + "-" + uuid.uuid4().hex[:8]
+
 #
 # [FUNCTION] currentHour()
 #
@@ -8,9 +8,50 @@
 #  HTTP URLにアクセスして値を取得する関数を定義するファイル
 # 
 # [NOTES]
-# 
+#  取得した結果はキャッシュ（cache.py参照）に保持し、有効期限内は同じURLに再びアクセスしない。
+#  エンドポイントごとのサーキットブレーカー（circuit_breaker.py参照）が障害を検知している間はアクセスしない。
 #
+import os
+import time
+import urllib.parse
 import requests
+from .cache import CACHE
+from .metrics import HTTP_SECONDS
+from .circuit_breaker import circuitBreaker
+from .tracing import traceSpan, KIND_CLIENT
+from dotenv import load_dotenv
+load_dotenv()
+
+# 取得した結果を保持する秒数
+HTTP_CACHE_TTL = int(os.environ.get("HTTP_CACHE_TTL", "300"))
+# 取得に失敗したときに返す、最後に取得できた結果を保持する秒数（0のときは保持しない）
+HTTP_STALE_TTL = int(os.environ.get("HTTP_STALE_TTL", str(7 * 24 * 60 * 60)))
+# Webサイトに接続するまで、応答を受け取るまで待つ秒数
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+# Webサイトのベースとなるアドレス（処理時間をエンドポイントごとに集計するために用いる）
+BASE_URL = os.environ.get("BASE_URL")
+# requests.get()の代わりに用いる関数（httpSetTransport()参照）
+_transport = None
+
+#
+# [FUNCTION] httpSetTransport()
+#
+# [DESCRIPTION]
+#  Webサイトにアクセスする関数を置き換える（ベンチマークなど、Webサイトにアクセスせずに動作させるときに用いる）
+#
+# [INPUTS]
+#  transport - URLを引数とし、status_codeとjson()を持つオブジェクトを返す関数。Noneのときはrequests.get()に戻す
+#
+# [OUTPUTS] なし
+#
+# [NOTES]
+#  transportはrequestsと同じ例外（Timeout、ConnectionErrorなど）を送出してよい。
+#  タイムアウトはtransportが扱う（HTTP_CONNECT_TIMEOUT、HTTP_READ_TIMEOUTを参照する）。
+#
+def httpSetTransport(transport):
+    global _transport
+    _transport = transport
 
 #
 # [FUNCTION] httpGet()
@@ -20,29 +61,138 @@ import requests
 # 
 # [INPUTS]
 #  url - 対象となるURL
+#  ttl - 結果をキャッシュに保持する秒数（省略時はHTTP_CACHE_TTL）。0のときはキャッシュを用いない
 # 
 # [OUTPUTS]
 #  対象となるURLに応じたJSON構造が返る。
 #  失敗したら、Noneを返す。
 # 
 # [NOTES]
-# 
+#  失敗した結果は保持しない。
+#  接続できない、応答が遅い（HTTP_CONNECT_TIMEOUT、HTTP_READ_TIMEOUT）、本文がJSONでないときは失敗とする。
+#
+def httpGet(url, ttl=None):
+    if ttl == None:
+        ttl = HTTP_CACHE_TTL
+    if ttl <= 0:
+        return _httpGet(url)
+    return CACHE.getOrLoad("http:" + url, ttl, lambda: _httpGet(url))
+
+#
+# [FUNCTION] httpGetWithFallback()
+#
+# [DESCRIPTION]
+#  httpGet()と同じくJSON値を取得し、取得に失敗したときは最後に取得できた結果（古い値）を返す
+#
+# [INPUTS]
+#  url - 対象となるURL
+#  ttl - 結果をキャッシュに保持する秒数（省略時はHTTP_CACHE_TTL）。0のときはキャッシュも古い値も用いない
+#
+# [OUTPUTS]
+#  (JSON構造, 古い値を取得した時刻（time.time()）)
+#  新たに取得した値あるいは有効期限内のキャッシュを返すときは時刻がNone。
+#  取得に失敗し、古い値もなければ (None, None)
+#
+# [NOTES]
+#  取得した結果はキャッシュに"stale:"で始まるキーでHTTP_STALE_TTL秒保持し、取得に失敗したとき
+#  （サーキットブレーカーがアクセスを止めているときも含む）に古い値として返す。
+#  古い値であることを利用者に示せる、国の感染状況のカード（Covid19Context.snapshotWithFallback()）だけが用いる。
+#  グラフ、PDF、CSVなどはhttpGet()を用い、古い値から作成しない。
 #
-def httpGet(url):
+def httpGetWithFallback(url, ttl=None):
+    if ttl == None:
+        ttl = HTTP_CACHE_TTL
+    if ttl <= 0:
+        return (_httpGet(url), None)
+    data = CACHE.getOrLoad("http:" + url, ttl, lambda: _httpLoad(url))
+    if data != None:
+        return (data, None)
+    stale = CACHE.get("stale:" + url) if HTTP_STALE_TTL > 0 else None
+    if stale == None:
+        return (None, None)
+    return (stale[1], stale[0])
+
+# 取得した結果を古い値としても保持する
+def _httpLoad(url):
+    data = _httpGet(url)
+    if data != None and HTTP_STALE_TTL > 0:
+        CACHE.set("stale:" + url, (time.time(), data), HTTP_STALE_TTL)
+    return data
+
+#
+# [FUNCTION] _httpGet()
+#
+# [DESCRIPTION]
+#  キャッシュを用いずにHTTP URLにアクセスしてJSON値を取得する
+#  サーキットブレーカーがアクセスを止めているときは、すぐにNoneを返す
+#
+def _httpGet(url):
     data = None
+    status = 'timeout'
+    endpoint = httpEndpoint(url)
+    breaker = circuitBreaker(endpoint)
+    if not breaker.allow():
+        HTTP_SECONDS.observe(0, endpoint, 'circuit_open')
+        return None
+    start = time.perf_counter()
 
-    try:
-        result = requests.get(url)
-    except requests.exceptions.ConnectTimeout:
-        print("[TIMEOUT]", url)
-    else:
-        if result.status_code == 200:
-            data = result.json() # JSONに変換する
-        else:
-            print("[STATUS CODE]", result.status_code)
+    with traceSpan('GET ' + endpoint, KIND_CLIENT, **{'http.method': 'GET', 'http.url': url}) as span:
+        try:
+            if _transport == None:
+                result = requests.get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+            else:
+                result = _transport(url)
+            status = str(result.status_code)
+            if result.status_code == 200:
+                data = result.json() # JSONに変換する
+            else:
+                print("[STATUS CODE]", result.status_code)
+        except requests.exceptions.Timeout:
+            print("[TIMEOUT]", url)
+        except ValueError: # 途中で切れた本文など（requestsのJSONDecodeErrorも含む）
+            status = 'invalid'
+            print("[INVALID RESPONSE]", url)
+        except requests.exceptions.RequestException as e:
+            status = 'error'
+            print("[HTTP ERROR]", url, format(e))
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - start, endpoint, status)
+            if span != None:
+                span.set('http.status_code', status)
 
+    # 接続できない、サーバーのエラー、途中で切れた本文を障害とみなす（404などは成功とする）
+    if status in ('timeout', 'error', 'invalid', '429') or status.startswith('5'):
+        breaker.failure()
+    else:
+        breaker.success()
     return data
 
+#
+# [FUNCTION] httpEndpoint()
+#
+# [DESCRIPTION]
+#  処理時間を集計するため、URLから国名などの値を除いたエンドポイント名を求める
+#
+# [INPUTS]
+#  url - 対象となるURL
+#
+# [OUTPUTS]
+#  エンドポイント名 (例: countries/{name}, historical/all)
+#  BASE_URL以外のURLのときはホスト名
+#
+def httpEndpoint(url):
+    if BASE_URL == None or not url.startswith(BASE_URL):
+        return urllib.parse.urlparse(url).netloc
+    path = urllib.parse.urlparse(url[len(BASE_URL):]).path
+    segments = [s for s in path.split('/') if s != '']
+    if len(segments) == 0:
+        return '/'
+    if len(segments) == 1:
+        return segments[0]
+    if segments[1] == 'all':
+        return segments[0] + '/all'
+    return segments[0] + '/{name}'
+
 #
 # END OF FILE
 #
\ No newline at end of file
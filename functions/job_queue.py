@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] job_queue.py
+#
+# [DESCRIPTION]
+#  時間のかかる処理（ジョブ）を種類ごとの同時実行数の上限と優先度に従って実行するキューを定義するファイル
+#
+# [NOTES]
+#  ジョブは共有のワーカースレッドで実行されるため、Boltのリスナーはジョブを登録した時点で戻る。
+#  待ち行列が上限に達したときと、shutdown()を呼んだ後は新たなジョブを受け付けない。
+#  ジョブは登録したときのコンテキスト（contextvars）で実行する（トレースのスパンを引き継ぐ）。
+#
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# [CLASS] JobType
+#
+# [DESCRIPTION]
+#  ジョブの種類
+#
+# [INPUTS]
+#  name - 種類の名前
+#  limit - この種類のジョブを同時に実行する数の上限
+#  priority - 優先度（小さいほど先に実行する）
+#
+class JobType:
+  def __init__(self, name, limit, priority):
+    self.name = name
+    self.limit = limit
+    self.priority = priority
+
+#
+# [CLASS] JobQueue
+#
+# [DESCRIPTION]
+#  ジョブを優先度の順に、種類ごとの上限を超えない範囲で実行する
+#
+# [INPUTS]
+#  types - JobTypeのリスト
+#  workers - 全体で同時に実行するジョブ数の上限
+#  max_pending - 待たせておけるジョブ数の上限
+#  reserved - 最も優先度の高い(priority=0)ジョブのために空けておくワーカー数
+#
+class JobQueue:
+  def __init__(self, types, workers=4, max_pending=20, reserved=1):
+    self.types = {}
+    for job_type in types:
+      self.types[job_type.name] = job_type
+    self.workers = workers
+    self.max_pending = max_pending
+    self.reserved = min(reserved, workers - 1)
+    self._running = {name: 0 for name in self.types} # 種類ごとの実行中のジョブ数
+    self._pending = [] # (優先度, 登録順, 種類, 関数, 引数, 順番を通知したことを表すEvent, 中止したときの関数, コンテキスト) のヒープ
+    self._sequence = itertools.count()
+    self._lock = threading.Condition() # ジョブが終わるたびに通知する
+    self.closed = False
+    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+  #
+  # [METHOD] submit()
+  #
+  # [DESCRIPTION]
+  #  ジョブを登録する
+  #
+  # [INPUTS]
+  #  type_name - ジョブの種類の名前
+  #  function - 実行する関数
+  #  args - functionに渡す引数
+  #  on_wait - すぐに実行できないとき、待ち行列での順番(1から始まる)を引数として呼ばれる関数（省略可）
+  #  on_cancel - 停止するまでに実行を開始できず中止したときに呼ばれる関数（省略可）
+  #
+  # [OUTPUTS]
+  #  すぐに実行を開始したときは0、待たせたときは順番、
+  #  待ち行列が一杯か停止中で受け付けなかったときはNone
+  #
+  # [NOTES]
+  #  待たせたジョブは、on_waitが戻るまで実行を開始しない（順番の通知が開始の後にならない）。
+  #
+  def submit(self, type_name, function, args=(), on_wait=None, on_cancel=None):
+    job_type = self.types[type_name]
+    announced = threading.Event()
+    entry = (job_type.priority, next(self._sequence), type_name, function, args, announced, on_cancel, contextvars.copy_context())
+
+    with self._lock:
+      if self.closed or len(self._pending) >= self.max_pending:
+        return None
+      heapq.heappush(self._pending, entry)
+      self._dispatch()
+      if entry not in self._pending:
+        announced.set()
+        return 0
+      position = self._position(entry)
+
+    try:
+      if on_wait != None:
+        on_wait(position)
+    finally:
+      announced.set()
+    return position
+
+  #
+  # [METHOD] depth()
+  #
+  # [DESCRIPTION]
+  #  待ち行列にあるジョブ数を求める
+  #
+  def depth(self):
+    with self._lock:
+      return len(self._pending)
+
+  #
+  # [METHOD] running()
+  #
+  # [DESCRIPTION]
+  #  種類ごとの実行中のジョブ数を求める
+  #
+  # [OUTPUTS]
+  #  {<種類の名前>: 実行中のジョブ数}
+  #
+  def running(self):
+    with self._lock:
+      return dict(self._running)
+
+  #
+  # [METHOD] shutdown()
+  #
+  # [DESCRIPTION]
+  #  新たなジョブの受け付けを止め、待ち行列のジョブも含めて終わるまで待つ
+  #
+  # [INPUTS]
+  #  timeout - 待つ最大秒数
+  #
+  # [OUTPUTS]
+  #  (中止したジョブ数, 時間内に終わらなかった実行中のジョブ数)
+  #
+  # [NOTES]
+  #  時間内に開始できなかったジョブは待ち行列から取り除き、on_cancelを呼ぶ。
+  #
+  def shutdown(self, timeout):
+    deadline = time.monotonic() + timeout
+    with self._lock:
+      self.closed = True
+      while len(self._pending) > 0 or sum(self._running.values()) > 0:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._lock.wait(remaining)
+      cancelled = self._pending
+      self._pending = []
+      running = sum(self._running.values())
+
+    for entry in cancelled:
+      if entry[6] != None:
+        try:
+          entry[6]()
+        except Exception as e:
+          print("[JOB ERROR]", entry[2], format(e))
+    return len(cancelled), running
+
+  # ---------- 以下はself._lockを獲得した状態で呼ぶ ----------
+
+  # 種類と全体の上限に空きがあるか
+  def _canStart(self, type_name):
+    job_type = self.types[type_name]
+    workers = self.workers
+    if job_type.priority > 0:
+      workers -= self.reserved
+    if sum(self._running.values()) >= workers:
+      return False
+    return self._running[type_name] < job_type.limit
+
+  # 待ち行列の中でentryより先に実行されるジョブ数 + 1
+  def _position(self, entry):
+    return sum(1 for other in self._pending if other[:2] < entry[:2]) + 1
+
+  # ジョブを開始する
+  def _start(self, entry):
+    self._running[entry[2]] += 1
+    self._executor.submit(self._run, entry)
+
+  # 上限に空きのある種類のジョブを優先度の順に開始する
+  def _dispatch(self):
+    waiting = []
+    while len(self._pending) > 0 and sum(self._running.values()) < self.workers:
+      entry = heapq.heappop(self._pending)
+      if self._canStart(entry[2]):
+        self._start(entry)
+      else:
+        waiting.append(entry) # 種類の上限に達しているため後回しにする
+    for entry in waiting:
+      heapq.heappush(self._pending, entry)
+
+  # ---------- ワーカースレッド ----------
+
+  # ジョブを実行し、終わったら次のジョブを開始する
+  def _run(self, entry):
+    _, _, type_name, function, args, announced, _, context = entry
+    try:
+      announced.wait()
+      context.run(function, *args)
+    except Exception as e:
+      print("[JOB ERROR]", type_name, format(e))
+    finally:
+      with self._lock:
+        self._running[type_name] -= 1
+        self._dispatch()
+        self._lock.notify_all()
+
+#
+# END OF FILE
+#
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] metrics.py
+#
+# [DESCRIPTION]
+#  処理時間のヒストグラムや回数を集計し、Prometheusのテキスト形式で公開する関数を定義するファイル
+#
+# [NOTES]
+#  環境変数METRICS_PORTを指定すると、metricsStartServer()でローカルのHTTPサーバーを起動し
+#  http://<METRICS_HOST>:<METRICS_PORT>/metrics で集計結果を返す。
+#
+#  集計はプロセスごとに行う。gunicornで複数のワーカーを起動したときは、ワーカーごとに
+#  METRICS_PORTから順に空いているポートで待ち受ける（gunicorn.conf.py参照）。
+#
+import os
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .tracing import traceSpan, KIND_SERVER
+from .profiling import profileListener
+from dotenv import load_dotenv
+load_dotenv()
+
+# 集計結果を公開するポート番号。0のときは公開しない
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# 待ち受けるアドレス
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# ヒストグラムの区切り（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 登録した集計項目
+_METRICS = []
+_METRICS_LOCK = threading.Lock()
+
+#
+# [CLASS] Histogram
+#
+# [DESCRIPTION]
+#  値（処理時間など）の分布をラベルごとに集計する
+#
+# [INPUTS]
+#  name - 項目名
+#  description - 説明
+#  labels - ラベル名のタプル
+#  buckets - 区切りの値（昇順）
+#
+class Histogram:
+  def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+    self.name = name
+    self.description = description
+    self.labels = labels
+    self.buckets = buckets
+    self._values = {} # {<ラベルの値のタプル>: [区切りごとの件数, 合計, 件数]}
+    self._lock = threading.Lock()
+    metricsRegister(self)
+
+  # 値を一つ記録する
+  def observe(self, value, *label_values):
+    index = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      entry = self._values.get(label_values)
+      if entry == None:
+        entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+      if index < len(self.buckets):
+        entry[0][index] += 1
+      entry[1] += value
+      entry[2] += 1
+
+  # withブロックの処理時間を記録する
+  @contextmanager
+  def time(self, *label_values):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, *label_values)
+
+  # Prometheusのテキスト形式の行を返す
+  def render(self):
+    lines = _header(self, 'histogram')
+    with self._lock:
+      values = sorted((k, list(v[0]), v[1], v[2]) for k, v in self._values.items())
+    for label_values, counts, total, count in values:
+      cumulative = 0
+      for bound, n in zip(self.buckets, counts):
+        cumulative += n
+        lines.append(self.name + '_bucket' + _labels(self.labels + ('le',), label_values + (_number(bound),)) + ' ' + str(cumulative))
+      lines.append(self.name + '_bucket' + _labels(self.labels + ('le',), label_values + ('+Inf',)) + ' ' + str(count))
+      lines.append(self.name + '_sum' + _labels(self.labels, label_values) + ' ' + _number(total))
+      lines.append(self.name + '_count' + _labels(self.labels, label_values) + ' ' + str(count))
+    return lines
+
+#
+# [CLASS] Counter
+#
+# [DESCRIPTION]
+#  回数をラベルごとに集計する
+#
+# [INPUTS]
+#  name - 項目名（_totalで終わる）
+#  description - 説明
+#  labels - ラベル名のタプル
+#
+class Counter:
+  def __init__(self, name, description, labels=()):
+    self.name = name
+    self.description = description
+    self.labels = labels
+    self._values = {}
+    self._lock = threading.Lock()
+    metricsRegister(self)
+
+  # 回数を加える
+  def inc(self, *label_values, amount=1):
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+
+  # {<ラベルの値のタプル>: 回数} を返す
+  def values(self):
+    with self._lock:
+      return dict(self._values)
+
+  # Prometheusのテキスト形式の行を返す
+  def render(self):
+    lines = _header(self, 'counter')
+    for label_values, value in sorted(self.values().items()):
+      lines.append(self.name + _labels(self.labels, label_values) + ' ' + _number(value))
+    return lines
+
+#
+# [CLASS] Gauge
+#
+# [DESCRIPTION]
+#  公開するときに関数を呼んで現在の値（待ち行列の長さなど）を求める
+#
+# [INPUTS]
+#  name - 項目名
+#  description - 説明
+#  function - 現在の値、あるいは{<ラベルの値のタプル>: 値}を返す関数
+#  labels - functionが辞書を返すときのラベル名のタプル
+#
+class Gauge:
+  def __init__(self, name, description, function, labels=()):
+    self.name = name
+    self.description = description
+    self.function = function
+    self.labels = labels
+    metricsRegister(self)
+
+  # Prometheusのテキスト形式の行を返す
+  def render(self):
+    lines = _header(self, 'gauge')
+    try:
+      values = self.function()
+    except Exception as e:
+      print("[METRICS ERROR]", self.name, format(e))
+      return lines
+    if not isinstance(values, dict):
+      values = {(): values}
+    for label_values, value in sorted(values.items()):
+      lines.append(self.name + _labels(self.labels, label_values) + ' ' + _number(value))
+    return lines
+
+#
+# [FUNCTION] metricsRegister()
+#
+# [DESCRIPTION]
+#  公開する集計項目を登録する（Histogram、Counter、Gaugeは作成したときに登録される）
+#
+# [INPUTS]
+#  metric - render()を持つ集計項目
+#
+# [OUTPUTS] なし
+#
+def metricsRegister(metric):
+  with _METRICS_LOCK:
+    _METRICS.append(metric)
+
+#
+# [FUNCTION] metricsListener()
+#
+# [DESCRIPTION]
+#  Boltのリスナー関数の処理時間を記録するデコレーター
+#  リスナー関数の呼び出しを一つのトレースの始まりとして記録し、対象であればプロファイルする（profiling.py参照）
+#
+# [INPUTS]
+#  name - リスナー名（コマンド名、action_idなど）
+#
+# [OUTPUTS]
+#  デコレーター
+#
+# [NOTES]
+#  Boltは元の関数の引数名から渡す引数を決めるため、functools.wraps()で元の関数を参照できるようにする。
+#  ジョブとして実行する処理の時間はcovid19_job_secondsに記録される。
+#
+def metricsListener(name):
+  def decorator(function):
+    @functools.wraps(function)
+    def wrapper(**kwargs):
+      with traceSpan('listener ' + name, KIND_SERVER, root=True, **{'slack.listener': name}), LISTENER_SECONDS.time(name), profileListener(name):
+        return function(**kwargs)
+    return wrapper
+  return decorator
+
+#
+# [FUNCTION] metricsCacheResult()
+#
+# [DESCRIPTION]
+#  キャッシュを参照した結果を記録する
+#
+# [INPUTS]
+#  key - キャッシュのキー（最初の:より前を接頭辞として集計する）
+#  hit - 値が見つかったらTrue
+#
+# [OUTPUTS] なし
+#
+def metricsCacheResult(key, hit):
+  CACHE_REQUESTS.inc(key.split(':', 1)[0], 'hit' if hit else 'miss')
+
+#
+# [FUNCTION] metricsRender()
+#
+# [DESCRIPTION]
+#  登録した全ての集計項目をPrometheusのテキスト形式で出力する
+#
+# [INPUTS] なし
+#
+# [OUTPUTS]
+#  テキスト（文字列）
+#
+def metricsRender():
+  with _METRICS_LOCK:
+    metrics = list(_METRICS)
+  lines = []
+  for metric in metrics:
+    lines.extend(metric.render())
+  return "\n".join(lines) + "\n"
+
+#
+# [FUNCTION] metricsStartServer()
+#
+# [DESCRIPTION]
+#  集計結果を返すHTTPサーバーを別スレッドで起動する
+#
+# [INPUTS]
+#  port - ポート番号（省略時はMETRICS_PORT）。0のときは起動しない
+#  attempts - 使用中のときに順に試すポートの数
+#
+# [OUTPUTS]
+#  待ち受けるポート番号。起動しなかったときはNone
+#
+def metricsStartServer(port=METRICS_PORT, attempts=1):
+  if port <= 0:
+    return None
+  for candidate in range(port, port + attempts):
+    try:
+      server = ThreadingHTTPServer((METRICS_HOST, candidate), _MetricsHandler)
+    except OSError:
+      continue # 他のプロセスが使用している
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print("[METRICS] http://" + METRICS_HOST + ":" + str(candidate) + "/metrics")
+    return candidate
+  print("[METRICS] ポートを使用できません", port)
+  return None
+
+# /metricsへのリクエストに集計結果を返すハンドラー
+class _MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    data = metricsRender().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    pass
+
+# ---------- 集計する項目 ----------
+
+LISTENER_SECONDS = Histogram('covid19_listener_seconds', 'Boltのリスナー関数の処理時間', ('listener',))
+JOB_SECONDS = Histogram('covid19_job_seconds', 'ジョブの処理時間', ('type',))
+JOB_WAIT_SECONDS = Histogram('covid19_job_wait_seconds', 'ジョブを登録してから開始するまでの時間', ('type',))
+HTTP_SECONDS = Histogram('covid19_http_request_seconds', 'WebサイトへのHTTPリクエストの時間', ('endpoint', 'status'))
+SQL_SECONDS = Histogram('covid19_sql_seconds', 'SQL文の実行時間', ('statement',))
+RENDER_SECONDS = Histogram('covid19_render_seconds', 'グラフ、PDF、ファイルの作成時間', ('kind',))
+UPLOAD_SECONDS = Histogram('covid19_upload_seconds', 'Slackへのファイルのアップロード時間', ('kind',))
+CACHE_REQUESTS = Counter('covid19_cache_requests_total', 'キャッシュを参照した回数', ('prefix', 'result'))
+
+# キャッシュのキーの接頭辞ごとのヒット率
+def _cacheHitRatio():
+  totals = {}
+  for (prefix, result), value in CACHE_REQUESTS.values().items():
+    hits, count = totals.get(prefix, (0, 0))
+    totals[prefix] = (hits + (value if result == 'hit' else 0), count + value)
+  return {(prefix,): hits / count for prefix, (hits, count) in totals.items() if count > 0}
+
+Gauge('covid19_cache_hit_ratio', 'キャッシュのヒット率', _cacheHitRatio, ('prefix',))
+
+# ---------- Utilities ----------
+
+# HELPとTYPEの行
+def _header(metric, kind):
+  return ['# HELP ' + metric.name + ' ' + metric.description, '# TYPE ' + metric.name + ' ' + kind]
+
+# {name="value",...} の形式のラベル
+def _labels(names, values):
+  if len(names) == 0:
+    return ''
+  pairs = []
+  for name, value in zip(names, values):
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    pairs.append(name + '="' + value + '"')
+  return '{' + ','.join(pairs) + '}'
+
+# 数値の表記
+def _number(value):
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return repr(value) if isinstance(value, float) else str(value)
+
+#
+# END OF FILE
+#
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] pipeline.py
+#
+# [DESCRIPTION]
+#  入力と出力を宣言した処理（ステージ）を依存関係に従って実行する小さなパイプラインを定義するファイル
+#
+# [NOTES]
+#  各ステージは一つの成果物（ステージ名と同じ名前）を出力する。
+#  互いに依存しないステージはスレッドで並行に実行され、一度作成した成果物はそれを入力とする全てのステージで共有される。
+#  各ステージはrun()を呼んだときのコンテキスト（contextvars）で、トレースのスパンとして実行される。
+#
+import os
+import contextvars
+from .tracing import traceSpan
+from .profiling import profileSection
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#
+# [CLASS] Stage
+#
+# [DESCRIPTION]
+#  パイプラインを構成する一つの処理
+#
+# [INPUTS]
+#  name - ステージ名（出力する成果物の名前）
+#  inputs - 入力とする成果物の名前のリスト。functionには同じ順序で引数として渡される
+#  function - 処理を行う関数。成果物を返す。作成できなかったときはNoneを返す
+#  temporary - Trueのとき成果物を一時的なものとみなし、パイプラインの終了時に破棄する
+#              （ファイル名であれば削除し、(バッファー, ファイル名)であればバッファーを閉じる）
+#
+class Stage:
+  def __init__(self, name, inputs, function, temporary=False):
+    self.name = name
+    self.inputs = inputs
+    self.function = function
+    self.temporary = temporary
+
+#
+# [CLASS] PipelineRun
+#
+# [DESCRIPTION]
+#  パイプラインの実行結果
+#
+# [NOTES]
+#  artifacts - {<成果物の名前>: <成果物>}（実行前に与えた入力を含む）
+#  failures - {<ステージ名>: <例外 あるいは None>}
+#             Noneは成果物を作成できなかったか、入力が揃わずに実行しなかったことを表す
+#
+class PipelineRun:
+  def __init__(self, artifacts, failures):
+    self.artifacts = artifacts
+    self.failures = failures
+
+#
+# [CLASS] Pipeline
+#
+# [DESCRIPTION]
+#  ステージの集合から、指定した成果物を作成するために必要なステージだけを実行する
+#
+# [INPUTS]
+#  stages - Stageのリスト
+#  max_workers - 同時に実行するステージ数の上限
+#
+class Pipeline:
+  def __init__(self, stages, max_workers=4):
+    self.stages = {}
+    for stage in stages:
+      self.stages[stage.name] = stage
+    self.max_workers = max_workers
+
+  #
+  # [METHOD] run()
+  #
+  # [DESCRIPTION]
+  #  指定した成果物を作成する
+  #
+  # [INPUTS]
+  #  targets - 作成する成果物の名前のリスト
+  #  artifacts - 入力となる成果物 {<名前>: <値>}
+  #              作成した成果物はこの辞書に追加されるため、同じ辞書を再び渡すと作成済みの成果物は再利用される
+  #              ただし一時的な成果物（temporary=True）は終了時に破棄して辞書から取り除くため、再利用されない
+  #
+  # [OUTPUTS]
+  #  PipelineRun
+  #
+  def run(self, targets, artifacts):
+    needed = self._resolve(targets, artifacts)
+    failures = {}
+    pending = list(needed)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      while len(pending) > 0 or len(running) > 0:
+        # 入力が揃ったステージを開始する
+        for name in list(pending):
+          stage = self.stages[name]
+          if any(i in failures for i in stage.inputs):
+            failures[name] = None # 入力を作成できなかったため実行しない
+            pending.remove(name)
+          elif all(i in artifacts for i in stage.inputs):
+            args = [artifacts[i] for i in stage.inputs]
+            context = contextvars.copy_context() # ステージごとに複製する（同じコンテキストは同時に実行できない）
+            running[executor.submit(context.run, _runStage, stage, args)] = name
+            pending.remove(name)
+
+        if len(running) == 0:
+          # 入力が与えられていないステージは実行できない
+          for name in pending:
+            failures[name] = None
+          break
+
+        # いずれかのステージが終わるまで待つ
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          name = running.pop(future)
+          try:
+            value = future.result()
+          except Exception as e:
+            print("[PIPELINE ERROR]", name, format(e))
+            failures[name] = e
+            continue
+          if value == None:
+            failures[name] = None
+          else:
+            artifacts[name] = value
+
+    # 一時的な成果物を破棄する
+    for name in needed:
+      if self.stages[name].temporary and name in artifacts:
+        _discard(artifacts.pop(name))
+
+    return PipelineRun(artifacts, failures)
+
+  #
+  # [METHOD] _resolve()
+  #
+  # [DESCRIPTION]
+  #  成果物を作成するために実行が必要なステージ名を依存関係の順に求める
+  #
+  def _resolve(self, targets, artifacts):
+    order = []
+    visiting = set()
+
+    def visit(name):
+      if name in artifacts or name in order:
+        return
+      if name not in self.stages:
+        return # 入力として与えられるべき成果物
+      if name in visiting:
+        raise ValueError("pipeline has a cycle at " + name)
+      visiting.add(name)
+      for i in self.stages[name].inputs:
+        visit(i)
+      visiting.discard(name)
+      order.append(name)
+
+    for target in targets:
+      visit(target)
+    return order
+
+# ---------- Utilities ----------
+
+# ステージの関数をスパンとして実行する（プロファイル中の呼び出しであればこのスレッドもプロファイルする）
+def _runStage(stage, args):
+  with traceSpan('stage ' + stage.name), profileSection():
+    return stage.function(*args)
+
+#
+# [FUNCTION] _discard()
+#
+# [DESCRIPTION]
+#  一時的な成果物を破棄する
+#
+# [INPUTS]
+#  value - ファイル名、あるいは(バッファー, ファイル名)のタプル
+#
+# [OUTPUTS] なし
+#
+def _discard(value):
+  if isinstance(value, tuple):
+    value[0].close()
+  elif isinstance(value, str) and os.path.exists(value):
+    os.remove(value)
+
+#
+# END OF FILE
+#
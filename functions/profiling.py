@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] profiling.py
+#
+# [DESCRIPTION]
+#  指定したリスナー関数の処理をプロファイルし、フレームグラフ用の出力と時間のかかる関数の一覧を保存する関数を定義するファイル
+#
+# [NOTES]
+#  環境変数PROFILE_LISTENERS（カンマ区切りのリスナー名、*は全て）を指定すると、起動時から
+#  それぞれPROFILE_COUNT回の呼び出しをプロファイルする。/covid19 profile コマンドでも指定できる。
+#  指定していないときは、リスナー関数ごとに辞書を一回参照するだけで何もしない。
+#
+#  一回の呼び出し（リスナー関数とそこから登録したジョブ、パイプラインのステージ）ごとに
+#  PROFILE_FOLDERへ次のファイルを保存する。
+#   <時刻>-<リスナー名>.collapsed - 一定間隔で採取したスタック（flamegraph.plやspeedscopeで表示できる）
+#   <時刻>-<リスナー名>.prof - cProfileの結果（pstatsやsnakevizで読み込める）
+#   <時刻>-<リスナー名>.txt - 累積時間の長い関数の一覧
+#
+#  プロファイルする処理はcontextvarsで引き継ぐため、別スレッドで実行するジョブやステージも対象となる。
+#  ジョブが後から開始したときは、終わるたびに同じファイルを更新する。
+#
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from .current_time import uniqueTimeStamp
+from dotenv import load_dotenv
+load_dotenv()
+
+# 起動時からプロファイルするリスナー名（カンマ区切り、*は全て）
+PROFILE_LISTENERS = os.environ.get("PROFILE_LISTENERS", "")
+# リスナーごとにプロファイルする回数
+PROFILE_COUNT = int(os.environ.get("PROFILE_COUNT", "10"))
+# 結果を保存するフォルダー
+PROFILE_FOLDER = os.environ.get("PROFILE_FOLDER", os.path.join(os.environ.get("LOCAL_FOLDER", "."), "profiles"))
+# スタックを採取する間隔（秒）
+PROFILE_INTERVAL = 0.005
+# 一覧に表示する関数の数
+PROFILE_TOP = 30
+
+# {<リスナー名>: 残りの回数}
+_ARMED = {}
+_ARMED_LOCK = threading.Lock()
+# 現在の呼び出しのプロファイル
+_CURRENT = contextvars.ContextVar('profile_session', default=None)
+# 実行中のプロファイル（スタックを採取する対象）
+_SESSIONS = set()
+_SESSIONS_LOCK = threading.Lock()
+_SAMPLER = None
+
+#
+# [CLASS] ProfileSession
+#
+# [DESCRIPTION]
+#  一回の呼び出しのプロファイル
+#
+# [INPUTS]
+#  name - リスナー名
+#
+class ProfileSession:
+  def __init__(self, name):
+    safe = "".join(c if c.isalnum() or c in '-_' else '_' for c in name.lstrip('/'))
+    self.name = name
+    self.path = os.path.join(PROFILE_FOLDER, uniqueTimeStamp() + "-" + safe) # 同じ秒の呼び出しも別のファイルにする
+    self.samples = {} # {<スタック>: 回数}
+    self.threads = set() # プロファイル中のスレッドID
+    self._profiles = []
+    self._lock = threading.Lock()
+
+  #
+  # [METHOD] section()
+  #
+  # [DESCRIPTION]
+  #  現在のスレッドでwithブロックの処理をプロファイルする
+  #  全ての処理が終わったらファイルを保存する
+  #
+  @contextmanager
+  def section(self):
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+    except ValueError:
+      profile = None # 他のプロファイラーが動作している（スタックの採取だけ行う）
+    thread_id = threading.get_ident()
+    with self._lock:
+      self.threads.add(thread_id)
+    _startSampling(self)
+    try:
+      yield
+    finally:
+      if profile != None:
+        profile.disable()
+      with self._lock:
+        self.threads.discard(thread_id)
+        if profile != None:
+          self._profiles.append(profile)
+        finished = len(self.threads) == 0
+      if finished:
+        _stopSampling(self)
+        self.write()
+
+  # 採取したスタックを一つ記録する
+  def record(self, frames):
+    with self._lock:
+      threads = list(self.threads)
+    for thread_id in threads:
+      frame = frames.get(thread_id)
+      if frame == None:
+        continue
+      stack = _collapse(frame)
+      with self._lock:
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+  #
+  # [METHOD] write()
+  #
+  # [DESCRIPTION]
+  #  プロファイルの結果をファイルに保存する
+  #
+  def write(self):
+    with self._lock:
+      samples = dict(self.samples)
+      profiles = list(self._profiles)
+    try:
+      os.makedirs(PROFILE_FOLDER, exist_ok=True)
+      with open(self.path + ".collapsed", 'w', encoding='utf-8') as f:
+        for stack, count in sorted(samples.items()):
+          f.write(stack + " " + str(count) + "\n")
+      if len(profiles) > 0:
+        text = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=text)
+        for profile in profiles[1:]:
+          stats.add(profile)
+        stats.dump_stats(self.path + ".prof")
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        with open(self.path + ".txt", 'w', encoding='utf-8') as f:
+          f.write(self.name + "\n" + text.getvalue())
+    except (OSError, TypeError) as e:
+      print("[PROFILE ERROR]", self.name, format(e))
+      return
+    print("[PROFILE]", self.path)
+
+#
+# [FUNCTION] profileArm()
+#
+# [DESCRIPTION]
+#  指定したリスナーの次のcount回の呼び出しをプロファイルする
+#
+# [INPUTS]
+#  name - リスナー名（*は全て）
+#  count - 回数
+#
+# [OUTPUTS] なし
+#
+def profileArm(name, count):
+  with _ARMED_LOCK:
+    if count > 0:
+      _ARMED[name] = count
+    else:
+      _ARMED.pop(name, None)
+
+#
+# [FUNCTION] profileDisarm()
+#
+# [DESCRIPTION]
+#  全てのリスナーのプロファイルを止める
+#
+def profileDisarm():
+  with _ARMED_LOCK:
+    _ARMED.clear()
+
+#
+# [FUNCTION] profileStatus()
+#
+# [DESCRIPTION]
+#  プロファイルするリスナーと残りの回数を求める
+#
+# [OUTPUTS]
+#  {<リスナー名>: 残りの回数}
+#
+def profileStatus():
+  with _ARMED_LOCK:
+    return dict(_ARMED)
+
+#
+# [FUNCTION] profileListener()
+#
+# [DESCRIPTION]
+#  リスナー関数の呼び出しがプロファイルの対象であれば、withブロックとそこから実行する処理をプロファイルする
+#
+# [INPUTS]
+#  name - リスナー名
+#
+@contextmanager
+def profileListener(name):
+  if len(_ARMED) == 0 or _CURRENT.get() != None:
+    yield
+    return
+  session = _take(name)
+  if session == None:
+    yield
+    return
+
+  token = _CURRENT.set(session)
+  try:
+    with session.section():
+      yield
+  finally:
+    _CURRENT.reset(token)
+
+#
+# [FUNCTION] profileSection()
+#
+# [DESCRIPTION]
+#  プロファイル中の呼び出しから別スレッドで実行する処理（ジョブ、ステージ）をプロファイルする
+#
+@contextmanager
+def profileSection():
+  session = _CURRENT.get()
+  if session == None:
+    yield
+    return
+  with session.section():
+    yield
+
+# ---------- Utilities ----------
+
+# 回数が残っていればプロファイルを始める
+def _take(name):
+  with _ARMED_LOCK:
+    key = name if name in _ARMED else '*' if '*' in _ARMED else None
+    if key == None:
+      return None
+    _ARMED[key] -= 1
+    if _ARMED[key] <= 0:
+      del _ARMED[key]
+  return ProfileSession(name)
+
+# スタックを採取するスレッドを開始する
+def _startSampling(session):
+  global _SAMPLER
+  with _SESSIONS_LOCK:
+    _SESSIONS.add(session)
+    if _SAMPLER == None or not _SAMPLER.is_alive():
+      _SAMPLER = threading.Thread(target=_sampleLoop, name='profile-sampler', daemon=True)
+      _SAMPLER.start()
+
+# 処理が終わったプロファイルのスタックの採取をやめる
+def _stopSampling(session):
+  with _SESSIONS_LOCK:
+    _SESSIONS.discard(session)
+
+# 実行中のプロファイルがある間、一定の間隔でスタックを採取する
+def _sampleLoop():
+  global _SAMPLER
+  while True:
+    with _SESSIONS_LOCK:
+      sessions = list(_SESSIONS)
+      if len(sessions) == 0:
+        _SAMPLER = None
+        return
+    frames = sys._current_frames()
+    for session in sessions:
+      session.record(frames)
+    time.sleep(PROFILE_INTERVAL)
+
+# スタックを 外側;...;内側 の形式の文字列にする
+def _collapse(frame):
+  names = []
+  while frame != None:
+    code = frame.f_code
+    names.append(code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + ")")
+    frame = frame.f_back
+  names.reverse()
+  return ";".join(names)
+
+for name in PROFILE_LISTENERS.split(','):
+  if name.strip() != '':
+    profileArm(name.strip(), PROFILE_COUNT)
+
+#
+# END OF FILE
+#
@@ -8,13 +8,40 @@
 #  環境変数DB_URLが定義されていない場合、すべての関数はNoneを返却する。
 #
 import os
+import time
 import psycopg2
 import urllib.parse
+from .metrics import SQL_SECONDS
+from .tracing import traceSpan, KIND_CLIENT
 from dotenv import load_dotenv
 load_dotenv()
 
 # データベース接続先を取得
 dbUrl = os.environ.get('DB_URL')
+# 接続を待つ秒数、SQL文の実行を打ち切るミリ秒数（0のときは打ち切らない）
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', '10000'))
+# getConnection()の代わりに接続を作成する関数（psqlSetConnector()参照）
+_connector = None
+
+#
+# [FUNCTION] psqlSetConnector()
+#
+# [DESCRIPTION]
+#  データベースへの接続を作成する関数を置き換える（ベンチマークなど、PostgreSQLを用いずに動作させるときに用いる）
+#
+# [INPUTS]
+#  connector - DB-APIの接続オブジェクトを返す関数。Noneのときは環境変数DB_URLに接続する
+#
+# [OUTPUTS] なし
+#
+# [NOTES]
+#  connectorを設定すると、環境変数DB_URLが定義されていなくても各関数はconnectorで接続する。
+#  connectorと接続オブジェクトはpsycopg2と同じ例外（OperationalErrorなど）を送出してよい。
+#
+def psqlSetConnector(connector):
+  global _connector
+  _connector = connector
 
 #
 # [FUNCTION] getConnection()
@@ -28,8 +55,11 @@ dbUrl = os.environ.get('DB_URL')
 #  Connectionオブジェクト
 # 
 # [NOTES]
+#  接続はDB_CONNECT_TIMEOUT秒、SQL文の実行はDB_STATEMENT_TIMEOUTミリ秒で打ち切る
 #
 def getConnection():
+  if _connector != None:
+    return _connector()
   if (dbUrl == None):
     return None
 
@@ -40,7 +70,9 @@ def getConnection():
     user=url.username,
     password=url.password,
     host=url.hostname,
-    port=url.port
+    port=url.port,
+    connect_timeout=DB_CONNECT_TIMEOUT,
+    options='-c statement_timeout=' + str(DB_STATEMENT_TIMEOUT)
   )
   return conn
   
@@ -62,22 +94,74 @@ def getConnection():
 def psqlGet(query):
   results = None
 
-  if (dbUrl == None):
+  if (dbUrl == None and _connector == None):
     return results
   
+  statement = sqlStatement(query)
+  start = time.perf_counter()
+  conn = None
+  with traceSpan('SQL ' + statement, KIND_CLIENT, **{'db.system': 'postgresql'}):
+    try:
+      conn = getConnection()
+      cur = conn.cursor()
+      cur.execute(query)
+      results = cur.fetchall()
+      cur.close()
+    except psycopg2.Error as e:
+      print("[DATABASE ERROR]")
+      print(format(e))
+    finally:
+      if conn != None:
+        conn.close()
+      SQL_SECONDS.observe(time.perf_counter() - start, statement)
+
+  return results
+
+#
+# [FUNCTION] psqlIterate()
+#
+# [DESCRIPTION]
+#  指定したSQL文を実行して、その結果を指定した件数ずつ取得するジェネレーター
+# 
+# [INPUTS]
+#  query - 実行するSQL文
+#  size - 一度に取得するレコード数
+# 
+# [OUTPUTS] 
+#  最大size件のタプルからなるリストを順に返す。
+#  失敗したら、何も返さずに終了する。
+# 
+# [NOTES]
+#  サーバーサイドカーソルを用いるため、結果の全件をメモリに読み込まない
+#
+def psqlIterate(query, size):
+
+  if (dbUrl == None and _connector == None):
+    return
+
+  conn = None
+  start = time.perf_counter()
   try:
     conn = getConnection()
-    cur = conn.cursor()
-    cur.execute(query)
+    cur = conn.cursor(name='psql_iterate') # サーバーサイドカーソル
+    cur.itersize = size
+    # ジェネレーターの中でyieldをまたぐスパンは呼び出し側の処理を子にしてしまうため、実行時だけ記録する
+    with traceSpan('SQL ' + sqlStatement(query), KIND_CLIENT, **{'db.system': 'postgresql'}):
+      cur.execute(query)
+    while True:
+      results = cur.fetchmany(size)
+      if len(results) == 0:
+        break
+      yield results
+    cur.close()
   except psycopg2.Error as e:
     print("[DATABASE ERROR]")
     print(format(e))
-  else:
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-
-  return results
+  finally:
+    if conn != None:
+      conn.close()
+    # 呼び出し側が結果を処理する時間も含まれる
+    SQL_SECONDS.observe(time.perf_counter() - start, sqlStatement(query))
 
 #
 # [FUNCTION] psqlInsert()
@@ -94,18 +178,47 @@ def psqlGet(query):
 #
 def psqlInsert(query):
 
-  if (dbUrl == None):
+  if (dbUrl == None and _connector == None):
     return
   
-  try:
-    conn = getConnection()
-    cur = conn.cursor()
-    cur.execute(query)
-    cur.close()
-    conn.commit()
-    conn.close()
-  except Exception as e:
-    print(format(e))
+  statement = sqlStatement(query)
+  start = time.perf_counter()
+  conn = None
+  with traceSpan('SQL ' + statement, KIND_CLIENT, **{'db.system': 'postgresql'}):
+    try:
+      conn = getConnection()
+      cur = conn.cursor()
+      cur.execute(query)
+      cur.close()
+      conn.commit()
+    except Exception as e:
+      print(format(e))
+    finally:
+      if conn != None:
+        conn.close()
+      SQL_SECONDS.observe(time.perf_counter() - start, statement)
+
+#
+# [FUNCTION] sqlStatement()
+#
+# [DESCRIPTION]
+#  処理時間を集計するため、SQL文から値を除いた文の種類とテーブル名を求める
+#
+# [INPUTS]
+#  query - SQL文
+#
+# [OUTPUTS]
+#  文の種類とテーブル名 (例: SELECT countries, INSERT annotation)
+#
+def sqlStatement(query):
+  words = query.split()
+  if len(words) == 0:
+    return ''
+  statement = words[0].upper()
+  for i in range(1, len(words) - 1):
+    if words[i].upper() in ('FROM', 'INTO', 'UPDATE'):
+      return statement + " " + words[i + 1].lower()
+  return statement
 
 #
 # END OF FILE
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] rate_limit.py
+#
+# [DESCRIPTION]
+#  重複したボタン操作の抑止と、利用者・ワークスペースごとの実行回数の制限を定義するファイル
+#
+# [NOTES]
+#  どちらもプロセス内のメモリに状態を保持する。
+#
+import time
+import threading
+
+# 状態を保持するキーの数がこれを超えたら不要になったものを削除する
+MAX_KEYS = 1024
+
+#
+# [CLASS] DuplicateGuard
+#
+# [DESCRIPTION]
+#  同じ操作（キー）が実行中、あるいは直前に開始されたとき、後から来た操作を重複とみなす
+#
+# [INPUTS]
+#  window - 開始してからこの秒数の間は、終了していても重複とみなす
+#
+class DuplicateGuard:
+  def __init__(self, window):
+    self.window = window
+    self._entries = {} # {<キー>: [開始時刻, 実行中か]}
+    self._lock = threading.Lock()
+
+  #
+  # [METHOD] claim()
+  #
+  # [DESCRIPTION]
+  #  操作の実行を開始してよいか判定し、よければ実行中として記録する
+  #
+  # [INPUTS]
+  #  key - 操作を表すキー（例: (利用者, チャネル, action_id, value)）
+  #
+  # [OUTPUTS]
+  #  開始してよければTrue、重複していればFalse
+  #
+  def claim(self, key):
+    now = time.monotonic()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry != None and (entry[1] == True or now - entry[0] < self.window):
+        return False
+      if len(self._entries) > MAX_KEYS:
+        self._prune(now)
+      self._entries[key] = [now, True]
+      return True
+
+  #
+  # [METHOD] finish()
+  #
+  # [DESCRIPTION]
+  #  操作の実行が終わったことを記録する（開始からwindow秒経つまでは重複とみなし続ける）
+  #
+  def finish(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry != None:
+        entry[1] = False
+
+  #
+  # [METHOD] release()
+  #
+  # [DESCRIPTION]
+  #  実行しなかった操作の記録を取り消す
+  #
+  def release(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  # 終了してwindow秒を過ぎた記録を削除する
+  def _prune(self, now):
+    for key in [k for k, v in self._entries.items() if v[1] == False and now - v[0] >= self.window]:
+      del self._entries[key]
+
+#
+# [CLASS] RateLimiter
+#
+# [DESCRIPTION]
+#  キー（利用者やワークスペース）ごとのトークンバケットで実行回数を制限する
+#
+# [INPUTS]
+#  per_minute - 一分あたりに補充するトークン数
+#  burst - バケットの容量（連続して実行できる回数）
+#
+class RateLimiter:
+  def __init__(self, per_minute, burst):
+    self.rate = per_minute / 60.0
+    self.burst = burst
+    self._buckets = {} # {<キー>: [トークン数, 最後に補充した時刻]}
+    self._lock = threading.Lock()
+
+  #
+  # [METHOD] allow()
+  #
+  # [DESCRIPTION]
+  #  トークンを一つ消費して実行してよいか判定する
+  #
+  # [INPUTS]
+  #  key - 制限の単位となるキー
+  #
+  # [OUTPUTS]
+  #  実行してよければTrue、トークンが足りなければFalse
+  #
+  def allow(self, key):
+    now = time.monotonic()
+    with self._lock:
+      bucket = self._buckets.get(key)
+      if bucket == None:
+        if len(self._buckets) > MAX_KEYS:
+          self._prune(now)
+        bucket = [float(self.burst), now]
+        self._buckets[key] = bucket
+      # 経過時間に応じてトークンを補充する
+      bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+      bucket[1] = now
+      if bucket[0] < 1:
+        return False
+      bucket[0] -= 1
+      return True
+
+  #
+  # [METHOD] refund()
+  #
+  # [DESCRIPTION]
+  #  allow()で消費したトークンを返す（他の制限で実行しなかったときに用いる）
+  #
+  # [INPUTS]
+  #  key - 制限の単位となるキー
+  #
+  def refund(self, key):
+    with self._lock:
+      bucket = self._buckets.get(key)
+      if bucket != None:
+        bucket[0] = min(self.burst, bucket[0] + 1)
+
+  # 満杯まで補充されたバケットを削除する（次に使うときは満杯のバケットとして作り直される）
+  def _prune(self, now):
+    for key in [k for k, v in self._buckets.items() if v[0] + (now - v[1]) * self.rate >= self.burst]:
+      del self._buckets[key]
+
+#
+# END OF FILE
+#
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] shutdown.py
+#
+# [DESCRIPTION]
+#  アプリを停止するとき、実行中のジョブを終えてからキャッシュを保存し、一時ファイルを削除する関数を定義するファイル
+#
+# [NOTES]
+#  SIGTERMあるいはSIGINTを受け取ると停止処理を始める。停止処理の途中でもう一度受け取ったときは直ちに終了する。
+#
+import os
+import sys
+import time
+import signal
+import threading
+from .cache import cacheSaveSnapshot
+from .tracing import traceFlush
+from dotenv import load_dotenv
+load_dotenv()
+
+# 実行中のジョブが終わるのを待つ最大秒数
+SHUTDOWN_TIMEOUT = int(os.environ.get("SHUTDOWN_TIMEOUT", "25"))
+# この秒数より前に作成された一時ファイルは削除する
+TEMP_MAX_AGE = 60 * 60
+# 一時ファイルとみなす拡張子
+TEMP_EXTENSIONS = ('.png', '.pdf', '.csv', '.gz', '.parquet', '.arrow', '.npz', '.zip')
+
+#
+# [FUNCTION] shutdownInstall()
+#
+# [DESCRIPTION]
+#  SIGTERMとSIGINTを受け取ったときにgracefulShutdown()を行い、プロセスを終了するよう設定する
+#
+# [INPUTS]
+#  stop_accepting - 新たなイベントの受け付けを止める関数（Noneのときは呼ばない）
+#  jobs - 終わるのを待つJobQueue
+#  folder - 一時ファイルを保存するフォルダー
+#
+# [OUTPUTS] なし
+#
+# [NOTES]
+#  メインスレッドから呼ぶこと。停止処理は別スレッドで行い、終わったらプロセスを終了する。
+#  一つのプロセスでfolderを使う場合に用いる（終了時にfolderの一時ファイルを全て削除する）。
+#
+def shutdownInstall(stop_accepting, jobs, folder):
+  started = threading.Event()
+
+  def run():
+    gracefulShutdown(stop_accepting, jobs, folder, 0)
+    sys.stdout.flush()
+    os._exit(0) # 時間内に終わらなかったジョブのスレッドを待たない
+
+  def handler(signum, frame):
+    if started.is_set():
+      print("[SHUTDOWN] 直ちに終了します")
+      os._exit(1)
+    started.set()
+    threading.Thread(target=run, name='shutdown').start()
+
+  signal.signal(signal.SIGTERM, handler)
+  signal.signal(signal.SIGINT, handler)
+
+#
+# [FUNCTION] gracefulShutdown()
+#
+# [DESCRIPTION]
+#  新たなイベントとジョブの受け付けを止め、ジョブが終わるのを待ってから、キャッシュを保存して一時ファイルを削除する
+#
+# [INPUTS]
+#  stop_accepting - 新たなイベントの受け付けを止める関数（Noneのときは呼ばない）
+#  jobs - 終わるのを待つJobQueue
+#  folder - 一時ファイルを保存するフォルダー
+#  max_age - この秒数より前に変更された一時ファイルを削除する
+#            （他のプロセスと共有するフォルダーではTEMP_MAX_AGEとし、作成中のファイルを削除しない）
+#  timeout - ジョブが終わるのを待つ最大秒数
+#
+# [OUTPUTS] なし
+#
+def gracefulShutdown(stop_accepting, jobs, folder, max_age=TEMP_MAX_AGE, timeout=SHUTDOWN_TIMEOUT):
+  print("[SHUTDOWN] 停止します。実行中のジョブを最大", timeout, "秒待ちます")
+  if stop_accepting != None:
+    try:
+      stop_accepting()
+    except Exception as e:
+      print(format(e))
+
+  cancelled, running = jobs.shutdown(timeout)
+  if cancelled > 0 or running > 0:
+    print("[SHUTDOWN] 中止したジョブ:", cancelled, "終わらなかったジョブ:", running)
+
+  count = cacheSaveSnapshot()
+  print("[SHUTDOWN] キャッシュを", count, "件保存しました")
+  traceFlush()
+  count = cleanTemporaryFiles(folder, max_age)
+  print("[SHUTDOWN] 一時ファイルを", count, "件削除しました")
+
+#
+# [FUNCTION] cleanTemporaryFiles()
+#
+# [DESCRIPTION]
+#  フォルダーに残った一時ファイル（グラフ、PDF、CSVなど）を削除する
+#
+# [INPUTS]
+#  folder - 一時ファイルを保存するフォルダー
+#  max_age - この秒数より前に変更されたファイルだけを削除する
+#
+# [OUTPUTS]
+#  削除したファイル数
+#
+# [NOTES]
+#  同じフォルダーを他のプロセスが使っているときは、max_ageを作成中のファイルを含まない長さにする。
+#
+def cleanTemporaryFiles(folder, max_age):
+  if folder == None or not os.path.isdir(folder):
+    return 0
+
+  count = 0
+  now = time.time()
+  for name in os.listdir(folder):
+    path = os.path.join(folder, name)
+    if not name.endswith(TEMP_EXTENSIONS) or not os.path.isfile(path):
+      continue
+    try:
+      if now - os.path.getmtime(path) >= max_age:
+        os.remove(path)
+        count += 1
+    except OSError:
+      pass # 他のプロセスが削除した
+  return count
+
+#
+# END OF FILE
+#
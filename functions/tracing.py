@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] tracing.py
+#
+# [DESCRIPTION]
+#  処理の区間（スパン）を記録し、OpenTelemetry（OTLP/JSON）の形式で出力する関数を定義するファイル
+#
+# [NOTES]
+#  環境変数TRACE_PATHを指定するとファイルに一行ずつ追記し、TRACE_ENDPOINTを指定するとコレクターに送信する。
+#  どちらも指定しなければ記録しない（traceSpan()は何もしない）。
+#
+#  Slackからの一回の操作（リスナー関数の呼び出し）を一つのトレースとし、その中で実行した
+#  HTTPリクエスト、SQL文、グラフやPDFの作成、アップロードを子のスパンとして記録する。
+#  現在のスパンはcontextvarsで保持するため、別スレッドで実行する処理には
+#  contextvars.copy_context()で取得したコンテキストを引き継ぐ（job_queue.py、pipeline.py参照）。
+#
+#  記録したスパンは別スレッドでまとめて出力する。ファイルはOpenTelemetry Collectorの
+#  otlpjsonfileレシーバーで読み込める。tools/trace_report.pyで処理時間の内訳を表示できる。
+#
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+import requests
+from dotenv import load_dotenv
+load_dotenv()
+
+# スパンを追記するファイル名
+TRACE_PATH = os.environ.get("TRACE_PATH")
+# スパンを送信するコレクターのアドレス（OTLP/HTTP、例: http://localhost:4318）
+TRACE_ENDPOINT = os.environ.get("TRACE_ENDPOINT")
+# スパンを記録するか
+TRACE_ENABLED = TRACE_PATH != None or TRACE_ENDPOINT != None
+# まとめて出力する間隔（秒）
+TRACE_FLUSH_INTERVAL = 2
+# 一度に出力するスパン数の上限
+TRACE_BATCH_SIZE = 256
+# 出力を待たせておけるスパン数の上限（超えたら破棄する）
+TRACE_MAX_QUEUE = 10000
+# サービス名
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "covid19-slack-py")
+
+# スパンの種類（OpenTelemetryのSpanKind）
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+# 現在のスパン
+_CURRENT = contextvars.ContextVar('trace_span', default=None)
+# 出力を待つスパン
+_QUEUE = queue.Queue(TRACE_MAX_QUEUE)
+_EXPORTER = None
+_EXPORTER_LOCK = threading.Lock()
+_WRITE_LOCK = threading.Lock()
+
+#
+# [CLASS] Span
+#
+# [DESCRIPTION]
+#  処理の区間
+#
+# [INPUTS]
+#  name - スパン名
+#  kind - 種類（KIND_INTERNAL、KIND_SERVER、KIND_CLIENT）
+#  parent - 親のスパン。Noneのときは新たなトレースを始める
+#  attributes - 属性 {<名前>: <値>}
+#
+class Span:
+  def __init__(self, name, kind, parent, attributes):
+    self.name = name
+    self.kind = kind
+    self.trace_id = parent.trace_id if parent != None else '%032x' % random.getrandbits(128)
+    self.span_id = '%016x' % random.getrandbits(64)
+    self.parent_id = parent.span_id if parent != None else None
+    self.attributes = attributes
+    self.start = time.time_ns()
+    self.end = None
+    self.error = None
+
+  # 属性を設定する
+  def set(self, key, value):
+    self.attributes[key] = value
+
+  # OTLP/JSONの形式に変換する
+  def toJson(self):
+    span = {
+      'traceId': self.trace_id,
+      'spanId': self.span_id,
+      'name': self.name,
+      'kind': self.kind,
+      'startTimeUnixNano': str(self.start),
+      'endTimeUnixNano': str(self.end),
+      'attributes': _attributes(self.attributes),
+      'status': {'code': 1} if self.error == None else {'code': 2, 'message': self.error},
+    }
+    if self.parent_id != None:
+      span['parentSpanId'] = self.parent_id
+    return span
+
+#
+# [FUNCTION] traceSpan()
+#
+# [DESCRIPTION]
+#  withブロックの処理をスパンとして記録する
+#
+# [INPUTS]
+#  name - スパン名
+#  kind - 種類（省略時はKIND_INTERNAL）
+#  root - Trueのとき、現在のスパンに関わらず新たなトレースを始める
+#  attributes - 属性
+#
+# [OUTPUTS]
+#  Spanオブジェクト（withのasで受け取る）。記録しないときはNone
+#
+# [NOTES]
+#  ブロック内で例外が発生したときはエラーとして記録し、例外はそのまま送出する。
+#
+@contextmanager
+def traceSpan(name, kind=KIND_INTERNAL, root=False, **attributes):
+  if not TRACE_ENABLED:
+    yield None
+    return
+
+  span = Span(name, kind, None if root else _CURRENT.get(), attributes)
+  token = _CURRENT.set(span)
+  try:
+    yield span
+  except BaseException as e:
+    span.error = type(e).__name__ + ": " + str(e)
+    raise
+  finally:
+    _CURRENT.reset(token)
+    span.end = time.time_ns()
+    _export(span)
+
+#
+# [FUNCTION] traceCurrent()
+#
+# [DESCRIPTION]
+#  現在のスパンを求める
+#
+# [OUTPUTS]
+#  Spanオブジェクト。記録していないときはNone
+#
+def traceCurrent():
+  return _CURRENT.get()
+
+#
+# [FUNCTION] traceFlush()
+#
+# [DESCRIPTION]
+#  出力を待っているスパンを全て出力する
+#
+# [INPUTS] なし
+#
+# [OUTPUTS] なし
+#
+def traceFlush():
+  if not TRACE_ENABLED:
+    return
+  while True:
+    spans = _take(TRACE_BATCH_SIZE)
+    if len(spans) == 0:
+      break
+    _write(spans)
+
+# ---------- 出力 ----------
+
+# 記録したスパンを出力の待ち行列に入れる
+def _export(span):
+  global _EXPORTER
+  if _EXPORTER == None or not _EXPORTER.is_alive(): # forkしたプロセスではスレッドを起動し直す
+    with _EXPORTER_LOCK:
+      if _EXPORTER == None or not _EXPORTER.is_alive():
+        _EXPORTER = threading.Thread(target=_exportLoop, name='trace-export', daemon=True)
+        _EXPORTER.start()
+  try:
+    _QUEUE.put_nowait(span)
+  except queue.Full:
+    pass # 出力が追いつかないときは破棄する
+
+# 待ち行列から最大size個のスパンを取り出す
+def _take(size):
+  spans = []
+  while len(spans) < size:
+    try:
+      spans.append(_QUEUE.get_nowait())
+    except queue.Empty:
+      break
+  return spans
+
+# 一定の間隔でまとめて出力する
+def _exportLoop():
+  while True:
+    time.sleep(TRACE_FLUSH_INTERVAL)
+    traceFlush()
+
+# ファイルへの追記とコレクターへの送信
+def _write(spans):
+  request = {
+    'resourceSpans': [{
+      'resource': {'attributes': _attributes({'service.name': SERVICE_NAME, 'process.pid': os.getpid()})},
+      'scopeSpans': [{
+        'scope': {'name': 'covid19-slack-py'},
+        'spans': [span.toJson() for span in spans],
+      }],
+    }],
+  }
+  data = json.dumps(request, ensure_ascii=False)
+  with _WRITE_LOCK:
+    if TRACE_PATH != None:
+      try:
+        with open(TRACE_PATH, 'a', encoding='utf-8') as f:
+          f.write(data + "\n")
+      except OSError as e:
+        print("[TRACE ERROR]", format(e))
+    if TRACE_ENDPOINT != None:
+      try:
+        requests.post(TRACE_ENDPOINT.rstrip('/') + '/v1/traces', data=data.encode('utf-8'),
+          headers={'Content-Type': 'application/json'}, timeout=5)
+      except requests.exceptions.RequestException as e:
+        print("[TRACE ERROR]", format(e))
+
+# 属性をOTLP/JSONのKeyValueのリストに変換する
+def _attributes(attributes):
+  results = []
+  for key, value in attributes.items():
+    if isinstance(value, bool):
+      results.append({'key': key, 'value': {'boolValue': value}})
+    elif isinstance(value, int):
+      results.append({'key': key, 'value': {'intValue': str(value)}})
+    elif isinstance(value, float):
+      results.append({'key': key, 'value': {'doubleValue': value}})
+    else:
+      results.append({'key': key, 'value': {'stringValue': str(value)}})
+  return results
+
+if TRACE_ENABLED:
+  atexit.register(traceFlush)
+
+#
+# END OF FILE
+#
@@ -0,0 +1,54 @@
+#
+# [FILE] gunicorn.conf.py
+#
+# [DESCRIPTION]
+#  HTTPモードでSlackアプリを複数のワーカープロセスで起動するためのgunicornの設定
+#
+# [NOTES]
+#  起動方法:
+#    SLACK_MODE=http gunicorn -c gunicorn.conf.py wsgi:application
+#
+#  ジョブキュー、重複操作の抑止、実行回数の制限はワーカーごとに働く。
+#  キャッシュをワーカー間で共有するには環境変数CACHE_BACKEND=sqliteとする。
+#
+import os
+
+# 待ち受けるアドレス
+bind = "0.0.0.0:" + os.environ.get("PORT", "3000")
+# ワーカープロセス数
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# ワーカーごとのスレッド数（Boltはack()を返した後の処理を別スレッドで続ける）
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "4"))
+# ワーカーを起動する前にアプリを読み込み、作成済みのキャッシュを全てのワーカーで共有する
+preload_app = True
+# 応答しなくなったワーカーを再起動するまでの秒数
+timeout = 30
+# 停止するとき、ワーカーが実行中のジョブを終えるのを待つ秒数（SHUTDOWN_TIMEOUTより長くする）
+graceful_timeout = int(os.environ.get("SHUTDOWN_TIMEOUT", "25")) + 5
+
+#
+# ワーカープロセスを起動した後に呼ばれる
+#  キャッシュのスナップショットを定期的に保存するスレッドはワーカーごとに開始する
+#  （マスターで開始すると、スレッドがキャッシュのロックを獲得している間にforkすることがあるため）
+#  前回の停止時に残った一時ファイルを削除する（他のワーカーが作成中のファイルを含まないよう古いものだけ）
+#  集計結果はワーカーごとに異なるため、METRICS_PORTから順に空いているポートで公開する
+#  （停止中のワーカーがポートを使っている間に起動することがあるため、ワーカー数の2倍まで試す）
+#
+def post_fork(server, worker):
+  from functions.cache import cacheStartSnapshots
+  from functions.metrics import metricsStartServer
+  from app import local_folder
+  from functions.shutdown import cleanTemporaryFiles, TEMP_MAX_AGE
+  cacheStartSnapshots()
+  cleanTemporaryFiles(local_folder, TEMP_MAX_AGE)
+  metricsStartServer(attempts=workers * 2)
+
+#
+# ワーカープロセスが終了するときに呼ばれる（新たなリクエストの受け付けはgunicornが止めている）
+#  実行中のジョブが終わるのを待ち、キャッシュを保存する。一時ファイルは他のワーカーと共有するため古いものだけ削除する
+#
+def worker_exit(server, worker):
+  from app import REPORT_JOBS, local_folder
+  from functions.shutdown import gracefulShutdown
+  gracefulShutdown(None, REPORT_JOBS, local_folder)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] post_signed.py
+#
+# [DESCRIPTION]
+#  HTTPモードで起動したSlackアプリに、Slackと同じ形式で署名したリクエストを送信するテスト用のスクリプト
+#
+# [NOTES]
+#  使い方:
+#    python tools/post_signed.py command /covid19 Japan
+#    python tools/post_signed.py action action-graph-history Japan
+#
+#  環境変数SLACK_SIGNING_SECRETで署名し、APP_URL（省略時は http://localhost:3000/slack/events）に送信する。
+#  response_urlにはこのスクリプトが待ち受けるローカルのURLを指定し、アプリからの返答を表示する。
+#  ファイルのアップロードは実際のSlackに対して行われる。
+#
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import requests
+from dotenv import load_dotenv
+load_dotenv()
+
+# 送信先のURL
+APP_URL = os.environ.get('APP_URL', 'http://localhost:3000/slack/events')
+# 返答を受け取るポート番号
+RESPONSE_PORT = int(os.environ.get('RESPONSE_PORT', '3001'))
+# 返答を待つ秒数
+WAIT_SECONDS = 30
+
+#
+# [FUNCTION] signedHeaders()
+#
+# [DESCRIPTION]
+#  リクエストの本文に対するSlackの署名ヘッダーを作成する
+#
+# [INPUTS]
+#  secret - Signing Secret
+#  body - リクエストの本文（文字列）
+#
+# [OUTPUTS]
+#  HTTPヘッダー {X-Slack-Request-Timestamp, X-Slack-Signature, Content-Type}
+#
+def signedHeaders(secret, body):
+  timestamp = str(int(time.time()))
+  base = "v0:" + timestamp + ":" + body
+  signature = "v0=" + hmac.new(secret.encode(), base.encode(), hashlib.sha256).hexdigest()
+  return {
+    'X-Slack-Request-Timestamp': timestamp,
+    'X-Slack-Signature': signature,
+    'Content-Type': 'application/x-www-form-urlencoded',
+  }
+
+#
+# [FUNCTION] commandBody()
+#
+# [DESCRIPTION]
+#  スラッシュコマンドのリクエスト本文を作成する
+#
+def commandBody(command, text, response_url):
+  return urllib.parse.urlencode({
+    'command': command,
+    'text': text,
+    'team_id': 'T0TEST',
+    'user_id': 'U0TEST',
+    'user_name': 'tester',
+    'channel_id': os.environ.get('TEST_CHANNEL', 'C0TEST'),
+    'response_url': response_url,
+    'trigger_id': 'trigger.test',
+  })
+
+#
+# [FUNCTION] actionBody()
+#
+# [DESCRIPTION]
+#  ボタン操作（block_actions）のリクエスト本文を作成する
+#
+def actionBody(action_id, value, response_url):
+  payload = {
+    'type': 'block_actions',
+    'team': {'id': 'T0TEST'},
+    'user': {'id': 'U0TEST', 'username': 'tester'},
+    'channel': {'id': os.environ.get('TEST_CHANNEL', 'C0TEST')},
+    'response_url': response_url,
+    'trigger_id': 'trigger.test',
+    'actions': [{'type': 'button', 'action_id': action_id, 'value': value, 'block_id': 'test'}],
+  }
+  return urllib.parse.urlencode({'payload': json.dumps(payload)})
+
+# response_urlへの返答を表示するハンドラー
+class ResponseHandler(BaseHTTPRequestHandler):
+  def do_POST(self):
+    data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    try:
+      print("[RESPONSE]", json.dumps(json.loads(data), ensure_ascii=False))
+    except ValueError:
+      print("[RESPONSE]", data.decode('utf-8'))
+    self.send_response(200)
+    self.end_headers()
+    self.wfile.write(b'ok')
+
+  def log_message(self, format, *args):
+    pass
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3 or sys.argv[1] not in ('command', 'action'):
+    print("使い方: python tools/post_signed.py command <コマンド> <引数> | action <action_id> <値>")
+    sys.exit(1)
+  secret = os.environ.get('SLACK_SIGNING_SECRET')
+  if secret == None:
+    print("[環境変数未設定] SLACK_SIGNING_SECRET")
+    sys.exit(1)
+
+  # 返答を受け取るサーバーを起動する
+  server = HTTPServer(('localhost', RESPONSE_PORT), ResponseHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  response_url = "http://localhost:" + str(RESPONSE_PORT) + "/response"
+
+  argument = " ".join(sys.argv[3:])
+  if sys.argv[1] == 'command':
+    body = commandBody(sys.argv[2], argument, response_url)
+  else:
+    body = actionBody(sys.argv[2], argument, response_url)
+
+  result = requests.post(APP_URL, data=body.encode('utf-8'), headers=signedHeaders(secret, body))
+  print("[STATUS CODE]", result.status_code, result.text)
+
+  # 返答を待つ
+  time.sleep(WAIT_SECONDS)
+  server.shutdown()
+
+#
+# END OF FILE
+#
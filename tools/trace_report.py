@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] trace_report.py
+#
+# [DESCRIPTION]
+#  TRACE_PATHに出力したスパンを読み込み、トレースごとに処理時間の内訳とクリティカルパスを表示するスクリプト
+#
+# [NOTES]
+#  使い方:
+#    python tools/trace_report.py [ファイル名] [表示するトレース数]
+#
+#  ファイル名を省略したときは環境変数TRACE_PATHを用いる。新しいトレースから順に表示する。
+#  各スパンの終了時刻を決めた子のスパン（クリティカルパス）に * を付ける。
+#
+import os
+import sys
+import json
+from dotenv import load_dotenv
+load_dotenv()
+
+# 表示するトレース数
+DEFAULT_TRACES = 10
+
+#
+# [FUNCTION] loadSpans()
+#
+# [DESCRIPTION]
+#  OTLP/JSONの形式で一行ずつ出力したファイルからスパンを読み込む
+#
+# [INPUTS]
+#  path - ファイル名
+#
+# [OUTPUTS]
+#  {<トレースID>: [<スパン>, ...]}
+#
+def loadSpans(path):
+  traces = {}
+  with open(path, encoding='utf-8') as f:
+    for line in f:
+      if line.strip() == '':
+        continue
+      for resource in json.loads(line).get('resourceSpans', []):
+        for scope in resource.get('scopeSpans', []):
+          for span in scope.get('spans', []):
+            span['start'] = int(span['startTimeUnixNano'])
+            span['end'] = int(span['endTimeUnixNano'])
+            traces.setdefault(span['traceId'], []).append(span)
+  return traces
+
+#
+# [FUNCTION] printTrace()
+#
+# [DESCRIPTION]
+#  一つのトレースのスパンを親子関係に従って字下げして表示する
+#
+# [INPUTS]
+#  spans - 同じトレースのスパンのリスト
+#
+# [OUTPUTS] なし
+#
+def printTrace(spans):
+  ids = {span['spanId'] for span in spans}
+  children = {}
+  roots = []
+  for span in spans:
+    parent = span.get('parentSpanId')
+    if parent in ids:
+      children.setdefault(parent, []).append(span)
+    else:
+      roots.append(span) # 親が出力されていないスパンも最上位に表示する
+
+  start = min(span['start'] for span in spans)
+  end = max(span['end'] for span in spans)
+  print("=== trace", spans[0]['traceId'], "%.1f ms" % ((end - start) / 1e6))
+
+  def visit(span, depth, critical):
+    mark = '*' if critical else ' '
+    offset = (span['start'] - start) / 1e6
+    duration = (span['end'] - span['start']) / 1e6
+    error = ' ERROR ' + span['status'].get('message', '') if span.get('status', {}).get('code') == 2 else ''
+    print("%s %8.1f ms  +%8.1f ms  %s%s%s" % (mark, duration, offset, '  ' * depth, span['name'], error))
+    items = sorted(children.get(span['spanId'], []), key=lambda s: s['start'])
+    path = criticalPath(items) if critical else []
+    for child in items:
+      visit(child, depth + 1, any(child is s for s in path))
+
+  path = criticalPath(roots)
+  for root in sorted(roots, key=lambda s: s['start']):
+    visit(root, 0, any(root is s for s in path))
+
+#
+# [FUNCTION] criticalPath()
+#
+# [DESCRIPTION]
+#  兄弟のスパンのうち、全体の終了時刻を決めたものを求める
+#  最後に終わったスパンから、その開始より前に終わったスパンのうち最後のものを順にたどる
+#
+# [INPUTS]
+#  spans - 同じ親を持つスパンのリスト
+#
+# [OUTPUTS]
+#  クリティカルパス上のスパンのリスト
+#
+def criticalPath(spans):
+  path = []
+  limit = None
+  while True:
+    candidates = [s for s in spans if limit == None or s['end'] <= limit]
+    if len(candidates) == 0:
+      return path
+    span = max(candidates, key=lambda s: s['end'])
+    path.append(span)
+    limit = span['start']
+
+if __name__ == "__main__":
+  path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('TRACE_PATH')
+  if path == None:
+    print("使い方: python tools/trace_report.py <ファイル名> [表示するトレース数]")
+    sys.exit(1)
+  count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TRACES
+
+  traces = loadSpans(path)
+  ordered = sorted(traces.values(), key=lambda spans: min(span['start'] for span in spans), reverse=True)
+  for spans in ordered[:count]:
+    printTrace(spans)
+
+#
+# END OF FILE
+#
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# [FILE] wsgi.py
+#
+# [DESCRIPTION]
+#  HTTPモード（環境変数SLACK_MODE=http）でSlackアプリをWSGIサーバーから起動するためのエントリーポイント
+#
+# [NOTES]
+#  gunicornで複数のワーカープロセスを起動する（設定はgunicorn.conf.pyを参照）
+#    gunicorn -c gunicorn.conf.py wsgi:application
+#
+#  preload_appを有効にすると、このファイルはワーカーを起動する前に一度だけ読み込まれる。
+#  ここで作成したキャッシュ（国名の日本語変換表、グラフの字形）は全てのワーカーで共有される。
+#
+from slack_bolt.adapter.wsgi import SlackRequestHandler
+
+from app import app
+from functions.covid19 import translateCountryName
+from functions.covid19_sparkline import sparklinePreload
+
+#
+# [FUNCTION] preload()
+#
+# [DESCRIPTION]
+#  全てのワーカーで共有するキャッシュを作成しておく
+#
+# [INPUTS] なし
+#
+# [OUTPUTS] なし
+#
+def preload():
+  translateCountryName('Japan') # 国名の日本語変換表を作成する
+  sparklinePreload()
+
+preload()
+
+# WSGIアプリケーション（Request URLのパスは /slack/events）
+application = SlackRequestHandler(app)
+
+#
+# END OF FILE
+#